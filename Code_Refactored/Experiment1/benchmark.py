@@ -0,0 +1,193 @@
+"""
+实验一: 串口吞吐量基准测试矩阵
+
+对同一个回环串口 (TX/RX 短接的实际串口，或 pyserial 的 loop:// URL) 依次扫描
+波特率 x 串口格式 (7/8 数据位, N/E/O 校验, 1/2 停止位) x 负载块大小，每一格连续发送 duration 秒，
+统计实际吞吐量、相对理论线路速率的效率、丢失字节和进程 CPU 占用，结果写成 JSON 或 CSV 报告。
+
+理论线路速率 = 波特率 / 每字符比特数 (起始位 + 数据位 + 校验位 + 停止位)，即每秒可传输的负载字节数。
+loop:// 没有物理线路，不限速时测得的是软件上限 (效率可超过 100%)；加 --pace 按线路速率令牌桶发送。
+负载只使用 ASCII 字符，7 位数据位时回环数据不会被截断。
+
+用法:
+    python main.py --bench --port loop:// [--bauds 9600,115200] [--formats all|8N1,7E2]
+                   [--sizes 64,1024] [--duration 2] [--pace] [--out report.json|report.csv]
+"""
+
+import csv
+import json
+import time
+
+from utils import Logger, TokenBucket, bits_per_char, parse_serial_format
+
+DEFAULT_BAUDS = (9600, 115200)
+DEFAULT_SIZES = (64, 1024)
+DEFAULT_DURATION = 2.0
+ALL_FORMATS = tuple(f"{d}{p}{s}" for d in '78' for p in 'NEO' for s in '12')
+DRAIN_IDLE = 0.5  # 发送结束后接收计数停止增长多久视为接收完成 (秒)
+
+# 报告列 (JSON 每行一个对象，CSV 为表头)
+COLUMNS = ('baudrate', 'format', 'payload_size', 'paced', 'duration_s', 'sent_bytes', 'received_bytes',
+           'lost_bytes', 'loss_pct', 'throughput_Bps', 'line_rate_Bps', 'efficiency_pct', 'cpu_pct',
+           'writes', 'reads')
+
+
+def _payload(size):
+    """可识别的 ASCII 负载 (7 位数据位安全)"""
+    pattern = b'0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def _wait_drained(assistant, sent, timeout):
+    """
+    等待回环数据全部收回，或接收计数在 DRAIN_IDLE 内不再增长
+    :return: 最后一次收到数据的时刻 (吞吐量按此计时，不含空等)
+    """
+    deadline = time.time() + timeout
+    last, last_change = assistant.bytes_received, time.time()
+    while assistant.bytes_received < sent and time.time() < deadline:
+        time.sleep(0.01)
+        if assistant.bytes_received != last:
+            last, last_change = assistant.bytes_received, time.time()
+        elif time.time() - last_change > DRAIN_IDLE:
+            break
+    return last_change
+
+
+def run_cell(assistant, port, baudrate, fmt, size, duration=DEFAULT_DURATION, pace=False):
+    """
+    以指定参数重新打开串口并连续发送 duration 秒
+    :return: 报告中的一行 (dict)；串口无法打开时返回 None
+    """
+    bytesize, stopbits, parity, label = parse_serial_format(fmt)
+    if not assistant.open_port(port, baudrate, bytesize=bytesize, stopbits=stopbits, parity=parity):
+        return None
+    try:
+        assistant.test_mode = True
+        assistant.pacer = TokenBucket.for_serial(assistant.ser) if pace else None
+        assistant.bytes_received = 0
+        assistant.read_calls = 0
+        payload = _payload(size)
+        bits = bits_per_char(bytesize, parity, stopbits)
+        line_rate = baudrate / bits
+
+        sent = writes = 0
+        cpu_start, start = time.process_time(), time.time()
+        while time.time() - start < duration:
+            if not assistant.send_data(payload):
+                break
+            sent += size
+            writes += 1
+        # 驱动缓冲中尚未发出的数据按线路速率估算排空时间
+        end = _wait_drained(assistant, sent, max(sent / line_rate - duration, 0) + 2.0)
+        cpu = time.process_time() - cpu_start
+        elapsed = end - start
+
+        received = assistant.bytes_received
+        throughput = received / elapsed if elapsed else 0.0
+        return {
+            'baudrate': baudrate,
+            'format': label,
+            'payload_size': size,
+            'paced': pace,
+            'duration_s': round(elapsed, 3),
+            'sent_bytes': sent,
+            'received_bytes': received,
+            'lost_bytes': max(sent - received, 0),
+            'loss_pct': round(max(sent - received, 0) / sent * 100, 3) if sent else 0.0,
+            'throughput_Bps': round(throughput, 1),
+            'line_rate_Bps': round(line_rate, 1),
+            'efficiency_pct': round(throughput / line_rate * 100, 1),
+            'cpu_pct': round(cpu / elapsed * 100, 1) if elapsed else 0.0,
+            'writes': writes,
+            'reads': assistant.read_calls,
+        }
+    finally:
+        assistant.test_mode = False
+        assistant.pacer = None
+        assistant.close_port(quiet=True)
+
+
+def run_matrix(assistant, port, bauds=DEFAULT_BAUDS, formats=ALL_FORMATS, sizes=DEFAULT_SIZES,
+               duration=DEFAULT_DURATION, pace=False):
+    """依次运行所有组合，返回报告行列表 (打不开的组合跳过)"""
+    total = len(bauds) * len(formats) * len(sizes)
+    Logger.info(f"基准测试: {total} 组 x {duration:g}s (端口 {port})")
+    Logger.console(format_header())
+    rows = []
+    for baudrate in bauds:
+        for fmt in formats:
+            for size in sizes:
+                row = run_cell(assistant, port, baudrate, fmt, size, duration, pace)
+                if row is None:
+                    Logger.warning(f"跳过 {baudrate} {fmt}: 串口无法以该参数打开")
+                    continue
+                rows.append(row)
+                Logger.console(format_row(row))
+    return rows
+
+
+def format_header():
+    return (f"{'Baud':<8} {'Fmt':<5} {'Size':<6} {'Sent':<10} {'Recv':<10} {'Loss%':<7} "
+            f"{'B/s':<11} {'Line B/s':<10} {'Eff%':<7} {'CPU%':<6}")
+
+
+def format_row(row):
+    return (f"{row['baudrate']:<8} {row['format']:<5} {row['payload_size']:<6} {row['sent_bytes']:<10} "
+            f"{row['received_bytes']:<10} {row['loss_pct']:<7} {row['throughput_Bps']:<11} "
+            f"{row['line_rate_Bps']:<10} {row['efficiency_pct']:<7} {row['cpu_pct']:<6}")
+
+
+def write_report(rows, path, meta=None):
+    """按扩展名写出 CSV 或 JSON 报告 (JSON 附带测试参数 meta)"""
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta or {}, 'results': rows}, f, indent=2, ensure_ascii=False)
+    Logger.info(f"报告已写入 {path}")
+
+
+def parse_list(text, kind=int):
+    """逗号分隔的参数列表"""
+    return tuple(kind(v.strip()) for v in str(text).split(',') if v.strip())
+
+
+def parse_formats(text):
+    """'all' 或逗号分隔的格式 (8N1,7E2)，无效格式抛出 ValueError"""
+    if str(text).strip().lower() == 'all':
+        return ALL_FORMATS
+    return tuple(parse_serial_format(f)[3] for f in parse_list(text, str))
+
+
+def make_meta(port, bauds, formats, sizes, duration, pace):
+    """报告中的测试参数"""
+    return {'port': port, 'bauds': bauds, 'formats': formats, 'sizes': sizes,
+            'duration': duration, 'paced': pace, 'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def _arg(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def main(assistant, args):
+    """命令行模式: python main.py --bench --port <端口> [...]"""
+    port = _arg(args, '--port')
+    if not port:
+        print(__doc__)
+        return
+    try:
+        bauds = parse_list(_arg(args, '--bauds', ','.join(map(str, DEFAULT_BAUDS))))
+        formats = parse_formats(_arg(args, '--formats', 'all'))
+        sizes = parse_list(_arg(args, '--sizes', ','.join(map(str, DEFAULT_SIZES))))
+        duration = float(_arg(args, '--duration', DEFAULT_DURATION))
+    except ValueError as e:
+        Logger.error(f"参数错误: {e}")
+        return
+    pace = '--pace' in args
+    meta = make_meta(port, bauds, formats, sizes, duration, pace)
+    rows = run_matrix(assistant, port, bauds, formats, sizes, duration, pace)
+    write_report(rows, _arg(args, '--out', 'bench_report.json'), meta)
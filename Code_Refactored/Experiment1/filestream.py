@@ -0,0 +1,178 @@
+"""
+实验一: 文件流式回环传输
+
+长消息测试把整段数据拼成一个字符串后一次 write，无法用于数兆字节的固件镜像。这里按块发送文件:
+    - 发送: 优先 mmap 映射文件，逐块取 memoryview 切片写串口；无法映射时 readinto 复用同一个块缓冲区
+    - 流水线: 已发送未收回的字节超过 WINDOW 时才等待，写入与接收线程的读取并行进行，
+      同时避免 loop:// 队列或对端 UART 接收缓冲无限堆积
+    - 校验: 收发两端各维护一个按 SEGMENT 分段的累计 CRC32 (StreamCrc)，接收端在接收线程中直接对
+      环形缓冲区切片计算，不复制数据；进度报告时逐段比对，出错可立即发现，不必等传输结束
+整个过程中内存占用只有一个窗口，与文件大小无关
+"""
+
+import mmap
+import os
+import tempfile
+import time
+import zlib
+
+from utils import Logger
+
+CHUNK_SIZE = 4096           # 每次写串口的字节数
+WINDOW = 64 * 1024          # 已发送未收回的字节上限
+SEGMENT_SIZE = 64 * 1024    # 分段校验粒度
+PROGRESS_INTERVAL = 0.5     # 进度报告间隔 (秒)
+STALL_TIMEOUT = 3.0         # 接收计数这么久不增长视为丢失，结束传输
+
+
+class StreamCrc:
+    """按 segment 字节分段的累计 CRC32 (整体 CRC + 每段 CRC)"""
+    def __init__(self, segment=SEGMENT_SIZE):
+        self.segment = segment
+        self.crc = 0
+        self.total = 0
+        self.segments = []   # 已完成各段的 CRC
+        self._seg_crc = 0
+        self._seg_fill = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self.crc = zlib.crc32(view, self.crc)
+        self.total += len(view)
+        while len(view):
+            take = min(len(view), self.segment - self._seg_fill)
+            self._seg_crc = zlib.crc32(view[:take], self._seg_crc)
+            self._seg_fill += take
+            view = view[take:]
+            if self._seg_fill == self.segment:
+                self.segments.append(self._seg_crc)
+                self._seg_crc, self._seg_fill = 0, 0
+
+    def finish(self):
+        """结束: 不足一段的尾部也作为一段"""
+        if self._seg_fill:
+            self.segments.append(self._seg_crc)
+            self._seg_crc, self._seg_fill = 0, 0
+        return self.crc
+
+    def first_mismatch(self, other):
+        """两端已完成的段中第一个 CRC 不一致的段号，全部一致返回 None"""
+        for i, (a, b) in enumerate(zip(self.segments, other.segments)):
+            if a != b:
+                return i
+        return None
+
+
+def file_chunks(path, chunk=CHUNK_SIZE):
+    """
+    按块产出文件内容 (memoryview)，调用方在取下一块前用完当前块
+    优先 mmap (零拷贝)；空文件或不支持映射的文件 (管道、部分特殊文件) 用 readinto 复用同一缓冲区
+    """
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            mm = None
+        if mm is not None:
+            with mm, memoryview(mm) as view:
+                for pos in range(0, len(view), chunk):
+                    part = view[pos:pos + chunk]
+                    try:
+                        yield part
+                    finally:
+                        part.release()  # 关闭映射前必须释放所有切片
+            return
+        buf = bytearray(chunk)
+        with memoryview(buf) as view:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                yield view[:n]
+
+
+def make_test_file(size, chunk=1 << 20):
+    """生成 size 字节的随机测试文件 (分块写入)，返回路径"""
+    fd, path = tempfile.mkstemp(prefix='exp1_stream_', suffix='.bin')
+    with os.fdopen(fd, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            n = min(chunk, remaining)
+            f.write(os.urandom(n))
+            remaining -= n
+    return path
+
+
+def _report_progress(assistant, sent, total, start, tx_crc, rx_crc):
+    elapsed = time.time() - start
+    received = assistant.bytes_received
+    rate = received / elapsed / 1024 if elapsed else 0.0
+    pct = received / total * 100 if total else 100.0
+    Logger.console(f"  进度: {received}/{total} 字节 ({pct:.1f}%)  已发送 {sent}  {rate:.1f} KB/s  "
+          f"已校验 {min(len(tx_crc.segments), len(rx_crc.segments))} 段")
+
+
+def stream_file(assistant, path, chunk=CHUNK_SIZE, window=WINDOW):
+    """
+    以流水线方式回环发送文件并逐段校验
+    :return: 结果字典 (bytes/sent/received/seconds/throughput/crc_tx/crc_rx/ok/bad_segment)
+    """
+    total = os.path.getsize(path)
+    tx_crc, rx_crc = StreamCrc(), StreamCrc()
+    assistant.test_mode = True
+    assistant.bytes_received = 0
+    assistant.ring.sink = rx_crc.update   # 接收线程对每次读入的环形缓冲区切片直接计算 CRC
+    sent, bad = 0, None
+    start = last_report = time.time()
+    try:
+        for part in file_chunks(path, chunk):
+            # 窗口满时等待接收追上 (回环另一端就是本机接收线程)
+            last_rx, last_change = assistant.bytes_received, time.time()
+            while sent - assistant.bytes_received > window:
+                time.sleep(0.001)
+                if assistant.bytes_received != last_rx:
+                    last_rx, last_change = assistant.bytes_received, time.time()
+                elif time.time() - last_change > STALL_TIMEOUT:
+                    raise TimeoutError(f"接收停滞 {STALL_TIMEOUT:g}s，可能发生丢包")
+            tx_crc.update(part)
+            if not assistant.send_data(part):
+                raise IOError("写串口失败")
+            sent += len(part)
+
+            if time.time() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.time()
+                _report_progress(assistant, sent, total, start, tx_crc, rx_crc)
+                bad = tx_crc.first_mismatch(rx_crc)
+                if bad is not None:
+                    Logger.error(f"第 {bad} 段 (偏移 {bad * tx_crc.segment}) CRC 不一致，停止发送")
+                    break
+
+        # 等待剩余数据收回
+        last_rx, last_change = assistant.bytes_received, time.time()
+        while bad is None and assistant.bytes_received < sent and time.time() - last_change < STALL_TIMEOUT:
+            time.sleep(0.01)
+            if assistant.bytes_received != last_rx:
+                last_rx, last_change = assistant.bytes_received, time.time()
+    except (TimeoutError, IOError) as e:
+        Logger.error(f"传输中断: {e}")
+    finally:
+        elapsed = time.time() - start
+        assistant.ring.sink = None
+        assistant.test_mode = False
+
+    tx_crc.finish()
+    rx_crc.finish()
+    if bad is None:
+        bad = tx_crc.first_mismatch(rx_crc)
+    received = assistant.bytes_received
+    return {
+        'bytes': total,
+        'sent': sent,
+        'received': received,
+        'seconds': elapsed,
+        'throughput': received / elapsed if elapsed else 0.0,
+        'crc_tx': tx_crc.crc,
+        'crc_rx': rx_crc.crc,
+        'ok': sent == total and received == total and tx_crc.crc == rx_crc.crc,
+        'bad_segment': bad,
+    }
@@ -1,4 +1,5 @@
 import serial
+import codecs
 import threading
 import time
 import sys
@@ -6,7 +7,74 @@ import os
 
 # 将上级目录加入 sys.path 以便导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_serial_port, create_serial_connection
+from utils import Logger, select_serial_port, create_serial_connection, TokenBucket, load_node_config
+from capture import open_capture, capture_tap, DIR_RX, DIR_TX
+import bert
+import benchmark
+import filestream
+
+RING_SIZE = 64 * 1024   # 接收环形缓冲区大小 (字节)
+
+
+def _direct_fd(ser):
+    """POSIX 本地串口返回文件描述符 (可用 os.readv 直接读入缓冲区)，其它串口 (loop://、Windows 等) 返回 None"""
+    if not hasattr(os, 'readv') or not isinstance(ser, serial.Serial):
+        return None
+    try:
+        return ser.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class RxRing:
+    """
+    预分配的接收环形缓冲区 (单生产者)
+    接收线程把串口数据直接读入 memoryview 切片，不为每次读取分配新的 bytes；
+    written 为累计写入字节数，控制台显示线程按自己的位置追赶，落后超过一圈时丢弃最旧的数据
+    sink: 可选回调，在接收线程中对每次读入的切片调用 (如文件传输的累计 CRC)，不复制数据
+    tap: 抓包回调 (见 capture.py)，调用方式同 sink；回环没有分帧，每次读取记为一条
+    """
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.view = memoryview(bytearray(size))
+        self.written = 0
+        self.ready = threading.Event()
+        self.sink = None
+        self.tap = None
+
+    def fill_from(self, ser, want, fd=None):
+        """
+        从串口读入最多 want 字节 (不跨越环尾)，返回实际字节数
+        :param fd: 有数据等待时直接 os.readv 到缓冲区 (零拷贝)；否则走 pyserial readinto (可阻塞至 timeout)
+        """
+        pos = self.written % self.size
+        chunk = self.view[pos:pos + min(want, self.size - pos)]
+        n = os.readv(fd, [chunk]) if fd is not None else ser.readinto(chunk)
+        if n:
+            sink = self.sink
+            if sink:
+                sink(chunk[:n])
+            if self.tap:
+                self.tap(chunk[:n])
+            self.written += n
+            self.ready.set()
+        return n or 0
+
+    def read_since(self, pos):
+        """
+        取出累计位置 pos 之后的数据 (仅供显示，接收线程可能同时覆盖最旧的部分)
+        :return: (bytes, 新位置, 被覆盖而丢弃的字节数)
+        """
+        end = self.written
+        lost = max(0, end - pos - self.size)
+        pos += lost
+        start, n = pos % self.size, end - pos
+        if start + n <= self.size:
+            data = bytes(self.view[start:start + n])
+        else:
+            data = bytes(self.view[start:]) + bytes(self.view[:start + n - self.size])
+        return data, end, lost
+
 
 class SerialAssistant:
     def __init__(self):
@@ -17,29 +85,44 @@ class SerialAssistant:
         
         # Statistics for rate testing
         self.bytes_received = 0
+        self.read_calls = 0             # 接收读取次数 (bytes_received / read_calls 为平均每次读取字节数)
         self.test_mode = False          # If True, suppress print and just count
+        self.echo = True                # 是否在控制台显示接收内容 (显示在独立线程中解码，不影响计数)
+        self.pacer = None               # TokenBucket: 按线路速率限速发送 (None 表示不限速)
+        self.ring = RxRing()
+        self.console_thread = None
+        self.capture = None             # 抓包环形文件 (--capture，见 capture.py)
+        self.port_name = None
 
-    def open_port(self, port_name, baudrate=9600, timeout=1):
-        """Open serial port using utils"""
-        self.ser = create_serial_connection(port_name, baudrate, timeout=timeout)
+    def open_port(self, port_name, baudrate=9600, timeout=1, **fmt):
+        """Open serial port using utils (fmt: bytesize/stopbits/parity，默认 8N1)"""
+        self.ser = create_serial_connection(port_name, baudrate, timeout=timeout, **fmt)
         if self.ser:
+            self.port_name = port_name
+            self.ring.tap = capture_tap(self.capture, port_name, DIR_RX)
             # Start receive thread automatically
             self.receiving = True
             self.recv_thread = threading.Thread(target=self._receive_worker, daemon=True)
             self.recv_thread.start()
+            self.console_thread = threading.Thread(target=self._console_worker, daemon=True)
+            self.console_thread.start()
             return True
         else:
             return False
 
-    def close_port(self):
+    def close_port(self, quiet=False):
         """Close serial port"""
         self.receiving = False                  
         if self.recv_thread and self.recv_thread.is_alive():
             self.recv_thread.join(timeout=1)   
+        self.ring.ready.set()
+        if self.console_thread and self.console_thread.is_alive():
+            self.console_thread.join(timeout=1)
         
         if self.ser and self.ser.is_open:
             self.ser.close()
-            Logger.info("串口已关闭。")
+            if not quiet:
+                Logger.info("串口已关闭。")
 
     def send_data(self, data):
         """Send data properly encoded"""
@@ -51,7 +134,12 @@ class SerialAssistant:
             if isinstance(data, str):
                 data = data.encode('utf-8')
             
-            self.ser.write(data)
+            if self.pacer:
+                self.pacer.paced_write(self.ser, data)
+            else:
+                self.ser.write(data)
+            if self.capture:
+                self.capture.record(self.port_name, DIR_TX, data)
             # Experiment 1 Req 3: Specific feedback on send success
             if not self.test_mode:
                 Logger.success(f"已发送 {len(data)} 字节。")
@@ -63,39 +151,57 @@ class SerialAssistant:
     def _receive_worker(self):
         """
         Background thread for receiving data.
+        没有数据时阻塞等待 1 字节 (串口 timeout)，有数据时一直读到驱动缓冲为空再等待，
+        数据直接写入预分配的环形缓冲区，这里只计数，不解码
         """
-        while self.receiving and self.ser and self.ser.is_open:
+        ser = self.ser
+        fd = _direct_fd(ser)
+        while self.receiving and ser.is_open:
             try:
-                # Check buffer size
-                if self.ser.in_waiting > 0:         
-                    # Read all available
-                    data = self.ser.read(self.ser.in_waiting)
-                    # Logger.debug(f"从缓冲区接收到 {len(data)} 字节")
-                    self.bytes_received += len(data)
-                    
-                    if not self.test_mode:
-                        try:
-                            decoded = data.decode('utf-8')
-                            print(f"\r[接收] {decoded}")
-                            sys.stdout.flush()
-                        except UnicodeDecodeError:
-                            print(f"\r[接收(Raw)] {data}")
-                            sys.stdout.flush()
-                            
-                time.sleep(0.01) # Small sleep to reduce CPU usage
+                n = self.ring.fill_from(ser, 1)
+                while n:
+                    self.bytes_received += n
+                    self.read_calls += 1
+                    waiting = ser.in_waiting
+                    n = self.ring.fill_from(ser, waiting, fd) if waiting else 0
             except Exception as e:
                 if self.receiving:
                     Logger.error(f"接收出错: {e}")
                 break
 
+    def _console_worker(self):
+        """显示线程: 从环形缓冲区取出新数据并按 UTF-8 增量解码 (多字节字符跨读取边界也能正确显示)"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pos = self.ring.written
+        while self.receiving:
+            self.ring.ready.wait(0.5)
+            self.ring.ready.clear()
+            if self.test_mode or not self.echo:
+                pos = self.ring.written  # 测试模式下跳过显示
+                decoder.reset()
+                continue
+            data, pos, lost = self.ring.read_since(pos)
+            if not data:
+                continue
+            if lost:
+                Logger.warning(f"显示跟不上接收速度，跳过 {lost} 字节")
+                decoder.reset()
+            try:
+                decoded = decoder.decode(data)
+                if decoded:
+                    Logger.console(f"\r[接收] {decoded}")
+            except UnicodeDecodeError:
+                decoder.reset()
+                Logger.console(f"\r[接收(Raw)] {data}")
+
 def run_basic_mode(assistant):
-    print("\n--- 基础聊天模式 (输入 'exit' 退出) ---")
-    print("输入文本进行回环测试:")
+    Logger.console("\n--- 基础聊天模式 (输入 'exit' 退出) ---")
+    Logger.console("输入文本进行回环测试:")
 
     assistant.test_mode = False # Ensure normal output
 
     while True:
-        msg = input(">> ")
+        msg = Logger.input(">> ")
         if msg.lower() == 'exit':
             break
         assistant.send_data(msg)
@@ -104,11 +210,17 @@ def run_basic_mode(assistant):
 def run_rate_test(assistant):
     """Experiment 1 Req 4: Max send rate test"""
     try:
-        print("\n--- 最大发送速率测试 ---")
-        print("正在连续发送数据流 (5秒)...")
+        Logger.console("\n--- 最大发送速率测试 ---")
+        pace = Logger.input("是否按线路速率限速发送 (令牌桶)? (y/N): ").strip().lower() == 'y'
+        if pace:
+            assistant.pacer = TokenBucket.for_serial(assistant.ser)
+            Logger.console(f"线路速率: {assistant.pacer.rate_bytes:.0f} 字节/秒 "
+                  f"({assistant.ser.baudrate} baud, 每字节 {assistant.pacer.bits_per_byte} bit)")
+        Logger.console("正在连续发送数据流 (5秒)...")
         
         assistant.test_mode = True # Suppress printing
         assistant.bytes_received = 0
+        assistant.read_calls = 0
         
         start_time = time.time()
         payload = b'X' * 1024 # 1KB packets
@@ -122,27 +234,32 @@ def run_rate_test(assistant):
             pass
             
         duration = time.time() - start_time
-        print("\n发送完成，正在计算结果...")
+        Logger.console("\n发送完成，正在计算结果...")
         
         # Since it's loopback, we check receiving speed too
         time.sleep(1) 
         
-        print("-" * 30)
-        print(f"耗时: {duration:.2f} s")
-        print(f"总发送: {sent_bytes} 字节")
-        print(f"总接收: {assistant.bytes_received} 字节")
-        print(f"速率: {sent_bytes / duration / 1024:.2f} KB/s")
+        Logger.console("-" * 30)
+        Logger.console(f"耗时: {duration:.2f} s")
+        Logger.console(f"总发送: {sent_bytes} 字节")
+        Logger.console(f"总接收: {assistant.bytes_received} 字节")
+        if assistant.read_calls:
+            Logger.console(f"接收读取: {assistant.read_calls} 次 (平均每次 {assistant.bytes_received / assistant.read_calls:.0f} 字节)")
+        Logger.console(f"速率: {sent_bytes / duration / 1024:.2f} KB/s")
+        if assistant.pacer:
+            Logger.console(f"有效速率: {sent_bytes / duration:.0f} B/s (线路速率 {assistant.pacer.rate_bytes:.0f} B/s)")
         if assistant.bytes_received < sent_bytes:
              Logger.warning("注意: 接收到的数据少于发送的数据，可能发生了缓冲区溢出丢包。")
     finally:
         assistant.test_mode = False
+        assistant.pacer = None
 
 def run_long_message_test(assistant):
     """Experiment 1 Req 4: Long message test"""
     try:
-        print("\n--- 长消息 (分包/粘包) 测试 ---")
+        Logger.console("\n--- 长消息 (分包/粘包) 测试 ---")
         length = 10000 # 10KB message
-        print(f"生成 {length} 字节的文本数据...")
+        Logger.console(f"生成 {length} 字节的文本数据...")
         
         # Create a long identifiable string
         long_msg = "START" + "1234567890" * (length // 10) + "END"
@@ -150,11 +267,11 @@ def run_long_message_test(assistant):
         assistant.test_mode = True # Use clean output mode
         assistant.bytes_received = 0
         
-        print("开始发送...")
+        Logger.console("开始发送...")
         start_time = time.time()
         assistant.send_data(long_msg)
         
-        print("等待接收完成...")
+        Logger.console("等待接收完成...")
         timeout = 10 
         last_bytes = 0
         while assistant.bytes_received < len(long_msg) and timeout > 0:
@@ -162,10 +279,10 @@ def run_long_message_test(assistant):
             timeout -= 0.5
             if assistant.bytes_received > last_bytes:
                 progress = (assistant.bytes_received / len(long_msg)) * 100
-                print(f"  进度: {assistant.bytes_received}/{len(long_msg)} ({progress:.1f}%)")
+                Logger.console(f"  进度: {assistant.bytes_received}/{len(long_msg)} ({progress:.1f}%)")
                 last_bytes = assistant.bytes_received
             
-        print(f"完成。接收字节数: {assistant.bytes_received}")
+        Logger.console(f"完成。接收字节数: {assistant.bytes_received}")
         
         if assistant.bytes_received == len(long_msg):
             Logger.success("完整接收到所有数据。")
@@ -174,8 +291,121 @@ def run_long_message_test(assistant):
     finally:
         assistant.test_mode = False
 
+def run_benchmark(assistant, port_name):
+    """吞吐量基准测试矩阵 (见 benchmark.py)，测试期间按各组参数重新打开串口，结束后恢复原设置"""
+    Logger.console("\n--- 吞吐量基准测试矩阵 ---")
+    baudrate = assistant.ser.baudrate
+    try:
+        bauds = benchmark.parse_list(Logger.input(f"波特率列表 (默认 {','.join(map(str, benchmark.DEFAULT_BAUDS))}): ").strip()
+                                     or ','.join(map(str, benchmark.DEFAULT_BAUDS)))
+        formats = benchmark.parse_formats(Logger.input("串口格式 (all 或 8N1,7E2，默认 all): ").strip() or 'all')
+        sizes = benchmark.parse_list(Logger.input(f"负载块大小 (默认 {','.join(map(str, benchmark.DEFAULT_SIZES))}): ").strip()
+                                     or ','.join(map(str, benchmark.DEFAULT_SIZES)))
+        duration = float(Logger.input(f"每组时长秒数 (默认 {benchmark.DEFAULT_DURATION:g}): ").strip() or benchmark.DEFAULT_DURATION)
+    except ValueError as e:
+        Logger.error(f"输入无效: {e}")
+        return
+    pace = Logger.input("是否按线路速率限速发送 (令牌桶)? (y/N): ").strip().lower() == 'y'
+    out = Logger.input("报告文件 (.json/.csv，默认 bench_report.json): ").strip() or 'bench_report.json'
+
+    meta = benchmark.make_meta(port_name, bauds, formats, sizes, duration, pace)
+    assistant.close_port(quiet=True)
+    try:
+        rows = benchmark.run_matrix(assistant, port_name, bauds, formats, sizes, duration, pace)
+        benchmark.write_report(rows, out, meta)
+    finally:
+        assistant.open_port(port_name, baudrate)
+
+def run_file_stream_test(assistant):
+    """文件流式传输测试: mmap 分块发送 + 接收线程累计 CRC 逐段校验 (见 filestream.py)"""
+    Logger.console("\n--- 文件流式传输测试 ---")
+    path = Logger.input("文件路径 (留空则生成 1 MB 随机测试文件): ").strip()
+    temp = None
+    if not path:
+        path = temp = filestream.make_test_file(1 << 20)
+    elif not os.path.isfile(path):
+        Logger.error(f"文件不存在: {path}")
+        return
+    try:
+        Logger.info(f"开始发送 {path} ({os.path.getsize(path)} 字节)...")
+        result = filestream.stream_file(assistant, path)
+    finally:
+        if temp:
+            os.remove(temp)
+
+    Logger.console("-" * 30)
+    Logger.console(f"耗时: {result['seconds']:.2f} s")
+    Logger.console(f"文件: {result['bytes']} 字节, 发送 {result['sent']}, 接收 {result['received']}")
+    Logger.console(f"吞吐量: {result['throughput'] / 1024:.2f} KB/s")
+    Logger.console(f"CRC32: 发送 {result['crc_tx']:08X} / 接收 {result['crc_rx']:08X}")
+    if result['ok']:
+        Logger.success("文件完整回环，校验一致。")
+    elif result['bad_segment'] is not None:
+        seg = result['bad_segment']
+        Logger.warning(f"数据损坏: 第 {seg} 段 (偏移 {seg * filestream.SEGMENT_SIZE}) 起校验不一致。")
+    else:
+        Logger.warning(f"数据不完整: 丢失 {result['sent'] - result['received']} 字节。")
+
+def run_ber_test(assistant):
+    """误码率测试: 满速发送测试图样，接收线程逐块与期望图样比对 (见 bert.py)"""
+    Logger.console("\n--- 误码率测试 (BERT) ---")
+    pattern = Logger.input(f"测试图样 ({'/'.join(bert.PATTERN_NAMES)}，默认 {bert.DEFAULT_PATTERN}): ").strip().upper()
+    try:
+        checker = bert.StreamChecker(pattern or bert.DEFAULT_PATTERN)
+        duration = float(Logger.input("测试时长秒数 (默认 5): ").strip() or 5)
+    except ValueError as e:
+        Logger.error(f"输入无效: {e}")
+        return
+
+    chunk = 4096
+    assistant.test_mode = True
+    assistant.bytes_received = 0
+    assistant.ring.sink = checker.feed
+    sent = 0
+    try:
+        start = time.time()
+        while time.time() - start < duration:
+            # 在途数据不超过一个窗口，接收线程跟得上时就是满速
+            while sent - assistant.bytes_received > filestream.WINDOW and time.time() - start < duration + 2:
+                time.sleep(0.001)
+            if not assistant.send_data(bert.pattern_chunk(checker.pattern, sent, chunk)):
+                break
+            sent += chunk
+        deadline = time.time() + 2
+        while assistant.bytes_received < sent and time.time() < deadline:
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        assistant.ring.sink = None
+        assistant.test_mode = False
+
+    stats = checker.finish()
+    Logger.console("-" * 30)
+    Logger.console(f"发送 {sent} 字节, 接收 {assistant.bytes_received} 字节")
+    for line in bert.format_ber_report(stats):
+        Logger.console(line)
+    if sent > assistant.bytes_received:
+        Logger.warning(f"丢失 {sent - assistant.bytes_received} 字节 (未计入误码)")
+
 if __name__ == "__main__":
     assist = SerialAssistant()
+
+    # --log-level INFO / "WARNING,benchmark=DEBUG": 日志级别 (见 utils.Logger.configure)
+    # --capture <文件> [--capture-size MB]: 把收发数据写入抓包环形文件 (见 capture.py)
+    # 与实验二~六相同，由 load_node_config 解析 (读取时即设置日志级别)
+    try:
+        config = load_node_config(required=())
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
+        sys.exit(1)
+    if config and config.get('capture'):
+        assist.capture = open_capture(config['capture'], config.get('capture_size'))
+
+    # python main.py --bench --port loop://  非交互运行基准测试矩阵 (参数见 benchmark.py)
+    if '--bench' in sys.argv:
+        benchmark.main(assist, sys.argv[1:])
+        sys.exit()
     
     # 1. Port Selection utilizing utils
     current_port = select_serial_port("实验一：回环测试 - 请选择串口")
@@ -189,14 +419,17 @@ if __name__ == "__main__":
 
     try:
         while True:
-            print("\n" + "="*30)
-            print(f"Experiment 1: 串口回环测试 ({current_port})")
-            print("1. 基础收发 (Section 3)")
-            print("2. 速率性能测试 (Section 4 - Extension)")
-            print("3. 长消息测试 (Section 4 - Extension)")
-            print("0. 退出")
+            Logger.console("\n" + "="*30)
+            Logger.console(f"Experiment 1: 串口回环测试 ({current_port})")
+            Logger.console("1. 基础收发 (Section 3)")
+            Logger.console("2. 速率性能测试 (Section 4 - Extension)")
+            Logger.console("3. 长消息测试 (Section 4 - Extension)")
+            Logger.console("4. 吞吐量基准测试矩阵 (波特率 x 格式 x 块大小)")
+            Logger.console("5. 文件流式传输测试 (大文件分块发送 + 逐段 CRC)")
+            Logger.console("6. 误码率测试 (PRBS 图样比对)")
+            Logger.console("0. 退出")
             
-            choice = input("请选择功能: ")
+            choice = Logger.input("请选择功能: ")
             
             if choice == '1':
                 run_basic_mode(assist)
@@ -204,6 +437,12 @@ if __name__ == "__main__":
                 run_rate_test(assist)
             elif choice == '3':
                 run_long_message_test(assist)
+            elif choice == '4':
+                run_benchmark(assist, current_port)
+            elif choice == '5':
+                run_file_stream_test(assist)
+            elif choice == '6':
+                run_ber_test(assist)
             elif choice == '0':
                 break
             else:
@@ -213,3 +452,5 @@ if __name__ == "__main__":
         print("\n强制退出")
     finally:
         assist.close_port()
+        if assist.capture:
+            assist.capture.close()
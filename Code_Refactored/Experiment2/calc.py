@@ -0,0 +1,261 @@
+"""
+实验二: CALC 表达式求值 (AST 白名单 + 编译缓存 + 运算预算)
+
+原服务器对每个 CALC 请求直接 eval()，既慢 (每次重新解析编译)，又不安全: 客户端可以执行任意代码，
+或者发一个 9**9**9 让服务器卡死。这里:
+    - 用 ast 解析表达式，只允许数字常量、+ - * / // % **、正负号、括号、常量 pi/e
+      和少数数学函数 (FUNCTIONS)，其他语法一律拒绝
+    - 把语法树编译成嵌套闭包，之后求值不再经过解析
+    - 两级 LRU 缓存: 原文 -> (规范形式, 编译结果)；规范形式 (ast.dump，忽略空格等写法差异) -> 结果。
+      表达式只含常量，结果确定，错误 (如超出预算) 同样缓存，重复的恶意请求不再消耗计算
+    - 运算预算: 每次运算按操作数大小计费，整数结果超过 MAX_INT_BITS 位的运算在执行前拒绝
+      (幂运算按 指数 x log2(底数) 估算)，单个请求的求值时间因此有上界
+"""
+
+import ast
+import math
+import operator
+import threading
+from collections import OrderedDict
+
+MAX_EXPR_LEN = 256      # 表达式最大长度 (字符)
+MAX_NODES = 200         # 语法树最大节点数
+MAX_INT_BITS = 4096     # 整数结果位数上限 (约 1233 位十进制)
+OP_BUDGET = 2000        # 单个表达式的运算预算 (每次运算计 1 + 操作数位数/64)
+MAX_ROUND_DIGITS = 15
+CACHE_SIZE = 256
+
+
+class CalcError(ValueError):
+    """表达式不合法或超出限制 (消息直接放入响应，使用英文)"""
+
+
+def _int_bits(value):
+    return value.bit_length() if isinstance(value, int) else 64
+
+
+def _check_bits(bits):
+    if bits > MAX_INT_BITS:
+        raise CalcError(f"result too large (> {MAX_INT_BITS} bits)")
+
+
+def _pow(a, b):
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and abs(a) > 1:
+        _check_bits(b * math.log2(abs(a)))
+    result = operator.pow(a, b)
+    if isinstance(result, complex):
+        raise CalcError("complex result")
+    return result
+
+
+def _mul(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        _check_bits(a.bit_length() + b.bit_length())
+    return a * b
+
+
+def _round(x, ndigits=None):
+    if ndigits is None:
+        return round(x)
+    if not isinstance(ndigits, int) or abs(ndigits) > MAX_ROUND_DIGITS:
+        raise CalcError(f"round() digits must be an integer within +-{MAX_ROUND_DIGITS}")
+    return round(x, ndigits)
+
+
+BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: _mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _pow,
+}
+UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+CONSTANTS = {'pi': math.pi, 'e': math.e}
+# 函数名 -> (实现, 最少参数, 最多参数)
+FUNCTIONS = {
+    'abs': (abs, 1, 1),
+    'round': (_round, 1, 2),
+    'min': (min, 1, 16),
+    'max': (max, 1, 16),
+    'sqrt': (math.sqrt, 1, 1),
+    'exp': (math.exp, 1, 1),
+    'log': (math.log, 1, 2),
+    'sin': (math.sin, 1, 1),
+    'cos': (math.cos, 1, 1),
+    'tan': (math.tan, 1, 1),
+}
+
+
+class _Budget:
+    """一次求值的剩余运算预算"""
+    __slots__ = ('left',)
+
+    def __init__(self, ops):
+        self.left = ops
+
+    def charge(self, *args):
+        self.left -= 1 + sum(_int_bits(a) for a in args) // 64
+        if self.left < 0:
+            raise CalcError("operation budget exceeded")
+
+
+def _compile(node):
+    """把白名单内的语法树节点编译为闭包 fn(budget) -> 数值，不在白名单内时抛出 CalcError"""
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if type(value) not in (int, float):
+            raise CalcError(f"unsupported constant {value!r}")
+        if isinstance(value, int):
+            _check_bits(value.bit_length())
+        return lambda budget: value
+
+    if isinstance(node, ast.Name):
+        if node.id not in CONSTANTS:
+            raise CalcError(f"unknown name '{node.id}'")
+        value = CONSTANTS[node.id]
+        return lambda budget: value
+
+    if isinstance(node, ast.BinOp):
+        op = BINARY_OPS.get(type(node.op))
+        if op is None:
+            raise CalcError(f"operator {type(node.op).__name__} not allowed")
+        left, right = _compile(node.left), _compile(node.right)
+
+        def binary(budget):
+            a, b = left(budget), right(budget)
+            budget.charge(a, b)
+            return op(a, b)
+        return binary
+
+    if isinstance(node, ast.UnaryOp):
+        op = UNARY_OPS.get(type(node.op))
+        if op is None:
+            raise CalcError(f"operator {type(node.op).__name__} not allowed")
+        operand = _compile(node.operand)
+
+        def unary(budget):
+            a = operand(budget)
+            budget.charge(a)
+            return op(a)
+        return unary
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise CalcError("only calls to " + ", ".join(FUNCTIONS) + " are allowed")
+        func, lo, hi = FUNCTIONS[node.func.id]
+        if not lo <= len(node.args) <= hi:
+            raise CalcError(f"{node.func.id}() takes {lo}..{hi} arguments")
+        args = [_compile(arg) for arg in node.args]
+
+        def call(budget):
+            values = [arg(budget) for arg in args]
+            budget.charge(*values)
+            return func(*values)
+        return call
+
+    raise CalcError(f"syntax {type(node).__name__} not allowed")
+
+
+def compile_expr(text):
+    """
+    解析并编译表达式
+    :return: (规范形式, fn)，fn(budget) 求值
+    :raises CalcError: 语法错误或超出白名单/长度限制
+    """
+    text = text.strip()
+    if not text:
+        raise CalcError("empty expression")
+    if len(text) > MAX_EXPR_LEN:
+        raise CalcError(f"expression longer than {MAX_EXPR_LEN} characters")
+    try:
+        tree = ast.parse(text, mode='eval')
+    except (SyntaxError, ValueError, RecursionError):
+        raise CalcError("syntax error")
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+        raise CalcError(f"expression has more than {MAX_NODES} nodes")
+    return ast.dump(tree.body), _compile(tree.body)
+
+
+class Calculator:
+    """
+    带缓存的表达式求值器 (线程安全，可供工作池的多个线程共用)
+    evaluate() 返回结果数值，出错时抛出 CalcError；错误同样被缓存
+    """
+    def __init__(self, cache_size=CACHE_SIZE, budget=OP_BUDGET):
+        self.cache_size = cache_size
+        self.budget = budget
+        self.lock = threading.Lock()
+        self._compiled = OrderedDict()   # 原文 -> (规范形式, fn) 或 CalcError
+        self._results = OrderedDict()    # 规范形式 -> 结果 或 CalcError
+        self.hits = 0        # 命中结果缓存
+        self.compiles = 0    # 实际解析编译次数
+        self.evaluations = 0 # 实际求值次数
+        self.errors = 0
+
+    def _lookup(self, cache, key):
+        """在锁内调用: LRU 查找，命中时移到末尾"""
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+        return entry
+
+    def _store(self, cache, key, value):
+        """在锁内调用"""
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def evaluate(self, text):
+        text = text.strip()
+        with self.lock:
+            compiled = self._lookup(self._compiled, text)
+        if compiled is None:
+            try:
+                compiled = compile_expr(text)
+            except CalcError as e:
+                compiled = e
+            with self.lock:
+                self.compiles += 1
+                self._store(self._compiled, text, compiled)
+        if isinstance(compiled, CalcError):
+            with self.lock:
+                self.errors += 1
+            raise compiled
+
+        canon, fn = compiled
+        with self.lock:
+            result = self._lookup(self._results, canon)
+            if result is not None:
+                self.hits += 1
+        if result is None:
+            try:
+                result = fn(_Budget(self.budget))
+            except CalcError as e:
+                result = e
+            except (ArithmeticError, ValueError, TypeError) as e:
+                result = CalcError(str(e) or type(e).__name__)
+            with self.lock:
+                self.evaluations += 1
+                self._store(self._results, canon, result)
+        if isinstance(result, CalcError):
+            with self.lock:
+                self.errors += 1
+            raise result
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'compiles': self.compiles, 'evaluations': self.evaluations,
+                    'errors': self.errors, 'cached': len(self._results)}
+
+
+def format_calc_stats(calc):
+    st = calc.stats()
+    return (f"CALC 缓存命中 {st['hits']}, 编译 {st['compiles']}, 求值 {st['evaluations']}, "
+            f"错误 {st['errors']}, 缓存结果 {st['cached']}")
@@ -1,6 +1,7 @@
 """
 实验二：双机通信实验（C/S模式） - 客户端
 功能：作为客户端向服务器发送请求，并接收响应
+--pipeline: 流水线模式，请求带 ID 连续发出，不等待上一个响应 (见 pipeline.py)
 """
 
 import threading
@@ -10,31 +11,40 @@ import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_serial_port, create_serial_connection, choose_serial_format
+from utils import (Logger, select_serial_port, create_serial_connection, choose_serial_format,
+                   parse_serial_format, load_node_config, FrameBuffer, decode_frame)
+from pipeline import PendingRequests, tag_line, parse_tagged, format_latency, run_bench, DEFAULT_WINDOW
+from capture import open_capture, DIR_RX, DIR_TX
 
 class SerialClient:
     def __init__(self):
         self.ser = None
         self.receiving = False
         self.recv_thread = None
-        self.debug = True
+        self.debug = False      # --debug: 打印每帧的 repr/十六进制
+        self.capture = None     # 抓包环形文件 (--capture)
+        self.port_name = None
+        self.pending = PendingRequests()   # 流水线模式的在途请求 (ID -> Future)
 
     def _log(self, direction, payload):
-        """调试输出，带时间戳和方向"""
+        """
+        记录一帧 (payload 为 bytes): 开启抓包时写入环形文件 (见 capture.py)；
+        逐字节的 repr/十六进制调试输出开销较大，只在 --debug 时生成
+        """
+        if self.capture:
+            self.capture.record(self.port_name, DIR_RX if direction == 'RECV' else DIR_TX, payload)
         if not self.debug:
             return
         ts = time.strftime('%H:%M:%S')
-        if not isinstance(payload, bytes):
-            payload = str(payload).encode('utf-8', errors='ignore')
         raw = repr(payload)
         hex_str = ' '.join(f"{b:02X}" for b in payload)
-        # 使用 utils 的 debug 也可以，但这里格式比较特殊，保留原样但用 print
         print(f"[DEBUG {ts}] {direction}: len={len(payload)} raw={raw} hex={hex_str}")
     
     def open_port(self, port_name, baudrate=9600, bytesize=8, stopbits=1, parity='N'):
         """打开串口"""
         self.ser = create_serial_connection(port_name, baudrate, 1, bytesize, stopbits, parity)
         if self.ser:
+            self.port_name = port_name
             parity_str = str(parity) # might be object
             Logger.success(f"客户端串口 {port_name} 打开成功")
             Logger.info(f"配置: Baud {baudrate}")
@@ -55,6 +65,9 @@ class SerialClient:
         if self.ser and self.ser.is_open:
             self.ser.close()
             Logger.info("客户端串口已关闭")
+        if self.capture:
+            self.capture.close()
+            self.capture = None
     
     def send_request(self, request):
         """发送请求到服务器"""
@@ -73,26 +86,45 @@ class SerialClient:
                 return False
         return False
     
+    def request(self, request):
+        """
+        流水线请求: 带 ID 发出后立即返回 concurrent.futures.Future，不等待响应
+        future.result() 为去掉 ID 的响应文本，future.latency 为往返时延 (秒)；超时以 TimeoutError 结束
+        """
+        req_id, future = self.pending.new()
+        if not self.send_request(tag_line(req_id, request.strip())):
+            self.pending.fail(req_id, IOError("发送失败"))
+        return future
+
     def _receive_worker(self):
-        """接收数据的工作线程"""
+        """接收数据的工作线程: 带 ID 的响应交给对应的 Future，其余直接显示"""
+        framer = FrameBuffer()
         while self.receiving:
             try:
-                if self.ser.in_waiting > 0:
-                    data = self.ser.readline()
-                    if data:
-                        self._log('RECV', data)
-                        # 简单的回显给用户看
-                        try:
-                            print(f"[收到] {data.decode('utf-8').strip()}")
-                        except:
-                            pass
-                else:
-                    time.sleep(0.01)
+                for frame in framer.read_from(self.ser):
+                    self._log('RECV', bytes(frame))
+                    text = decode_frame(frame)
+                    req_id, body = parse_tagged(text)
+                    if req_id is not None and self.pending.resolve(req_id, body):
+                        continue
+                    # 简单的回显给用户看
+                    Logger.console(f"[收到] {text}")
+                self.pending.expire()
             except Exception as e:
                 if self.receiving:
                     Logger.error(f"接收数据异常: {e}")
                     time.sleep(0.1)
 
+def _show_response(future):
+    """流水线请求完成回调 (在接收线程中执行)"""
+    try:
+        body = future.result()
+    except Exception as e:
+        Logger.error(f"请求失败: {e}")
+        return
+    Logger.console(f"[收到 {future.latency * 1000:.1f}ms] {body}")
+
+
 def main():
     client = SerialClient()
     
@@ -100,37 +132,61 @@ def main():
     print("实验二：双机通信实验 - 客户端（C/S模式）")
     print("=" * 60)
     
-    # 1. 选择串口
-    selected_port = select_serial_port("请选择客户端串口")
-    if not selected_port:
+    # 串口参数: 给出 --config / --ports 时直接使用配置 (不扫描串口)，否则交互选择
+    try:
+        config = load_node_config(required=('ports',))
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
         return
 
-    # 2. 设置波特率
-    while True:
-        try:
-            bps_input = input("请输入波特率 (默认9600): ").strip()
-            baudrate = int(bps_input) if bps_input else 9600
-            break
-        except ValueError:
-            Logger.error("请输入有效的波特率")
-
-    # 3. 选择串口格式
-    bytesize, stopbits, parity, fmt_label = choose_serial_format()
+    client.debug = '--debug' in sys.argv
+    pipelined = '--pipeline' in sys.argv
+    if config:
+        client.capture = open_capture(config.get('capture'), config.get('capture_size'))
+    if config and not config['interactive']:
+        selected_port = config['ports'][0]
+        baudrate = config['serial'].get('baudrate', 9600)
+        bytesize, stopbits, parity, fmt_label = parse_serial_format(config.get('format', '8N1'))
+    else:
+        # 1. 选择串口
+        selected_port = select_serial_port("请选择客户端串口")
+        if not selected_port:
+            return
+
+        # 2. 设置波特率 (已由 --baud 给出时不再询问)
+        baudrate = config['serial'].get('baudrate') if config else None
+        while baudrate is None:
+            try:
+                bps_input = Logger.input("请输入波特率 (默认9600): ").strip()
+                baudrate = int(bps_input) if bps_input else 9600
+            except ValueError:
+                Logger.error("请输入有效的波特率")
+
+        # 3. 选择串口格式 (已由 --format 给出时不再询问)
+        if config and 'format' in config:
+            bytesize, stopbits, parity, fmt_label = parse_serial_format(config['format'])
+        else:
+            bytesize, stopbits, parity, fmt_label = choose_serial_format()
+
     Logger.info(f"选用格式: {fmt_label}，波特率 {baudrate}")
     
     # 4. 打开串口
     if not client.open_port(selected_port, baudrate, bytesize, stopbits, parity):
         return
     
-    print("\n" + "=" * 60)
-    print("客户端命令说明:")
-    print("  HELLO          - 向服务器发送问候")
-    print("  TIME           - 请求服务器当前时间")
-    print("  ECHO <msg>     - 回显消息")
-    print("  CALC <expr>    - 计算表达式，例如: CALC 2+3*4")
-    print("  QUIT           - 断开连接并退出")
-    print("  help           - 显示帮助信息")
-    print("=" * 60 + "\n")
+    Logger.console("\n" + "=" * 60)
+    Logger.console("客户端命令说明:")
+    Logger.console("  HELLO          - 向服务器发送问候")
+    Logger.console("  TIME           - 请求服务器当前时间")
+    Logger.console("  ECHO <msg>     - 回显消息")
+    Logger.console("  CALC <expr>    - 计算表达式，例如: CALC 2+3*4")
+    Logger.console("  QUIT           - 断开连接并退出")
+    Logger.console("  bench <n> [w] [命令] - 流水线测试: 发出 n 个请求 (在途不超过 w)，统计吞吐与时延")
+    Logger.console("  stats          - 显示流水线请求的时延统计")
+    Logger.console("  help           - 显示帮助信息")
+    Logger.console("=" * 60 + "\n")
+    if pipelined:
+        Logger.info("流水线模式: 命令带 ID 发出，不等待上一个响应")
     
     # 发送初始连接请求
     Logger.info("正在连接服务器...")
@@ -140,20 +196,49 @@ def main():
     # 主循环 - 发送请求
     try:
         while True:
-            request = input("\n请输入命令: ").strip()
+            request = Logger.input("\n请输入命令: ").strip()
             
             if not request:
                 continue
             
             if request.lower() == 'help':
-                print("\n可用命令:")
-                print("  HELLO          - 向服务器发送问候")
-                print("  TIME           - 请求服务器当前时间")
-                print("  ECHO <msg>     - 回显消息")
-                print("  CALC <expr>    - 计算表达式")
-                print("  QUIT           - 断开连接并退出")
+                Logger.console("\n可用命令:")
+                Logger.console("  HELLO          - 向服务器发送问候")
+                Logger.console("  TIME           - 请求服务器当前时间")
+                Logger.console("  ECHO <msg>     - 回显消息")
+                Logger.console("  CALC <expr>    - 计算表达式")
+                Logger.console("  QUIT           - 断开连接并退出")
+                Logger.console("  bench <n> [w] [命令] - 流水线吞吐/时延测试 (默认 w=%d, 命令 ECHO ping)" % DEFAULT_WINDOW)
+                Logger.console("  stats          - 流水线请求时延统计")
                 continue
-            
+
+            if request.lower().startswith('bench'):
+                parts = request.split(None, 3)
+                try:
+                    count = int(parts[1]) if len(parts) > 1 else 100
+                    window = int(parts[2]) if len(parts) > 2 else DEFAULT_WINDOW
+                    if count < 1 or window < 1:
+                        raise ValueError
+                except ValueError:
+                    Logger.error("用法: bench <请求数> [在途窗口] [命令]")
+                    continue
+                command = parts[3] if len(parts) > 3 else "ECHO ping"
+                done, elapsed = run_bench(client, count, window, command)
+                rate = done / elapsed if elapsed else 0.0
+                Logger.success(f"完成 {done}/{count} 个请求，用时 {elapsed:.2f}s，{rate:.1f} 请求/秒 (窗口 {window})")
+                Logger.console(format_latency(client.pending.stats))
+                continue
+
+            if request.lower() == 'stats':
+                Logger.console(format_latency(client.pending.stats))
+                continue
+
+            # 流水线模式: 带 ID 发出，响应到达时由接收线程回调显示
+            if pipelined and request.upper() != "QUIT":
+                future = client.request(request)
+                future.add_done_callback(_show_response)
+                continue
+
             # 发送请求
             client.send_request(request)
             
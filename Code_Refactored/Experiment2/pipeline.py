@@ -0,0 +1,217 @@
+"""
+实验二: 流水线请求/响应 (请求 ID 关联)
+
+原协议一问一答: 客户端发一行命令，服务器 sleep(0.1) 后回一行，同一时刻只能有一个请求在途，
+无论波特率多高都不到每秒 10 个请求。流水线模式下每个请求带一个 ID:
+    请求: #<id> <命令>\n        例: #17 TIME
+    响应: #<id> <响应>\n        例: #17 SERVER: Current time is ...
+客户端连续发出请求而不等待响应 (在途数不超过 window)，服务器处理完一个立即回一个 (不再 sleep)，
+客户端按 ID 把响应交给对应的 Future，并记录每个请求从发出到收到响应的时延。
+不带 # 前缀的行仍按原协议处理，新服务器兼容旧客户端。
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import Future
+
+TAG = '#'
+DEFAULT_TIMEOUT = 5.0   # 超过此时间未收到响应的请求以 TimeoutError 结束
+DEFAULT_WINDOW = 16     # 流水线测试默认在途请求数
+
+
+def tag_line(req_id, text):
+    """带 ID 的一行 (含换行符)"""
+    return f"{TAG}{req_id} {text}\n"
+
+
+def parse_tagged(line):
+    """
+    拆分带 ID 的一行
+    :return: (req_id, 内容)；不是 #<数字> 开头时返回 (None, 原行)
+    """
+    if line.startswith(TAG):
+        head, _, body = line[1:].partition(' ')
+        if head.isdigit():
+            return int(head), body
+    return None, line
+
+
+class LatencyStats:
+    """请求往返时延统计 (保留全部样本，按需计算分位数)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.timeouts = 0
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples = []
+            self.timeouts = 0
+
+    def summary(self):
+        """count/avg/p50/p95/p99/max (毫秒)，无样本时只有 count/timeouts"""
+        with self.lock:
+            samples = sorted(self.samples)
+            timeouts = self.timeouts
+        result = {'count': len(samples), 'timeouts': timeouts}
+        if samples:
+            pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            result.update(avg=sum(samples) / len(samples) * 1000, p50=pick(0.50), p95=pick(0.95),
+                          p99=pick(0.99), max=samples[-1] * 1000)
+        return result
+
+
+class LatencyHistogram:
+    """
+    固定分桶的时延直方图 (R10 序列，每十倍 10 个桶，1us ~ 10s)，内存占用固定，适合长期运行的服务器
+    summary() 与 LatencyStats 相同，分位数取所在桶的上沿 (误差不超过 26%，且不超过实测最大值)
+    """
+    EDGES = tuple(round(m * 10.0 ** e, 12) for e in range(-6, 1) for m in (1, 1.25, 1.6, 2, 2.5, 3.2, 4, 5, 6.3, 8)) + (10.0,)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def add(self, seconds):
+        i = bisect_left(self.EDGES, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.EDGES) + 1)   # 最后一桶: 超过 10s
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.timeouts = 0
+
+    def _quantile(self, q):
+        """在锁内调用"""
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return min(self.EDGES[i] if i < len(self.EDGES) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        with self.lock:
+            result = {'count': self.count, 'timeouts': self.timeouts}
+            if self.count:
+                result.update(avg=self.total / self.count * 1000, p50=self._quantile(0.50) * 1000,
+                              p95=self._quantile(0.95) * 1000, p99=self._quantile(0.99) * 1000,
+                              max=self.max * 1000)
+            return result
+
+    def buckets(self):
+        """非空桶: [(上沿秒数 或 None 表示超过 10s, 次数)]"""
+        with self.lock:
+            return [(self.EDGES[i] if i < len(self.EDGES) else None, n) for i, n in enumerate(self.counts) if n]
+
+
+def format_latency(stats):
+    s = stats.summary()
+    if not s['count']:
+        return f"无已完成的请求 (超时 {s['timeouts']})"
+    return (f"{s['count']} 个请求: 平均 {s['avg']:.1f}ms, p50 {s['p50']:.1f}ms, p95 {s['p95']:.1f}ms, "
+            f"p99 {s['p99']:.1f}ms, 最大 {s['max']:.1f}ms, 超时 {s['timeouts']}")
+
+
+class PendingRequests:
+    """
+    在途请求表: ID -> (Future, 发出时刻)
+    接收线程收到带 ID 的响应时 resolve()，同时把往返时延记入 stats；超时的请求由 expire() 结束
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.stats = LatencyStats()
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.next_id = 1
+
+    def new(self):
+        """登记一个新请求，返回 (req_id, future)"""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self.cond:
+            req_id = self.next_id
+            self.next_id += 1
+            self.pending[req_id] = (future, time.perf_counter())
+        return req_id, future
+
+    def resolve(self, req_id, body):
+        """收到响应: 结束对应的 Future，未知 ID (已超时或重复) 返回 False"""
+        with self.cond:
+            entry = self.pending.pop(req_id, None)
+            self.cond.notify_all()
+        if entry is None:
+            return False
+        future, sent_at = entry
+        latency = time.perf_counter() - sent_at
+        self.stats.add(latency)
+        future.latency = latency
+        future.set_result(body)
+        return True
+
+    def fail(self, req_id, exc):
+        """请求未能发出"""
+        with self.cond:
+            entry = self.pending.pop(req_id, None)
+            self.cond.notify_all()
+        if entry:
+            entry[0].set_exception(exc)
+
+    def expire(self):
+        """结束所有超时的请求 (接收线程每轮调用)"""
+        if not self.pending:
+            return
+        now = time.perf_counter()
+        expired = []
+        with self.cond:
+            for req_id, (future, sent_at) in list(self.pending.items()):
+                if now - sent_at > self.timeout:
+                    del self.pending[req_id]
+                    expired.append((req_id, future))
+            if expired:
+                self.cond.notify_all()
+        for req_id, future in expired:
+            with self.stats.lock:
+                self.stats.timeouts += 1
+            future.set_exception(TimeoutError(f"请求 #{req_id} 在 {self.timeout:g}s 内没有响应"))
+
+    def in_flight(self):
+        with self.cond:
+            return len(self.pending)
+
+    def wait_below(self, limit, timeout=None):
+        """阻塞到在途请求数小于 limit (limit=1 即等待全部完成)，超时返回 False"""
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.pending) < limit, timeout)
+
+
+def run_bench(client, count, window=DEFAULT_WINDOW, command="ECHO ping"):
+    """
+    流水线吞吐测试: 连续发出 count 个请求，在途数不超过 window
+    :return: (完成数, 耗时秒)
+    """
+    client.pending.stats.reset()
+    futures = []
+    start = time.perf_counter()
+    for _ in range(count):
+        if not client.pending.wait_below(window, client.pending.timeout):
+            break
+        futures.append(client.request(command))
+    client.pending.wait_below(1, client.pending.timeout + 1)
+    elapsed = time.perf_counter() - start
+    done = sum(1 for f in futures if f.done() and not f.exception())
+    return done, elapsed
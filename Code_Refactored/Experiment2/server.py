@@ -1,6 +1,12 @@
 """
 实验二：双机通信实验（C/S模式） - 服务器端
 功能：作为服务器接收客户端请求，处理后返回响应
+带 ID 的请求 (#<id> <命令>，见 pipeline.py) 处理完立即以同一 ID 回复；不带 ID 的请求按原协议处理
+--workers N [--queue M]: 工作池模式，接收线程只切帧入队，N 个工作线程处理请求，响应经同一个发送队列写出
+                         (见 workpool.py)；STATS 命令返回队列深度与处理时延
+命令分发见 services.py (CommandRegistry)，STATS <cmd> 返回该命令的时延直方图
+可同时监听多个串口 (--ports a,b,c 或交互多选)，每个串口一个客户端会话 (见 sessions.py)，
+工作池模式下各客户端公平共用工作线程；CLIENTS 返回各客户端吞吐量，--report N 每 N 秒打印一次
 """
 
 import threading
@@ -10,124 +16,223 @@ import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_serial_port, create_serial_connection, choose_serial_format
+from utils import (Logger, select_multiple_ports, create_serial_connection, choose_serial_format,
+                   parse_serial_format, load_node_config, FrameBuffer, decode_frame, PortWriter)
+from pipeline import tag_line, parse_tagged
+from workpool import WorkerPool, format_pool_stats, DEFAULT_QUEUE
+from calc import Calculator, CalcError, format_calc_stats
+from services import CommandRegistry, CommandError, format_command_stats, format_command_summary
+from sessions import ClientSession, format_session_stats, format_session_summary
+from capture import open_capture, DIR_RX, DIR_TX
 
 class SerialServer:
     def __init__(self):
-        self.ser = None
+        self.sessions = {}      # 串口名 -> ClientSession (见 sessions.py)，每个串口一个客户端
         self.running = False
-        self.recv_thread = None
-        self.debug = True
+        self.debug = False      # --debug: 打印每帧的 repr/十六进制
+        self.capture = None     # 抓包环形文件 (--capture)
+        self.workers = 0        # 工作线程数，0 表示在各端口的接收线程中直接处理 (原方式)
+        self.max_queue = DEFAULT_QUEUE
+        self.pool = None        # WorkerPool (工作池模式，所有端口共用，按客户端公平调度)
+        self.calc = Calculator()   # CALC 求值器 (AST 白名单 + 缓存 + 运算预算，见 calc.py)
+        self.commands = CommandRegistry()
+        self._register_services()
 
-    def _log(self, direction, payload):
-        """调试输出，带时间戳和方向"""
+    def _log(self, direction, payload, port):
+        """
+        记录一帧 (payload 为 bytes): 开启抓包时写入环形文件 (见 capture.py)；
+        逐字节的 repr/十六进制调试输出开销较大，只在 --debug 时生成
+        """
+        if self.capture:
+            self.capture.record(port, DIR_RX if direction == 'RECV' else DIR_TX, payload)
         if not self.debug:
             return
         ts = time.strftime('%H:%M:%S')
-        if not isinstance(payload, bytes):
-            payload = str(payload).encode('utf-8', errors='ignore')
         raw = repr(payload)
         hex_str = ' '.join(f"{b:02X}" for b in payload)
-        print(f"[DEBUG {ts}] {direction}: len={len(payload)} raw={raw} hex={hex_str}")
+        print(f"[DEBUG {ts}] {port} {direction}: len={len(payload)} raw={raw} hex={hex_str}")
     
     def open_port(self, port_name, baudrate=9600, bytesize=8, stopbits=1, parity='N'):
-        """打开串口"""
-        self.ser = create_serial_connection(port_name, baudrate, 1, bytesize, stopbits, parity)
-        if self.ser:
+        """打开一个串口 (可多次调用，每个串口服务一个客户端)"""
+        if port_name in self.sessions:
+            Logger.warning(f"串口 {port_name} 已打开")
+            return True
+        ser = create_serial_connection(port_name, baudrate, 1, bytesize, stopbits, parity)
+        if ser:
+            self.sessions[port_name] = ClientSession(port_name, ser)
             Logger.success(f"服务器串口 {port_name} 打开成功")
             return True
         else:
             return False
     
     def close_port(self):
-        """关闭串口"""
+        """关闭所有串口"""
         self.running = False
-        if self.recv_thread:
-            self.recv_thread.join(timeout=2)
-        if self.ser and self.ser.is_open:
-            self.ser.close()
-            Logger.info("服务器串口已关闭")
+        for session in self.sessions.values():
+            if session.thread:
+                session.thread.join(timeout=2)
+        if self.pool:
+            self.pool.close()
+            Logger.info("工作池统计: " + format_pool_stats(self.pool))
+            self.pool = None
+        if any(cmd.calls for cmd in self.commands.commands.values()):
+            Logger.info("命令统计:\n" + "\n".join(format_command_stats(self.commands)))
+        if any(s.requests for s in self.sessions.values()):
+            Logger.info("客户端统计:\n" + "\n".join(format_session_stats(self.sessions.values())))
+        for session in self.sessions.values():
+            if session.writer:
+                # 等待已入队的响应 (如 QUIT 的回复) 写完
+                deadline = time.time() + 2
+                while session.writer.depth() and time.time() < deadline:
+                    time.sleep(0.01)
+                session.writer.close()
+                session.writer = None
+            if session.ser.is_open:
+                session.ser.close()
+                Logger.info(f"服务器串口 {session.port} 已关闭")
+        if self.capture:
+            self.capture.close()
+            self.capture = None
     
-    def send_data(self, data):
-        """发送数据"""
-        if self.ser and self.ser.is_open:
+    def send_data(self, session, data):
+        """向一个客户端发送数据"""
+        if session.ser.is_open:
             try:
                 if isinstance(data, str):
                     data = data.encode('utf-8')
-                self.ser.write(data)
-                self._log('SEND', data)
+                if session.writer:
+                    if not session.writer.send(data):
+                        Logger.warning(f"[{session.port}] 发送队列已满，丢弃响应")
+                        return False
+                else:
+                    session.ser.write(data)
+                self._log('SEND', data, session.port)
+                session.on_response(len(data))
                 return True
             except Exception as e:
-                Logger.error(f"发送失败: {e}")
+                Logger.error(f"[{session.port}] 发送失败: {e}")
                 return False
         return False
     
-    def process_request(self, request):
-        """处理客户端请求"""
-        request_str = request.decode('utf-8', errors='ignore').strip()
-        
-        # 根据不同的请求类型返回不同的响应
-        if request_str.upper().startswith("HELLO"):
-            response = "SERVER: Hello, Client! Connection established."
-        elif request_str.upper().startswith("TIME"):
-            response = f"SERVER: Current time is {time.strftime('%Y-%m-%d %H:%M:%S')}"
-        elif request_str.upper().startswith("ECHO"):
-            # Echo 服务，返回客户端发送的内容
-            echo_content = request_str[5:].strip()
-            response = f"SERVER: ECHO - {echo_content}"
-        elif request_str.upper().startswith("CALC"):
-            # 简单计算服务
-            try:
-                expr = request_str[5:].strip()
-                result = eval(expr)
-                response = f"SERVER: CALC - {expr} = {result}"
-            except:
-                response = "SERVER: ERROR - Invalid calculation expression"
-        elif request_str.upper().startswith("QUIT"):
-            response = "SERVER: Goodbye!"
-            return response, True  # 返回退出标志
+    def _register_services(self):
+        """内置服务 (命令注册表见 services.py，新增服务只需 register)"""
+        reg = self.commands
+        reg.register("HELLO", self._hello, session=True)
+        reg.register("TIME", lambda: f"SERVER: Current time is {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        # Echo 服务，返回客户端发送的内容
+        reg.register("ECHO", lambda msg: f"SERVER: ECHO - {msg}", parse=str, usage="ECHO <msg>")
+        reg.register("CALC", self._calc, parse=str, required=True, usage="CALC <expr>")
+        reg.register("STATS", self._stats, parse=str, usage="STATS [cmd]")
+        reg.register("SESSION", lambda session: "SERVER: SESSION - " + format_session_summary(session), session=True)
+        reg.register("CLIENTS", self._clients)
+        reg.register("QUIT", lambda: "SERVER: Goodbye!", quits=True)
+
+    def _hello(self, session):
+        if session is not None:
+            session.greeted = True
+        return "SERVER: Hello, Client! Connection established."
+
+    def _clients(self):
+        """各客户端吞吐量"""
+        return "SERVER: CLIENTS - " + "; ".join(format_session_summary(s) for s in self.sessions.values())
+
+    def _calc(self, expr):
+        """简单计算服务 (不使用 eval，见 calc.py)"""
+        try:
+            result = self.calc.evaluate(expr)
+        except CalcError as e:
+            raise CommandError(f"Invalid calculation expression ({e})")
+        return f"SERVER: CALC - {expr} = {result}"
+
+    def _stats(self, verb):
+        """STATS: 工作池/CALC/各命令统计；STATS <cmd>: 该命令的时延直方图"""
+        if verb:
+            return "SERVER: STATS - " + format_command_summary(self.commands, verb)
+        if self.pool:
+            response = "SERVER: STATS - " + format_pool_stats(self.pool).replace("\n ", ";")
         else:
-            response = f"SERVER: Unknown command '{request_str}'. Available: HELLO, TIME, ECHO <msg>, CALC <expr>, QUIT"
-        
-        return response, False
+            response = "SERVER: STATS - 未启用工作池 (--workers)"
+        return response + "; " + format_calc_stats(self.calc) + "; " + format_command_summary(self.commands)
+
+    def process_request(self, request, session=None):
+        """
+        处理客户端请求 (request 为 bytes 或已解码的 str)
+        :return: (响应文本, 是否退出)
+        """
+        return self.commands.dispatch(decode_frame(request), session)
     
-    def receive_worker(self):
-        """接收数据的工作线程"""
-        Logger.info("服务已启动，等待客户端连接...")
+    def receive_worker(self, session):
+        """一个串口的接收线程"""
+        framer = FrameBuffer()
         while self.running:
             try:
-                if self.ser.in_waiting > 0:
-                    data = self.ser.readline()
-                    if data:
-                        self._log('RECV', data)
-                        
-                        # 处理请求并返回响应
-                        response, should_quit = self.process_request(data)
-                        time.sleep(0.1)  # 短暂延迟，确保客户端准备好接收
-                        self.send_data(response + "\n")
-                        
-                        if should_quit:
-                            Logger.info("收到退出请求，准备关闭...")
-                            # self.running = False # Server usually keeps running or restarts, but here we break conform to logic
-                            # But wait, original code broke here.
-                            self.running = False
-                            break
-                else:
-                    time.sleep(0.01)
+                # 一次读出全部可用字节并切出所有完整请求 (无数据时阻塞在串口 timeout 上)
+                for frame in framer.read_from(session.ser):
+                    received = time.perf_counter()
+                    self._log('RECV', bytes(frame), session.port)
+                    session.on_request(len(frame))
+                    req_id, request = parse_tagged(decode_frame(frame))
+                    item = (session, req_id, request, received)
+                    if self.pool:
+                        # 工作池模式: 只入队 (按客户端公平调度)，不在接收线程中处理；
+                        # 该客户端的队列满时立即回复忙碌
+                        if not self.pool.submit(item, session.port):
+                            session.on_reject()
+                            self.respond(session, req_id, "SERVER: BUSY - request queue full, retry later",
+                                         delay=False)
+                        continue
+                    if self.handle_request(item):
+                        break
             except Exception as e:
                 if self.running:
-                    Logger.error(f"接收数据异常: {e}")
+                    Logger.error(f"[{session.port}] 接收数据异常: {e}")
                     time.sleep(0.1)
     
+    def respond(self, session, req_id, response, delay=True):
+        """发送响应: 流水线请求立即以同一 ID 回复，客户端按 ID 匹配；不带 ID 的按原协议回复"""
+        if req_id is not None:
+            return self.send_data(session, tag_line(req_id, response))
+        if delay:
+            time.sleep(0.1)  # 短暂延迟，确保客户端准备好接收 (旧客户端收发不同时进行)
+        return self.send_data(session, response + "\n")
+
+    def handle_request(self, item):
+        """
+        处理一个 (会话, req_id, 请求, 收到时刻) 并回复 (接收线程或工作线程中执行)
+        QUIT: 只监听一个串口时关闭服务器并返回 True；多个串口时只结束该客户端的会话
+        """
+        session, req_id, request, received = item
+        response, should_quit = self.process_request(request, session)
+        self.respond(session, req_id, response)
+        session.latency.add(time.perf_counter() - received)
+        if not should_quit:
+            return False
+        if len(self.sessions) > 1:
+            Logger.info(f"[{session.port}] 客户端断开: " + format_session_summary(session))
+            session.reset()
+            return False
+        Logger.info("收到退出请求，准备关闭...")
+        self.running = False
+        return True
+
     def start_server(self):
-        """启动服务器"""
-        if not self.ser or not self.ser.is_open:
+        """启动服务器: 每个串口一个接收线程，工作池模式下所有串口共用工作线程"""
+        if not self.sessions:
             Logger.error("请先打开串口")
             return False
-        
+
+        if self.workers > 0:
+            for session in self.sessions.values():
+                # 每个串口一个发送队列，至少能容纳该客户端全部排队请求的回复
+                session.writer = PortWriter(session.ser, session.port,
+                                            max_frames=(16, 64, max(256, self.max_queue * 2)))
+            self.pool = WorkerPool(self.handle_request, self.workers, self.max_queue)
+            Logger.info(f"工作池模式: {self.workers} 个工作线程，每个客户端排队上限 {self.max_queue}")
         self.running = True
-        self.recv_thread = threading.Thread(target=self.receive_worker, daemon=True)
-        self.recv_thread.start()
+        for session in self.sessions.values():
+            session.thread = threading.Thread(target=self.receive_worker, args=(session,), daemon=True)
+            session.thread.start()
+        Logger.info(f"服务已启动 ({len(self.sessions)} 个串口)，等待客户端连接...")
         return True
 
 def main():
@@ -137,32 +242,69 @@ def main():
     print("实验二：双机通信实验 - 服务器端（C/S模式）")
     print("=" * 60)
     
-    # 1. 选择串口
-    selected_port = select_serial_port("请选择服务器串口")
-    if not selected_port:
+    # 串口参数: 给出 --config / --ports 时直接使用配置 (不扫描串口)，否则交互选择
+    try:
+        config = load_node_config(required=('ports',))
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
         return
 
-    # 2. 设置波特率
-    while True:
-        try:
-            bps_input = input("请输入波特率 (默认9600): ").strip()
-            baudrate = int(bps_input) if bps_input else 9600
-            break
-        except ValueError:
-            Logger.error("请输入有效的波特率")
-
-    # 3. 选择串口格式
-    bytesize, stopbits, parity, fmt_label = choose_serial_format()
+    server.debug = '--debug' in sys.argv
+    try:
+        if '--workers' in sys.argv:
+            server.workers = int(sys.argv[sys.argv.index('--workers') + 1])
+        if '--queue' in sys.argv:
+            server.max_queue = int(sys.argv[sys.argv.index('--queue') + 1])
+        # --report N: 每 N 秒打印一次各客户端吞吐量 (0 为不打印)
+        report = float(sys.argv[sys.argv.index('--report') + 1]) if '--report' in sys.argv else 0
+        if server.workers < 0 or server.max_queue < 1 or report < 0:
+            raise ValueError("--workers/--report 不能为负数，--queue 至少为 1")
+    except (ValueError, IndexError) as e:
+        Logger.error(f"参数错误: {e}")
+        return
+    if config:
+        server.capture = open_capture(config.get('capture'), config.get('capture_size'))
+    if config and not config['interactive']:
+        selected_ports = config['ports']
+        baudrate = config['serial'].get('baudrate', 9600)
+        bytesize, stopbits, parity, fmt_label = parse_serial_format(config.get('format', '8N1'))
+    else:
+        # 1. 选择串口 (可多选，每个串口服务一个客户端)
+        selected_ports = select_multiple_ports("请选择服务器串口 (可多选)")
+        if not selected_ports:
+            return
+
+        # 2. 设置波特率 (已由 --baud 给出时不再询问)
+        baudrate = config['serial'].get('baudrate') if config else None
+        while baudrate is None:
+            try:
+                bps_input = Logger.input("请输入波特率 (默认9600): ").strip()
+                baudrate = int(bps_input) if bps_input else 9600
+            except ValueError:
+                Logger.error("请输入有效的波特率")
+
+        # 3. 选择串口格式 (已由 --format 给出时不再询问)
+        if config and 'format' in config:
+            bytesize, stopbits, parity, fmt_label = parse_serial_format(config['format'])
+        else:
+            bytesize, stopbits, parity, fmt_label = choose_serial_format()
+
     Logger.info(f"选用格式: {fmt_label}，波特率 {baudrate}")
     
-    # 4. 打开串口
-    if not server.open_port(selected_port, baudrate, bytesize, stopbits, parity):
+    # 4. 打开串口 (部分串口打不开时用其余串口继续服务)
+    for port in selected_ports:
+        server.open_port(port, baudrate, bytesize, stopbits, parity)
+    if not server.sessions:
         return
     
     if server.start_server():
         try:
+            last_report = time.time()
             while server.running:
                 time.sleep(1)
+                if report and time.time() - last_report >= report:
+                    last_report = time.time()
+                    Logger.info("客户端统计:\n" + "\n".join(format_session_stats(server.sessions.values())))
         except KeyboardInterrupt:
             Logger.info("正在停止服务器...")
         finally:
@@ -0,0 +1,146 @@
+"""
+实验二: 服务器命令注册表
+
+原 process_request 是一串 request_str.upper().startswith(...) 判断，每个分支都把整行转一次大写，
+请求要依次经过前面所有分支，新增服务只能继续加长这条链。这里:
+    - 请求只解析一次: 第一个空白前的部分为命令 (不区分大小写)，其余为参数文本
+    - 按命令名查字典 (O(1)) 找到处理函数
+    - 注册时声明参数解析: parse=None 不接收参数；parse=可调用对象 时对参数文本调用，
+      抛出 ValueError 则回复用法 (usage)；required=True 时参数不能为空
+    - 处理函数返回响应文本；抛出 CommandError 时回复 "SERVER: ERROR - <原因>"
+    - 每个命令自带调用次数、错误次数和处理时延直方图 (LatencyHistogram)
+    - session=True 的命令额外收到发出请求的客户端会话 (见 sessions.py) 作为第一个参数
+与原协议的差异: 命令必须是完整的词 (原来 "HELLOWORLD" 也会匹配 HELLO)
+"""
+
+import threading
+import time
+
+from utils import Logger
+from pipeline import LatencyHistogram
+
+
+class CommandError(ValueError):
+    """处理函数拒绝请求 (消息放入错误响应)"""
+
+
+class Command:
+    """一个已注册的命令及其统计"""
+    def __init__(self, verb, handler, parse=None, required=False, usage='', quits=False, session=False):
+        self.verb = verb
+        self.handler = handler
+        self.parse = parse
+        self.required = required
+        self.usage = usage or verb
+        self.quits = quits       # 回复后结束会话 (QUIT)
+        self.session = session   # 处理函数需要客户端会话
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+
+
+class CommandRegistry:
+    """命令名 (大写) -> Command"""
+    def __init__(self):
+        self.commands = {}
+        self.lock = threading.Lock()
+        self.unknown = 0
+
+    def register(self, verb, handler, parse=None, required=False, usage='', quits=False, session=False):
+        """注册命令，已存在时覆盖 (便于替换内置服务)"""
+        verb = verb.upper()
+        self.commands[verb] = Command(verb, handler, parse, required, usage, quits, session)
+        return self.commands[verb]
+
+    def command(self, verb, **options):
+        """装饰器形式的 register"""
+        def decorator(handler):
+            self.register(verb, handler, **options)
+            return handler
+        return decorator
+
+    def available(self):
+        return ", ".join(cmd.usage for cmd in self.commands.values())
+
+    def dispatch(self, text, session=None):
+        """
+        执行一行请求 (已解码的 str)
+        :param session: 发出请求的客户端会话 (session=True 的命令需要)
+        :return: (响应文本, 是否退出)
+        """
+        parts = text.split(None, 1)  # 任意空白 (空格/制表符) 结束命令字
+        verb = parts[0] if parts else ''
+        rest = parts[1] if len(parts) > 1 else ''
+        cmd = self.commands.get(verb.upper())
+        if cmd is None:
+            with self.lock:
+                self.unknown += 1
+            return f"SERVER: Unknown command '{text}'. Available: {self.available()}", False
+
+        start = time.perf_counter()
+        error = True
+        rest = rest.strip()
+        try:
+            args = (session,) if cmd.session else ()
+            if cmd.parse is not None:
+                if cmd.required and not rest:
+                    raise CommandError(f"usage: {cmd.usage}")
+                try:
+                    args += (cmd.parse(rest),)
+                except ValueError:
+                    raise CommandError(f"usage: {cmd.usage}")
+            response = cmd.handler(*args)
+            error = False
+        except CommandError as e:
+            response = f"SERVER: ERROR - {e}"
+        except Exception as e:
+            Logger.error(f"命令 {cmd.verb} 处理异常: {e}")
+            response = f"SERVER: ERROR - {cmd.verb} failed"
+        cmd.latency.add(time.perf_counter() - start)
+        with self.lock:
+            cmd.calls += 1
+            if error:
+                cmd.errors += 1
+        return response, cmd.quits and not error
+
+    def stats(self):
+        """{命令: {'calls', 'errors', 以及 latency.summary() 的各项}}"""
+        result = {}
+        for verb, cmd in self.commands.items():
+            with self.lock:
+                entry = {'calls': cmd.calls, 'errors': cmd.errors}
+            entry.update(cmd.latency.summary())
+            result[verb] = entry
+        return result
+
+
+def format_command_stats(registry):
+    """各命令调用统计 (表格行 list of str)"""
+    lines = [f"{'Command':<10} {'Calls':<8} {'Errors':<8} {'Avg ms':<9} {'p50 ms':<9} {'p99 ms':<9} {'Max ms':<9}"]
+    lines.append("-" * 66)
+    for verb, st in registry.stats().items():
+        if not st['calls']:
+            continue
+        lines.append(f"{verb:<10} {st['calls']:<8} {st['errors']:<8} {st['avg']:<9.3f} {st['p50']:<9.3f} "
+                     f"{st['p99']:<9.3f} {st['max']:<9.3f}")
+    lines.append(f"未知命令 {registry.unknown} 次")
+    return lines
+
+
+def format_command_summary(registry, verb=None):
+    """单行摘要 (用于 STATS 响应): 指定 verb 时附带该命令的时延直方图"""
+    stats = registry.stats()
+    if verb:
+        cmd = registry.commands.get(verb.upper())
+        if cmd is None:
+            raise CommandError(f"unknown command '{verb}'")
+        st = stats[cmd.verb]
+        if not st['calls']:
+            return f"{cmd.verb}: 尚无调用"
+        hist = " ".join(f"<={edge * 1000:g}ms:{n}" if edge is not None else f">10s:{n}"
+                        for edge, n in cmd.latency.buckets())
+        return (f"{cmd.verb}: 调用 {st['calls']}, 错误 {st['errors']}, 平均 {st['avg']:.3f}ms, "
+                f"p50 {st['p50']:.3f}ms, p99 {st['p99']:.3f}ms, 最大 {st['max']:.3f}ms; 直方图 {hist}")
+    parts = [f"{v} {st['calls']}次/{st['errors']}错/p99 {st['p99']:.2f}ms"
+             for v, st in stats.items() if st['calls']]
+    return "命令: " + (", ".join(parts) or "无") + f", 未知命令 {registry.unknown}"
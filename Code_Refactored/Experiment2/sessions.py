@@ -0,0 +1,107 @@
+"""
+实验二: 多串口服务器的客户端会话
+
+服务器可同时监听多个串口，每个串口对应一个客户端会话 (ClientSession):
+    - 串口、接收线程、发送队列 (工作池模式下的 PortWriter) 都属于会话，各端口互不阻塞
+    - 会话状态: 是否已 HELLO、最后活动时间，以及按客户端统计的请求数/响应数/拒绝数/收发字节数、
+      每秒请求数 (每秒滚动计算一次) 和请求从收到到回复的时延直方图
+    - 客户端 QUIT 只结束自己的会话 (状态清零，串口保持打开等待下一个客户端)；
+      只监听一个串口时仍按原方式关闭服务器
+"""
+
+import threading
+import time
+
+from pipeline import LatencyHistogram
+
+
+class ClientSession:
+    """一个串口上的客户端会话"""
+    def __init__(self, port, ser):
+        self.port = port
+        self.ser = ser
+        self.writer = None        # PortWriter (工作池模式)
+        self.thread = None        # 接收线程
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """开始新会话 (打开串口或客户端 QUIT 之后)"""
+        with self.lock:
+            self.greeted = False
+            self.started = time.time()
+            self.last_active = None
+            self.requests = 0
+            self.responses = 0
+            self.rejected = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.latency = LatencyHistogram()
+            self.rate = 0.0
+            self._rate_start = time.monotonic()
+            self._rate_count = 0
+
+    def on_request(self, nbytes):
+        with self.lock:
+            self.requests += 1
+            self.bytes_in += nbytes
+            self.last_active = time.time()
+            self._rate_count += 1
+            self._update_rate()
+
+    def on_response(self, nbytes):
+        with self.lock:
+            self.responses += 1
+            self.bytes_out += nbytes
+
+    def on_reject(self):
+        with self.lock:
+            self.rejected += 1
+
+    def _update_rate(self):
+        """在锁内调用: 每秒滚动计算一次请求速率"""
+        elapsed = time.monotonic() - self._rate_start
+        if elapsed >= 1.0:
+            self.rate = self._rate_count / elapsed
+            self._rate_start += elapsed
+            self._rate_count = 0
+
+    def stats(self):
+        with self.lock:
+            self._update_rate()
+            return {
+                'port': self.port,
+                'greeted': self.greeted,
+                'uptime': time.time() - self.started,
+                'requests': self.requests,
+                'responses': self.responses,
+                'rejected': self.rejected,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'rate': self.rate,
+                'latency': self.latency.summary(),
+            }
+
+
+def format_session_stats(sessions):
+    """各客户端吞吐量 (表格行 list of str)"""
+    lines = [f"{'Port':<18} {'Req':<8} {'Resp':<8} {'Busy':<6} {'Req/s':<8} {'In B':<10} {'Out B':<10} "
+             f"{'p50 ms':<8} {'p99 ms':<8}"]
+    lines.append("-" * 92)
+    for session in sessions:
+        st = session.stats()
+        lat = st['latency']
+        p50 = f"{lat['p50']:.2f}" if lat['count'] else "-"
+        p99 = f"{lat['p99']:.2f}" if lat['count'] else "-"
+        lines.append(f"{st['port']:<18} {st['requests']:<8} {st['responses']:<8} {st['rejected']:<6} "
+                     f"{st['rate']:<8.1f} {st['bytes_in']:<10} {st['bytes_out']:<10} {p50:<8} {p99:<8}")
+    return lines
+
+
+def format_session_summary(session):
+    """单行摘要 (用于 SESSION / CLIENTS 响应)"""
+    st = session.stats()
+    lat = st['latency']
+    latency = f", p50 {lat['p50']:.2f}ms, p99 {lat['p99']:.2f}ms" if lat['count'] else ""
+    return (f"{st['port']}: 请求 {st['requests']}, 响应 {st['responses']}, 忙碌拒绝 {st['rejected']}, "
+            f"{st['rate']:.1f} 请求/秒, 收 {st['bytes_in']}B/发 {st['bytes_out']}B{latency}")
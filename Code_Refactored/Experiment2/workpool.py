@@ -0,0 +1,209 @@
+"""
+实验二: 服务器请求工作池
+
+原服务器在接收线程中直接调用 process_request，一个耗时的 CALC 会让接收线程停止读串口，
+期间到达的数据只能堆在操作系统的串口接收缓冲区里，缓冲区满后丢失。工作池模式下:
+    - 接收线程只负责切帧和入队 (submit)，不执行任何处理
+    - 固定数量的工作线程从有界队列取请求并调用处理函数
+    - 队列满时 submit 立即返回 False，由接收线程回复忙碌 (而不是阻塞读串口)
+    - 所有响应经同一个 PortWriter 写出 (见 server.py)，工作线程之间不争用串口
+排队时间 (入队到开始处理) 与处理时间分别统计，排队时间长说明工作线程不足，
+处理时间长说明单个请求本身慢，据此调整 --workers / --queue
+
+多个客户端 (多个串口) 共用一个工作池时，请求按客户端分别排队 (FairQueue)，
+工作线程以差额轮询 (Deficit Round Robin) 从各客户端队列取请求:
+    - 每轮给当前客户端增加 quantum 的额度，每个请求按 cost 扣减，额度不足时换下一个客户端；
+      默认 cost = quantum = 1，即各客户端每轮一个请求 (按字节计费时，小请求的客户端每轮能取走
+      几十个请求，低速客户端的等待时间随之变长)
+    - 一个客户端连续发送大量请求，只会占满它自己的队列 (max_queue 按客户端计) 并收到 BUSY，
+      其他客户端的请求仍按轮询及时得到处理
+"""
+
+import threading
+import time
+from collections import deque
+
+from utils import Logger
+from pipeline import LatencyHistogram
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE = 64      # 每个客户端的排队上限
+DEFAULT_QUANTUM = 1     # DRR 每轮额度 (与 cost 同单位，默认按请求数)
+
+
+class FairQueue:
+    """
+    按 key (客户端) 分队列的有界阻塞队列，get() 以差额轮询在各 key 之间公平选取
+    put() 不阻塞，该 key 的队列满或已关闭时返回 False
+    """
+    def __init__(self, max_per_key=DEFAULT_QUEUE, quantum=DEFAULT_QUANTUM):
+        self.max_per_key = max_per_key
+        self.quantum = quantum
+        self.cond = threading.Condition()
+        self.flows = {}         # key -> deque[(item, cost, 入队时刻)]
+        self.deficit = {}       # key -> 剩余额度
+        self.active = deque()   # 有排队请求的 key，队首为当前服务的 key
+        self._credited = False  # 队首 key 本轮是否已加过额度
+        self.size = 0
+        self.closed = False
+
+    def put(self, key, item, cost=1):
+        with self.cond:
+            if self.closed:
+                return False
+            flow = self.flows.get(key)
+            if flow is None:
+                flow = self.flows[key] = deque()
+                self.deficit[key] = 0
+            if len(flow) >= self.max_per_key:
+                return False
+            if not flow:
+                self.active.append(key)
+            flow.append((item, cost, time.perf_counter()))
+            self.size += 1
+            self.cond.notify()
+            return True
+
+    def _take(self):
+        """在锁内调用: DRR 取出一个 (item, 入队时刻)"""
+        while True:
+            key = self.active[0]
+            flow = self.flows[key]
+            if not self._credited:
+                self.deficit[key] += self.quantum
+                self._credited = True
+            item, cost, queued_at = flow[0]
+            if cost <= self.deficit[key]:
+                flow.popleft()
+                self.size -= 1
+                self.deficit[key] -= cost
+                if not flow:
+                    # 队列取空: 移出轮询，额度清零 (空闲客户端不积攒额度)
+                    self.active.popleft()
+                    self.deficit[key] = 0
+                    self._credited = False
+                return item, queued_at
+            self.active.rotate(-1)
+            self._credited = False
+
+    def get(self):
+        """阻塞取一个 (item, 入队时刻)，关闭后返回 None"""
+        with self.cond:
+            while not self.size and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            return self._take()
+
+    def depth(self, key=None):
+        with self.cond:
+            if key is None:
+                return self.size
+            flow = self.flows.get(key)
+            return len(flow) if flow else 0
+
+    def close(self):
+        """丢弃所有排队请求并唤醒等待的工作线程"""
+        with self.cond:
+            self.closed = True
+            self.flows.clear()
+            self.active.clear()
+            self.size = 0
+            self.cond.notify_all()
+
+
+class WorkerPool:
+    """
+    按客户端公平排队的有界队列 + 固定数量的工作线程
+    :param handler: handler(item)，在工作线程中执行
+    :param workers: 工作线程数
+    :param max_queue: 每个客户端的排队请求上限 (不含正在处理的)
+    """
+    def __init__(self, handler, workers=DEFAULT_WORKERS, max_queue=DEFAULT_QUEUE, name="worker",
+                 quantum=DEFAULT_QUANTUM):
+        self.handler = handler
+        self.queue = FairQueue(max_queue, quantum)
+        self.max_queue = max_queue
+        self.wait_stats = LatencyHistogram()      # 排队时间
+        self.handler_stats = LatencyHistogram()   # 处理时间
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.threads = [threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True)
+                        for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, item, key=None, cost=1):
+        """入队一个请求 (不阻塞)，key 为所属客户端，该客户端的队列满时返回 False"""
+        if not self.queue.put(key, item, cost):
+            with self.lock:
+                self.rejected += 1
+            return False
+        depth = self.queue.depth()
+        with self.lock:
+            self.submitted += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            item, queued_at = entry
+            start = time.perf_counter()
+            self.wait_stats.add(start - queued_at)
+            with self.lock:
+                self.busy += 1
+            try:
+                self.handler(item)
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                Logger.error(f"请求处理异常: {e}")
+            finally:
+                self.handler_stats.add(time.perf_counter() - start)
+                with self.lock:
+                    self.busy -= 1
+
+    def stats(self):
+        """统计快照"""
+        with self.lock:
+            return {
+                'workers': len(self.threads),
+                'busy': self.busy,
+                'depth': self.queue.depth(),
+                'max_depth': self.max_depth,
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'failed': self.failed,
+            }
+
+    def close(self, timeout=2.0):
+        """丢弃尚未开始的请求，等待正在处理的请求结束"""
+        self.queue.close()
+        deadline = time.monotonic() + timeout
+        for t in self.threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+
+def format_pool_stats(pool):
+    """工作池统计 (多行字符串)"""
+    st = pool.stats()
+    wait, handle = pool.wait_stats.summary(), pool.handler_stats.summary()
+
+    def latency(s):
+        if not s['count']:
+            return "无样本"
+        return f"平均 {s['avg']:.1f}ms, p50 {s['p50']:.1f}ms, p95 {s['p95']:.1f}ms, p99 {s['p99']:.1f}ms, 最大 {s['max']:.1f}ms"
+
+    return (f"工作线程 {st['busy']}/{st['workers']} 忙, 排队 {st['depth']} (峰值 {st['max_depth']}, 每客户端上限 {st['max_queue']}), "
+            f"已受理 {st['submitted']}, 拒绝 {st['rejected']}, 异常 {st['failed']}\n"
+            f"  排队: {latency(wait)}\n"
+            f"  处理: {latency(handle)}")
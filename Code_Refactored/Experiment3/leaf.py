@@ -8,13 +8,14 @@
 """
 
 import threading
-import time
 import sys
 import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_serial_port, create_serial_connection
+from utils import (Logger, select_serial_port, create_serial_connection, FrameBuffer, decode_frame,
+                   load_node_config)
+from capture import open_capture, capture_tap, DIR_RX, DIR_TX
 
 # 数据帧分隔符
 SEPARATOR = '|'
@@ -25,11 +26,14 @@ class LeafNode:
         self.running = False
         self.my_id = None
         self.recv_thread = None
+        self.port = None
+        self.capture = None   # 抓包环形文件 (--capture，见 capture.py)
 
     def connect(self, port, baudrate, my_id):
         self.ser = create_serial_connection(port, baudrate, timeout=0.1)
         if self.ser:
             self.my_id = my_id
+            self.port = port
             self.running = True
             
             # 启动接收线程
@@ -44,22 +48,21 @@ class LeafNode:
 
     def _receive_loop(self):
         Logger.info(f"开始监听来自端口的数据...")
+        framer = FrameBuffer(tap=capture_tap(self.capture, self.port, DIR_RX))
         while self.running and self.ser and self.ser.is_open:
             try:
-                if self.ser.in_waiting:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    if line:
-                        self._process_frame(line)
-                time.sleep(0.01)
+                for frame in framer.read_from(self.ser):
+                    self._process_frame(frame)
             except Exception as e:
                 Logger.error(f"接收线程异常: {e}")
                 break
 
-    def _process_frame(self, raw_data):
+    def _process_frame(self, frame):
         """
         处理接收到的帧
         格式: SRC_ID|DST_ID|PAYLOAD
         """
+        raw_data = decode_frame(frame)
         parts = raw_data.split(SEPARATOR, 2)
         if len(parts) != 3:
             return
@@ -67,11 +70,11 @@ class LeafNode:
         src_id, dst_id, payload = parts
 
         if dst_id == self.my_id:
-            print(f"\n[收到消息] 来自 {src_id}: {payload}")
-            print(f"> ", end="", flush=True) # 恢复提示符
+            Logger.console(f"\n[收到消息] 来自 {src_id}: {payload}")
+            Logger.console(f"> ", end="") # 恢复提示符
         elif dst_id == "BROADCAST": # 可选：支持广播
-             print(f"\n[收到广播] 来自 {src_id}: {payload}")
-             print(f"> ", end="", flush=True)
+             Logger.console(f"\n[收到广播] 来自 {src_id}: {payload}")
+             Logger.console(f"> ", end="")
         else:
             # 目标不是自己，忽略
             pass
@@ -83,10 +86,12 @@ class LeafNode:
 
         # 封装帧
         # 格式: SRC|DST|MSG
-        frame = f"{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{message}\n"
+        frame = f"{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{message}\n".encode('utf-8')
         try:
-            self.ser.write(frame.encode('utf-8'))
-            print(f"[发送成功] -> {target_id}: {message}")
+            self.ser.write(frame)
+            if self.capture:
+                self.capture.record(self.port, DIR_TX, frame)
+            Logger.console(f"[发送成功] -> {target_id}: {message}")
         except Exception as e:
             Logger.error(f"发送失败: {e}")
 
@@ -94,6 +99,8 @@ class LeafNode:
         self.running = False
         if self.ser and self.ser.is_open:
             self.ser.close()
+        if self.capture:
+            self.capture.close()
 
 def main():
     leaf = LeafNode()
@@ -101,32 +108,46 @@ def main():
     print("实验三：简单拓扑的多机通信实验 - 叶子节点 (Leaf)")
     print("="*60)
     
-    # 1. 选择串口
-    selected_port = select_serial_port("请选择连接根节点的串口")
-    if not selected_port:
+    # 给出 --config / --id --ports 时直接使用配置 (不扫描串口)，否则交互选择
+    try:
+        config = load_node_config()
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
         return
-    
-    # 2. 配置 ID
-    while True:
-        my_id = input("请输入本机识别ID (例如 ID2): ").strip()
-        if my_id:
-            break
-        print("ID不能为空")
+
+    # 波特率、抓包等选项在交互模式下同样生效
+    baudrate = config['serial'].get('baudrate', 9600) if config else 9600
+    if config:
+        leaf.capture = open_capture(config.get('capture'), config.get('capture_size'))
+    if config and not config['interactive']:
+        selected_port, my_id = config['ports'][0], config['id']
+    else:
+        # 1. 选择串口
+        selected_port = select_serial_port("请选择连接根节点的串口")
+        if not selected_port:
+            return
+        
+        # 2. 配置 ID
+        while True:
+            my_id = Logger.input("请输入本机识别ID (例如 ID2): ").strip()
+            if my_id:
+                break
+            print("ID不能为空")
     
     # 3. 连接
-    if not leaf.connect(selected_port, 9600, my_id):
+    if not leaf.connect(selected_port, baudrate, my_id):
         return
 
-    print("\n" + "="*60)
-    print("操作说明:")
-    print("  格式: 目标ID 消息内容")
-    print("  例如: ID3 Hello World")
-    print("  输入 'exit' 或 'quit' 退出")
-    print("="*60)
+    Logger.console("\n" + "="*60)
+    Logger.console("操作说明:")
+    Logger.console("  格式: 目标ID 消息内容")
+    Logger.console("  例如: ID3 Hello World")
+    Logger.console("  输入 'exit' 或 'quit' 退出")
+    Logger.console("="*60)
 
     try:
         while True:
-            cmd = input("> ").strip()
+            cmd = Logger.input("> ").strip()
             if not cmd:
                 continue
                 
@@ -15,18 +15,21 @@ import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_serial_port, create_serial_connection
+from utils import (Logger, select_serial_port, create_serial_connection, FrameBuffer, decode_frame,
+                   load_node_config)
+from capture import open_capture, capture_tap, DIR_RX, DIR_TX
 
 # 数据帧分隔符
 SEPARATOR = '|'
 
 class PortListener(threading.Thread):
-    def __init__(self, port, baudrate, callback, user_id="Unknown"):
+    def __init__(self, port, baudrate, callback, user_id="Unknown", capture=None):
         super().__init__()
         self.port = port
         self.baudrate = baudrate
         self.callback = callback
         self.user_id = user_id # 该端口连接的设备ID
+        self.capture = capture # 抓包环形文件 (见 capture.py)，None 为不抓包
         self.ser = None
         self.running = False
 
@@ -37,15 +40,15 @@ class PortListener(threading.Thread):
                 self.running = True
                 Logger.info(f"[{self.port}] 端口已打开，连接设备: {self.user_id}")
                 
+                framer = FrameBuffer(tap=capture_tap(self.capture, self.port, DIR_RX))
                 while self.running:
-                    if self.ser.in_waiting:
-                        try:
-                            line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                            if line:
-                                self.callback(line, self.port)
-                        except Exception as e:
-                            Logger.error(f"[{self.port}] 读取错误: {e}")
-                    time.sleep(0.01) # 避免CPU占用过高
+                    try:
+                        # 无数据时阻塞在串口 timeout 上，不再空转轮询
+                        for frame in framer.read_from(self.ser):
+                            self.callback(frame, self.port)
+                    except Exception as e:
+                        Logger.error(f"[{self.port}] 读取错误: {e}")
+                        time.sleep(0.1)
             else:
                 self.running = False
         except Exception as e:
@@ -53,9 +56,15 @@ class PortListener(threading.Thread):
             self.running = False
 
     def send(self, data):
+        """发送一帧 (str 按 UTF-8 编码；bytes/memoryview 原样转发)"""
         if self.ser and self.ser.is_open:
             try:
-                self.ser.write((data + '\n').encode('utf-8'))
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                data = bytes(data) + b'\n'
+                self.ser.write(data)
+                if self.capture:
+                    self.capture.record(self.port, DIR_TX, data)
                 return True
             except Exception as e:
                 Logger.error(f"[{self.port}] 发送失败: {e}")
@@ -71,25 +80,27 @@ class RootNode:
         self.listeners = {} # port_name -> PortListener
         self.routing_table = {} # node_id -> port_name
         self.my_id = "ROOT"
+        self.capture = None
 
-    def handle_message(self, raw_data, source_port):
+    def handle_message(self, frame, source_port):
         """
         处理接收到的消息
         协议格式: SRC_ID|DST_ID|PAYLOAD
         """
+        raw_data = decode_frame(frame)
         parts = raw_data.split(SEPARATOR, 2)
         if len(parts) != 3:
-            Logger.debug(f"[收到畸形帧] {raw_data} 来自 {source_port}")
+            Logger.debug("[收到畸形帧] %s 来自 %s", raw_data, source_port)
             return
 
         src_id, dst_id, payload = parts
         
         # 显示接收日志
-        print(f"[RECV] {src_id} -> {dst_id} : {payload} (来自 {source_port})")
+        Logger.console(f"[RECV] {src_id} -> {dst_id} : {payload} (来自 {source_port})")
 
         # 判断是否发给自己
         if dst_id == self.my_id:
-            print(f"  >>> 收到发给自己的消息: {payload}")
+            Logger.console(f"  >>> 收到发给自己的消息: {payload}")
             return
 
         # 查表转发
@@ -102,8 +113,9 @@ class RootNode:
                 return
 
             if target_port in self.listeners:
-                print(f"  >>> 转发至端口 {target_port} (目标: {dst_id})")
-                success = self.listeners[target_port].send(raw_data)
+                Logger.console(f"  >>> 转发至端口 {target_port} (目标: {dst_id})")
+                # 直接转发原始帧字节，无需重新编码
+                success = self.listeners[target_port].send(frame)
                 if not success:
                     Logger.error(f"  [ERROR] 转发失败")
             else:
@@ -116,7 +128,7 @@ class RootNode:
             Logger.warning(f"端口 {port} 已经在使用了")
             return
         
-        listener = PortListener(port, baudrate, self.handle_message, connected_id)
+        listener = PortListener(port, baudrate, self.handle_message, connected_id, self.capture)
         listener.start()
         self.listeners[port] = listener
         self.routing_table[connected_id] = port
@@ -133,13 +145,15 @@ class RootNode:
             # 封装帧: SRC(ROOT)|DST|MSG
             frame = f"{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{msg}"
             if self.listeners[port].send(frame):
-                print(f"[发送成功] -> {target_id} (via {port}): {msg}")
+                Logger.console(f"[发送成功] -> {target_id} (via {port}): {msg}")
                 return True
         return False
 
     def stop(self):
         for listener in self.listeners.values():
             listener.stop()
+        if self.capture:
+            self.capture.close()
 
 def main():
     root = RootNode()
@@ -147,51 +161,71 @@ def main():
     print("实验三：简单拓扑的多机通信实验 - 根节点 (Root)")
     print("="*60)
     
+    # 非交互配置: --ports COM3=ID2,COM4=ID3 或配置文件中的 peers = {"COM3": "ID2", ...}
+    try:
+        config = load_node_config(required=())
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
+        return
+
     # 配置波特率
-    baudrate = 9600
-    
-    # 交互式添加连接
-    print("\n请配置连接的叶子节点")
-    while True:
-        # 使用 utils 选择器
-        port = select_serial_port("选择端口 (或选择退出)")
+    baudrate = config['serial'].get('baudrate', 9600) if config else 9600
+
+    if config:
+        root.capture = open_capture(config.get('capture'), config.get('capture_size'))
+    if config and not config['interactive']:
+        peers = dict(config.get('peers', {}))
+        for entry in config.get('ports', []):
+            if '=' not in entry:
+                Logger.error(f"端口配置应为 端口=设备ID: {entry}")
+                return
+            port, node_id = entry.split('=', 1)
+            peers[port.strip()] = node_id.strip()
+        for port, node_id in peers.items():
+            root.add_port(port, baudrate, node_id)
+    else:
+        # 交互式添加连接
+        print("\n请配置连接的叶子节点")
+        while True:
+            # 使用 utils 选择器
+            port = select_serial_port("选择端口 (或选择退出)")
         
-        if not port:
-            break
+            if not port:
+                break
         
-        # 检查是否已经配置过
-        if port in root.listeners:
-            print(f"端口 {port} 已经配置过了，请选择其他串口")
-            continue
+            # 检查是否已经配置过
+            if port in root.listeners:
+                print(f"端口 {port} 已经配置过了，请选择其他串口")
+                continue
 
-        node_id = input(f"该端口 ({port}) 连接的设备ID是? (例如 ID2): ").strip()
-        if not node_id:
-            print("设备ID不能为空")
-            continue
+            node_id = Logger.input(f"该端口 ({port}) 连接的设备ID是? (例如 ID2): ").strip()
+            if not node_id:
+                print("设备ID不能为空")
+                continue
 
-        root.add_port(port, baudrate, node_id)
+            root.add_port(port, baudrate, node_id)
         
-        cont = input("是否继续添加端口? (y/n) [y]: ").strip().lower()
-        if cont == 'n':
-            break
+            cont = Logger.input("是否继续添加端口? (y/n) [y]: ").strip().lower()
+            if cont == 'n':
+                break
 
     if not root.listeners:
         Logger.info("未配置任何端口，程序退出")
         return
 
-    print("\n" + "="*60)
-    print(f"系统启动完成。本机ID: {root.my_id}")
-    print("转发表:")
+    Logger.console("\n" + "="*60)
+    Logger.console(f"系统启动完成。本机ID: {root.my_id}")
+    Logger.console("转发表:")
     for nid, port in root.routing_table.items():
-        print(f"  {nid} <==> {port}")
-    print("系统正在监听并转发数据...")
-    print("输入格式: <目标ID> <消息内容>  (例如: PC1 Hello)")
-    print("输入 'exit' 退出")
-    print("="*60)
+        Logger.console(f"  {nid} <==> {port}")
+    Logger.console("系统正在监听并转发数据...")
+    Logger.console("输入格式: <目标ID> <消息内容>  (例如: PC1 Hello)")
+    Logger.console("输入 'exit' 退出")
+    Logger.console("="*60)
 
     try:
         while True:
-            cmd = input("> ").strip()
+            cmd = Logger.input("> ").strip()
             if not cmd: continue
             
             if cmd.lower() in ['exit', 'quit']:
@@ -8,6 +8,7 @@
 """
 
 import threading
+import selectors
 import time
 import json
 import sys
@@ -15,7 +16,16 @@ import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_multiple_ports, create_serial_connection
+from utils import (Logger, select_multiple_ports, create_serial_connection, FrameBuffer, decode_frame,
+                   PortWriter, TokenBucket, format_port_stats, PRIO_HELLO, PRIO_CONTROL, PRIO_DATA,
+                   load_node_config, configure_node, wait_until_stopped)
+from wire import (MAGIC, CAP_BINARY, CAP_COMPRESS, CAP_ARQ, CAP_FEC, CAP_BERT, CodecStats, frame_length, resync_check, is_binary_frame,
+                  encode_packet, decode_packet, format_caps, parse_caps, format_codec_stats)
+from autobaud import LinkRateNegotiator, CAP_AUTOBAUD, TYPE_LINK
+from linkarq import LinkArq, is_arq_frame, format_arq_stats
+from fec import LinkFec, is_fec_frame, format_fec_stats
+from bert import LinkBert, is_bert_frame, format_ber_report, DEFAULT_PATTERN
+from capture import open_capture, capture_tap, format_capture_stats, DIR_RX, DIR_TX
 
 # === 协议常量 ===
 TYPE_HELLO = 'HELLO' # 邻居发现
@@ -30,15 +40,25 @@ DV_INTERVAL    = 5   # 发送路由表的间隔(秒)
 NEIGHBOR_TIMEOUT = 10 # 邻居超时判定(秒)
 
 class RouterNode:
-    def __init__(self):
+    def __init__(self, use_reactor=False):
         self.my_id = ""
         self.running = False
+        # Reactor 模式: 单线程 selectors 等待所有串口 + 定时任务 (可选)
+        self.use_reactor = use_reactor
+
+        # 定时器与串口参数 (默认取模块常量，可由配置文件覆盖，见 utils.load_node_config)
+        self.hello_interval = HELLO_INTERVAL
+        self.dv_interval = DV_INTERVAL
+        self.neighbor_timeout = NEIGHBOR_TIMEOUT
+        self.serial_params = {}
+        # 速率协商上限 (None 表示 autobaud.DEFAULT_MAX_BAUDRATE)
+        self.max_baudrate = None
         
         # 串口管理
         # active_ports: port_name -> serial.Serial 对象
         self.active_ports = {}
-        # port_locks: port_name -> threading.Lock (用于互斥写入)
-        self.port_locks = {}
+        # port_writers: port_name -> PortWriter (发送队列 + 专用写线程)
+        self.port_writers = {}
         
         # 邻居表
         # neighbors: port_name -> {'id': neighbor_id, 'last_seen': timestamp}
@@ -51,104 +71,303 @@ class RouterNode:
         self.routing_table = {}
         self.rt_lock = threading.Lock()
 
-    def start(self):
+        # 链路能力协商 (见 wire.py)
+        # local_caps: 本机支持的能力；link_caps: port_name -> 与该端口邻居协商一致的能力
+        self.local_caps = {CAP_BINARY, CAP_COMPRESS, CAP_AUTOBAUD, CAP_FEC, CAP_BERT}
+        self.link_caps = {}
+        # codec_stats: port -> CodecStats (压缩比与压缩/解压 CPU 时间)
+        self.codec_stats = {}
+        # 链路速率协商 (见 autobaud.py)，bring_up 时创建
+        self.autobaud = None
+        # 逐跳重传 (见 linkarq.py): link_arq 为 True 时在 HELLO 中声明 ARQ 能力
+        self.link_arq = False
+        self.arq = LinkArq(lambda port, data, prio: self._send_to_port(port, data, prio, arq=False),
+                           lambda port: getattr(self.active_ports.get(port), 'baudrate', None))
+        # 前向纠错 (见 fec.py): 冗余度来自 --fec / 配置项 fec (整数或 {端口: 冗余度})，可用 fec 命令修改
+        self.fec_levels = None
+        self.fec = LinkFec()
+        # 误码率测试 (见 bert.py): BERT 帧越过 ARQ/FEC 直接进入发送队列，测的是原始链路质量
+        self.bert = LinkBert(self._send_raw)
+        # 单帧处理异常 (畸形帧、对端版本不同等) 按端口计数，丢弃该帧后继续接收
+        self.frame_errors = {}
+        # 抓包 (见 capture.py): --capture / 配置项 capture 给出环形文件路径时在 bring_up 中打开，否则为 None
+        self.capture_path = None
+        self.capture_size = None
+        self.capture = None
+
+    def start(self, config=None):
+        """
+        启动节点
+        :param config: 启动配置 (utils.load_node_config)；为 None 或 config['interactive'] 为真时交互选择串口和ID
+        """
         print("="*60)
         print("实验四：动态路由 (DV算法)")
         print("="*60)
         
-        # 1. 扫描并展示可用串口
-        # 使用 utils 的多选列表
-        target_ports = select_multiple_ports("请选择要激活的串口 (用于构建网络)")
+        if config:
+            configure_node(self, config)
+        if config and not config['interactive']:
+            # 非交互启动: 串口与ID来自配置，不扫描串口
+            target_ports, my_id = config['ports'], config['id']
+        else:
+            # 1. 扫描并展示可用串口
+            # 使用 utils 的多选列表
+            target_ports = select_multiple_ports("请选择要激活的串口 (用于构建网络)")
+
+            if not target_ports:
+                Logger.warning("未选择有效串口，程序退出。")
+                return
+
+            # 2. 获取本机配置
+            my_id = ""
+            while not my_id:
+                my_id = Logger.input("请输入本机ID (例如 A, B, PC1): ").strip()
+
+        # 3. 打开串口并启动后台线程
+        if not self.bring_up(my_id, target_ports):
+            return
 
-        if not target_ports:
-            Logger.warning("未选择有效串口，程序退出。")
+        if config and not config.get('console', True):
+            wait_until_stopped(self)
             return
 
-        # 2. 获取本机配置
-        while not self.my_id:
-            self.my_id = input("请输入本机ID (例如 A, B, PC1): ").strip()
+        Logger.console("输入 'table' 查看路由表，输入 'send <Dest> <Msg>' 发送消息。")
+        Logger.console("="*60)
         
+        # 4. 主循环：处理用户输入
+        self._input_loop()
+
+    def bring_up(self, my_id, target_ports):
+        """
+        非交互启动: 打开串口、启动监听与定时任务后立即返回 (不进入命令行循环)
+        可用于同一进程内运行多个节点 (如 virtual_serial 虚拟链路)
+        :return: 至少一个串口打开成功时返回 True
+        """
+        self.my_id = my_id
         # 初始化路由表（加入自己）
         self.routing_table[self.my_id] = {'cost': 0, 'next_hop_port': 'LOCAL', 'next_hop_id': self.my_id}
 
         self.running = True
+        self.autobaud = LinkRateNegotiator(self.my_id, self._port_control, self.max_baudrate)
+        if self.link_arq:
+            self.local_caps.add(CAP_ARQ)
+            self.arq.start()
+        try:
+            self.fec = LinkFec(self.fec_levels)
+        except ValueError as e:
+            Logger.error(f"FEC 配置无效，已关闭: {e}")
+        self.capture = open_capture(self.capture_path, self.capture_size)
         
-        # 3. 启动端口监听线程
+        # 打开串口
         for port in target_ports:
             # 尝试打开串口
-            ser = create_serial_connection(port, timeout=0.1)
+            ser = create_serial_connection(port, timeout=0.1, **self.serial_params)
             if ser:
                 self.active_ports[port] = ser
-                self.port_locks[port] = threading.Lock()
-                
-                t = threading.Thread(target=self._listen_port, args=(port,), daemon=True)
-                t.start()
-                Logger.info(f"[{port}] 监听已启动...")
+                self.codec_stats[port] = CodecStats()
+                self.port_writers[port] = PortWriter(ser, port, pacer=TokenBucket.for_serial(ser),
+                                                     tap=capture_tap(self.capture, port, DIR_TX))
+                self.autobaud.register(port, ser.baudrate)
             else:
                  Logger.error(f"[{port}] 打开失败, 跳过")
 
         if not self.active_ports:
              Logger.error("没有任何串口成功打开，退出。")
-             return
+             self.running = False
+             return False
+
+        if self.use_reactor and not self._reactor_supported():
+            Logger.warning("部分串口不支持 select (无文件描述符)，回退到多线程模式")
+            self.use_reactor = False
+
+        if self.use_reactor:
+            # 单个 Reactor 线程: 监听全部端口并驱动 Hello/DV/超时定时器
+            threading.Thread(target=self._reactor_loop, daemon=True).start()
+            Logger.info(f"Reactor 模式: 单线程监听 {list(self.active_ports.keys())}")
+        else:
+            # 每个端口一个监听线程 + 三个周期性任务线程 (Hello广播, DV广播, 超时检测)
+            for port in self.active_ports:
+                t = threading.Thread(target=self._listen_port, args=(port,), daemon=True)
+                t.start()
+                Logger.info(f"[{port}] 监听已启动...")
 
-        # 4. 启动周期性任务 (Hello广播, DV广播, 超时检测)
-        threading.Thread(target=self._task_hello, daemon=True).start()
-        threading.Thread(target=self._task_broadcast_dv, daemon=True).start()
-        threading.Thread(target=self._task_check_timeout, daemon=True).start()
+            threading.Thread(target=self._task_hello, daemon=True).start()
+            threading.Thread(target=self._task_broadcast_dv, daemon=True).start()
+            threading.Thread(target=self._task_check_timeout, daemon=True).start()
         
         Logger.success("系统启动完成。正在自动发现邻居并构建路由表...")
-        print("输入 'table' 查看路由表，输入 'send <Dest> <Msg>' 发送消息。")
-        print("="*60)
-        
-        # 5. 主循环：处理用户输入
-        self._input_loop()
+        return True
 
     def _listen_port(self, port_name):
         """串口接收线程"""
         ser = self.active_ports[port_name]
+        # 增量分帧: 一次读出全部可用字节，处理粘包/分包
+        framer = FrameBuffer(magic=MAGIC, frame_length=frame_length,
+                             tap=capture_tap(self.capture, port_name, DIR_RX),
+                             resync=self._resync_check(port_name))
         try:
             while self.running and ser.is_open:
                 try:
-                    if ser.in_waiting:
-                        # 读取数据，拼接到buffer中处理粘包/分包 (这里简化按行读取)
-                        line = ser.readline().decode('utf-8', errors='ignore').strip()
-                        if line:
-                            self._handle_packet(line, port_name)
-                    else:
-                        time.sleep(0.01)
+                    for frame in framer.read_from(ser):
+                        self._receive_frame(frame, port_name)
                 except Exception as e:
                     Logger.error(f"[{port_name}] 读取错误: {e}")
                     break
         except Exception:
             pass
 
-    def _send_to_port(self, port_name, packet_str):
-        """线程安全地发送数据"""
-        if port_name not in self.active_ports:
-            return False
-        
-        lock = self.port_locks[port_name]
-        ser = self.active_ports[port_name]
-        
-        with lock:
+    def _reactor_supported(self):
+        """所有已打开端口都能提供文件描述符时才可使用 selectors (Windows 串口不行)"""
+        for ser in self.active_ports.values():
             try:
-                data = (packet_str + '\n').encode('utf-8')
-                ser.write(data)
-                return True
-            except Exception as e:
-                Logger.error(f"[{port_name}] 发送错误: {e}")
+                ser.fileno()
+            except Exception:
                 return False
+        return True
+
+    def _reactor_loop(self):
+        """
+        Reactor 主循环 (单线程)
+        - selectors 阻塞等待任意串口可读，或下一个定时任务到期
+        - 可读端口: 读出全部可用字节，按行切分后交给 _handle_packet
+        - 定时任务: Hello / DV 广播 / 邻居超时检测 在同一循环内执行
+        """
+        sel = selectors.DefaultSelector()
+        framers = {}  # port_name -> FrameBuffer (保存未凑满一帧的残留数据)
+        for port_name, ser in self.active_ports.items():
+            sel.register(ser.fileno(), selectors.EVENT_READ, port_name)
+            framers[port_name] = FrameBuffer(magic=MAGIC, frame_length=frame_length,
+                                             tap=capture_tap(self.capture, port_name, DIR_RX),
+                                             resync=self._resync_check(port_name))
+
+        # 定时器: [下次触发时间, 间隔, 回调]
+        now = time.monotonic()
+        timers = [
+            [now, self.hello_interval, self._send_hello],
+            [now, self.dv_interval, self._send_dv_updates],
+            [now + 1, 1, self._check_neighbor_timeout],
+        ]
+
+        try:
+            while self.running and sel.get_map():
+                now = time.monotonic()
+                for timer in timers:
+                    if now >= timer[0]:
+                        timer[2]()
+                        timer[0] = now + timer[1]
+
+                timeout = max(0, min(t[0] for t in timers) - time.monotonic())
+                for key, _ in sel.select(timeout):
+                    port_name = key.data
+                    ser = self.active_ports.get(port_name)
+                    try:
+                        frames = framers[port_name].read_from(ser)
+                    except Exception as e:
+                        Logger.error(f"[{port_name}] 读取错误: {e}")
+                        sel.unregister(key.fileobj)
+                        continue
+
+                    for frame in frames:
+                        self._receive_frame(frame, port_name)
+        finally:
+            sel.close()
+
+    def _receive_frame(self, frame, port_name):
+        """处理接收线程切出的一帧: 处理异常只计数并丢弃该帧，不结束该端口的接收"""
+        try:
+            self._handle_packet(frame, port_name)
+        except Exception as e:
+            self.frame_errors[port_name] = self.frame_errors.get(port_name, 0) + 1
+            Logger.warning("[%s] 丢弃无法处理的帧: %s", port_name, e)
+
+    def _send_to_port(self, port_name, packet, prio=PRIO_DATA, arq=True):
+        """
+        将一帧放入该端口对应优先级的发送队列 (非阻塞，由写线程实际写串口)
+        str 为文本帧，自动追加换行；bytes 为二进制帧
+        :param arq: 链路协商了 ARQ 时经逐跳重传发送 (HELLO 等链路控制帧传 False)
+        """
+        writer = self.port_writers.get(port_name)
+        if not writer:
+            return False
+        data = packet if isinstance(packet, bytes) else (packet + '\n').encode('utf-8')
+        if arq and self.arq.active(port_name):
+            return self.arq.send(port_name, data, prio)
+        # FEC 在 ARQ 之下: 重传的信封同样经过纠错编码
+        data = self.fec.encode(port_name, data, self.link_caps.get(port_name, ()))
+        return writer.send(data, prio)
+
+    def _resync_check(self, port):
+        """分帧重新同步条件: 只在已协商二进制格式的链路上，且只认通过校验的信封首部 (见 wire.resync_check)"""
+        return resync_check(lambda: CAP_BINARY in self.link_caps.get(port, ()))
+
+    def _send_raw(self, port_name, data):
+        """不经 ARQ/FEC 直接放入端口发送队列 (BERT 帧)"""
+        writer = self.port_writers.get(port_name)
+        return writer.send(data, PRIO_DATA) if writer else False
+
+    def _port_control(self, port_name, data=b'', baudrate=None):
+        """速率协商用: 越过发送队列立即写出控制帧，写完后切换波特率"""
+        writer = self.port_writers.get(port_name)
+        return writer.control(data, baudrate) if writer else False
+
+    def _encode_packet(self, port_name, p_type, src, dst='', payload=''):
+        """按该链路协商的格式封装数据包: 二进制帧 (bytes) 或文本帧 (str)"""
+        caps = self.link_caps.get(port_name, ())
+        if CAP_BINARY in caps:
+            try:
+                # 双方都声明了 Z 时，足够长的负载会被压缩
+                return encode_packet(p_type, src, dst, payload, compress=CAP_COMPRESS in caps,
+                                     stats=self.codec_stats.get(port_name))
+            except ValueError:
+                pass  # 字段超长，回退到文本格式
+
+        if p_type == TYPE_DV:
+            return f"{TYPE_DV}{SEPARATOR}{src}{SEPARATOR}{payload}"
+        return f"{TYPE_DATA}{SEPARATOR}{src}{SEPARATOR}{dst}{SEPARATOR}{payload}"
+
+    def _send_packet(self, port_name, p_type, src, dst='', payload=''):
+        """按链路格式封装并发送 (DV 走控制优先级，DATA 走数据优先级)"""
+        prio = PRIO_CONTROL if p_type == TYPE_DV else PRIO_DATA
+        return self._send_to_port(port_name, self._encode_packet(port_name, p_type, src, dst, payload), prio)
 
     # === 协议处理核心 ===
 
-    def _handle_packet(self, raw_data, port_source):
+    def _handle_packet(self, frame, port_source):
         """
-        处理接收到的数据包
+        处理接收到的数据包 (frame 为 FrameBuffer 切出的一帧，在此解码一次)
         三种类型:
-        1. HELLO|SenderID
+        1. HELLO|SenderID[|Caps]
         2. DV|SenderID|JSON_Routing_Table
         3. DATA|SrcID|DstID|Payload
+        4. LINK|SenderID|Op|... (链路速率协商，见 autobaud.py)
+        二进制帧 (wire.py) 解码后字段与文本格式一致
         """
+        if is_binary_frame(frame):
+            if is_bert_frame(frame):
+                # 误码率测试帧: 请求原样回送，回送帧交给本端测试比对
+                self.bert.on_frame(port_source, frame)
+                return
+            if is_fec_frame(frame):
+                # 前向纠错信封: 纠错后按内层帧处理，无法纠正时丢弃
+                inner = self.fec.decode(port_source, frame)
+                if inner:
+                    self._handle_packet(inner, port_source)
+                return
+            if is_arq_frame(frame):
+                # 逐跳重传信封: 按序取出内层帧再按普通帧处理
+                for inner in self.arq.on_frame(port_source, frame):
+                    self._handle_packet(inner, port_source)
+                return
+            pkt = decode_packet(frame, self.codec_stats.get(port_source))
+            if not pkt: return
+            if pkt.p_type == TYPE_DV:
+                self._on_recv_dv(pkt.src, pkt.payload, port_source)
+            elif pkt.p_type == TYPE_DATA:
+                self._on_recv_data(pkt.src, pkt.dst, pkt.payload)
+            return
+
+        raw_data = decode_frame(frame)
+        if not raw_data: return
         try:
             parts = raw_data.split(SEPARATOR, 3) # 最多切分出前几个字段
             if len(parts) < 2: return
@@ -156,8 +375,10 @@ class RouterNode:
             p_type = parts[0]
             
             if p_type == TYPE_HELLO:
+                # HELLO|SenderID|Caps (旧节点不带能力字段)
                 sender_id = parts[1]
-                self._on_recv_hello(sender_id, port_source)
+                caps = parse_caps(parts[2]) if len(parts) > 2 else set()
+                self._on_recv_hello(sender_id, port_source, caps)
                 
             elif p_type == TYPE_DV:
                 # DV|SenderID|JSON
@@ -171,15 +392,21 @@ class RouterNode:
                 if len(parts) != 4: return
                 _, src_id, dst_id, payload = parts
                 self._on_recv_data(src_id, dst_id, payload)
+
+            elif p_type == TYPE_LINK:
+                self.autobaud.handle(port_source, raw_data)
                 
         except Exception as e:
-            Logger.debug(f"[Packet Error] {e} | Raw: {raw_data}")
+            Logger.debug("[Packet Error] %s | Raw: %s", e, raw_data)
 
-    def _on_recv_hello(self, sender_id, port):
-        """收到Hello包，更新邻居状态"""
+    def _on_recv_hello(self, sender_id, port, caps=frozenset()):
+        """收到Hello包，更新邻居状态及链路能力"""
         with self.neighbors_lock:
             # 记录或更新邻居
             self.neighbors[port] = {'id': sender_id, 'last_seen': time.time()}
+            # 每个 Hello 都重新协商: 邻居换成旧节点时自动回退到文本格式
+            self.link_caps[port] = self.local_caps & caps
+            self.arq.on_hello(port, self.link_caps[port])
             
             # 如果邻居不在路由表中（或者路由表中该邻居是不可达状态），立即标记为直连
             with self.rt_lock:
@@ -194,6 +421,9 @@ class RouterNode:
                         'next_hop_id': sender_id
                     }
 
+        # 双方都支持 AB 时由 ID 较小的一端发起升速
+        self.autobaud.on_hello(port, sender_id, caps)
+
     def _on_recv_dv(self, sender_id, dv_json, port):
         """
         收到距离向量，运行 Bellman-Ford
@@ -292,75 +522,87 @@ class RouterNode:
             
             # 发送
             dv_str = json.dumps(custom_dv)
-            packet = f"{TYPE_DV}{SEPARATOR}{self.my_id}{SEPARATOR}{dv_str}"
-            self._send_to_port(port_out, packet)
+            self._send_packet(port_out, TYPE_DV, self.my_id, payload=dv_str)
 
     def _on_recv_data(self, src_id, dst_id, payload):
         """收到数据包"""
         if dst_id == self.my_id:
-            Logger.info(f">>> 收到消息 [{src_id}]: {payload}")
-            print("> ", end="", flush=True)
+            Logger.info(">>> 收到消息 [%s]: %s", src_id, payload)
+            Logger.console("> ", end="")
             return
         
-        # 转发逻辑
+        # 转发逻辑 (只在锁内查表，发送在锁外进行)
         with self.rt_lock:
             route = self.routing_table.get(dst_id)
-            if route and route['cost'] < 999:
-                next_port = route['next_hop_port']
-                # 封装并转发
-                packet = f"{TYPE_DATA}{SEPARATOR}{src_id}{SEPARATOR}{dst_id}{SEPARATOR}{payload}"
-                Logger.info(f"[转发] {src_id}->{dst_id} via {next_port}")
-                self._send_to_port(next_port, packet)
-            else:
-                 Logger.warning(f"[丢弃] 目标不可达: {dst_id} (From {src_id})")
+            next_port = route['next_hop_port'] if route and route['cost'] < 999 else None
+
+        if next_port:
+            # 按下一跳链路的格式封装并转发
+            Logger.info("[转发] %s->%s via %s", src_id, dst_id, next_port)
+            self._send_packet(next_port, TYPE_DATA, src_id, dst_id, payload)
+        else:
+             Logger.warning("[丢弃] 目标不可达: %s (From %s)", dst_id, src_id)
 
     # === 定时任务 ===
 
+    def _send_hello(self):
+        """向所有激活端口广播 Hello 包 (始终为文本格式，携带本机能力用于协商)"""
+        packet = f"{TYPE_HELLO}{SEPARATOR}{self.my_id}"
+        if self.local_caps:
+            packet += f"{SEPARATOR}{format_caps(self.local_caps)}"
+        for port in list(self.active_ports.keys()): 
+            self._send_to_port(port, packet, PRIO_HELLO, arq=False)
+
     def _task_hello(self):
         """定期发送 Hello 包"""
         while self.running:
-            packet = f"{TYPE_HELLO}{SEPARATOR}{self.my_id}"
-            # 向所有激活端口广播
-            for port in list(self.active_ports.keys()): 
-                self._send_to_port(port, packet)
-            time.sleep(HELLO_INTERVAL)
+            self._send_hello()
+            time.sleep(self.hello_interval)
 
     def _task_broadcast_dv(self):
         """定期广播路由表 (DV)"""
         while self.running:
             self._send_dv_updates()
-            time.sleep(DV_INTERVAL)
+            time.sleep(self.dv_interval)
+
+    def _check_neighbor_timeout(self):
+        """检测一次邻居超时，并将经由超时端口的路由置为不可达"""
+        now = time.time()
+        timeout_ports = []
+        
+        with self.neighbors_lock:
+            for port, info in self.neighbors.items():
+                if now - info['last_seen'] > self.neighbor_timeout:
+                    Logger.warning(f"[连接断开] 邻居 {info['id']} ({port}) 超时")
+                    timeout_ports.append(port)
+            
+            # 清除超时邻居
+            for p in timeout_ports:
+                del self.neighbors[p]
+                self.link_caps.pop(p, None)
+                self.arq.reset(p)
+        
+        if timeout_ports:
+            # 触发路由表更新
+            with self.rt_lock:
+                for dest, info in self.routing_table.items():
+                    if info['next_hop_port'] in timeout_ports and dest != self.my_id:
+                        info['cost'] = 999 
+            # 链路中断: 回到初始速率，恢复后重新协商
+            for p in timeout_ports:
+                self.autobaud.on_link_lost(p)
 
     def _task_check_timeout(self):
         """检测邻居超时"""
         while self.running:
-            now = time.time()
-            timeout_ports = []
-            
-            with self.neighbors_lock:
-                for port, info in self.neighbors.items():
-                    if now - info['last_seen'] > NEIGHBOR_TIMEOUT:
-                        Logger.warning(f"[连接断开] 邻居 {info['id']} ({port}) 超时")
-                        timeout_ports.append(port)
-                
-                # 清除超时邻居
-                for p in timeout_ports:
-                    del self.neighbors[p]
-            
-            if timeout_ports:
-                # 触发路由表更新
-                with self.rt_lock:
-                    for dest, info in self.routing_table.items():
-                        if info['next_hop_port'] in timeout_ports and dest != self.my_id:
-                            info['cost'] = 999 
-            
+            self._check_neighbor_timeout()
             time.sleep(1)
 
     # === 用户交互 ===
     def _input_loop(self):
         while self.running:
             try:
-                cmd = input("> ").strip()
+                cmd = Logger.input("> ").strip()
                 if not cmd: continue
                 
                 parts = cmd.split()
@@ -368,6 +610,14 @@ class RouterNode:
                 
                 if op == 'table' or op == 't':
                     self._print_table()
+                elif op == 'ports' or op == 'p':
+                    self._print_ports()
+                elif op == 'fec':
+                    self._cmd_fec(parts[1:])
+                elif op == 'bert':
+                    self._cmd_bert(parts[1:])
+                elif op == 'capture':
+                    self._cmd_capture(parts[1:])
                 elif op == 'send' or op == 's':
                     # send ID Hello World
                     if len(parts) < 3:
@@ -378,12 +628,17 @@ class RouterNode:
                     self._initiate_send(target, msg)
                 elif op == 'exit' or op == 'quit':
                     self.running = False
+                    self.arq.stop()
                     print("正在退出...")
+                    for w in self.port_writers.values():
+                        w.close()
                     for s in self.active_ports.values():
                         s.close()
+                    if self.capture:
+                        self.capture.close()
                     sys.exit(0)
                 else:
-                    print("未知命令。可用: table, send, exit")
+                    print("未知命令。可用: table, ports, fec, bert, capture, send, exit")
                     
             except KeyboardInterrupt:
                 self.running = False
@@ -392,20 +647,97 @@ class RouterNode:
                 Logger.error(f"输入错误: {e}")
 
     def _print_table(self):
-        print("\n------- 当前路由表 (Distance Vector) -------")
-        print(f"{'Destination':<15} {'Cost':<10} {'Next Hop':<15} {'Interface':<10}")
-        print("-" * 55)
+        Logger.console("\n------- 当前路由表 (Distance Vector) -------")
+        Logger.console(f"{'Destination':<15} {'Cost':<10} {'Next Hop':<15} {'Interface':<15} {'Baud':<10}")
+        Logger.console("-" * 67)
         with self.rt_lock:
             for dest, info in self.routing_table.items():
-                print(f"{dest:<15} {info['cost']:<10} {info['next_hop_id']:<15} {info['next_hop_port']:<10}")
-        print("-" * 55)
+                baud = self.autobaud.rate(info['next_hop_port']) or '-'
+                Logger.console(f"{dest:<15} {info['cost']:<10} {info['next_hop_id']:<15} {info['next_hop_port']:<15} {baud:<10}")
+        Logger.console("-" * 67)
+
+    def _print_ports(self):
+        Logger.console("\n------- 端口发送队列 -------")
+        for line in format_port_stats(self.port_writers):
+            Logger.console(line)
+        Logger.console("-" * 102)
+        Logger.console("\n------- 负载压缩 -------")
+        for line in format_codec_stats(self.codec_stats):
+            Logger.console(line)
+        Logger.console("-" * 88)
+        if self.link_arq:
+            Logger.console("\n------- 逐跳重传 -------")
+            for line in format_arq_stats(self.arq):
+                Logger.console(line)
+            Logger.console("-" * 96)
+        Logger.console("\n------- 前向纠错 -------")
+        for line in format_fec_stats(self.fec):
+            Logger.console(line)
+        Logger.console("-" * 96)
+        if self.frame_errors:
+            Logger.console("帧处理异常 (已丢弃): " + ", ".join(f"{p} {n}" for p, n in self.frame_errors.items()))
+
+    def _cmd_fec(self, args):
+        """fec <端口> <K|off>: 设置端口 FEC 冗余度 (每 K 个数据块一个校验块，K 越小冗余越高)"""
+        if len(args) != 2 or args[0] not in self.active_ports:
+            print("用法: fec <端口> <K|off>  (K = 1~16，对端也需支持 FEC)")
+            return
+        try:
+            self.fec.set_level(args[0], args[1])
+        except ValueError as e:
+            Logger.warning(f"{e}")
+            return
+        level = self.fec.level(args[0])
+        Logger.info(f"[{args[0]}] FEC " + (f"冗余度 K={level}" if level else "已关闭"))
+
+    def _cmd_capture(self, args):
+        """capture [文件.pcapng]: 显示抓包统计；给出文件名时把当前环中的记录导出为 pcapng"""
+        if not self.capture:
+            Logger.console("抓包未开启 (启动时加 --capture <文件>)")
+            return
+        Logger.console(format_capture_stats(self.capture))
+        if args:
+            try:
+                n = self.capture.export(args[0])
+            except OSError as e:
+                Logger.error(f"导出失败: {e}")
+                return
+            Logger.success(f"已导出 {n} 条记录到 {args[0]}")
+
+    def _cmd_bert(self, args):
+        """bert <端口> [图样] [帧数] [帧长]: 对该端口的邻居做回送误码测试 (后台运行，完成后打印报告)"""
+        if not args or args[0] not in self.active_ports:
+            print(f"用法: bert <端口> [图样={DEFAULT_PATTERN}] [帧数=200] [帧长=128]")
+            return
+        port = args[0]
+        if CAP_BERT not in self.link_caps.get(port, ()):
+            Logger.warning(f"[{port}] 邻居未声明 BER 能力，无法测试")
+            return
+        try:
+            pattern = args[1] if len(args) > 1 else DEFAULT_PATTERN
+            frames = int(args[2]) if len(args) > 2 else 200
+            size = int(args[3]) if len(args) > 3 else 128
+        except ValueError:
+            print("帧数和帧长应为整数")
+            return
+
+        def worker():
+            try:
+                stats = self.bert.run(port, pattern, frames, size)
+            except ValueError as e:
+                Logger.warning(f"{e}")
+                return
+            Logger.info(f"[{port}] 误码率测试完成")
+            for line in format_ber_report(stats):
+                Logger.console(f"  {line}")
+
+        Logger.info(f"[{port}] 开始误码率测试: {pattern.upper()} x {frames} 帧 ({size} 字节)")
+        threading.Thread(target=worker, daemon=True).start()
 
     def _initiate_send(self, target_id, msg):
         """本机发起发送数据"""
         # 包格式: DATA|Src|Dst|Payload
-        packet = f"{TYPE_DATA}{SEPARATOR}{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{msg}"
-        
-        # 查表发送
+        # 查表 (锁内)，发送 (锁外)
         with self.rt_lock:
             route = self.routing_table.get(target_id)
             if not route:
@@ -414,14 +746,22 @@ class RouterNode:
             if route['cost'] >= 999:
                 Logger.warning(f"错误: 目标 {target_id} 当前不可达")
                 return
-            
             port = route['next_hop_port']
-            Logger.info(f"[发送] 目标:{target_id} 下一跳:{route['next_hop_id']} ({port})")
-            self._send_to_port(port, packet)
+            next_hop_id = route['next_hop_id']
+
+        Logger.info(f"[发送] 目标:{target_id} 下一跳:{next_hop_id} ({port})")
+        self._send_packet(port, TYPE_DATA, self.my_id, target_id, msg)
 
 if __name__ == '__main__':
-    node = RouterNode()
+    # python router.py --reactor  启用单线程 selectors 模式 (仅 Linux/macOS 串口)
+    # python router.py --config node.toml / --id A --ports COM3,COM4 [--baud 115200 --format 8N1 --no-console]
+    try:
+        config = load_node_config()
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
+        sys.exit(1)
+    node = RouterNode(use_reactor='--reactor' in sys.argv)
     try:
-        node.start()
+        node.start(config)
     except KeyboardInterrupt:
         print("\n强制退出")
@@ -23,7 +23,16 @@ import os
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_multiple_ports, create_serial_connection
+from utils import (Logger, select_multiple_ports, create_serial_connection, FrameBuffer, decode_frame,
+                   PortWriter, TokenBucket, format_port_stats, PRIO_HELLO, PRIO_CONTROL, PRIO_DATA,
+                   load_node_config, configure_node, wait_until_stopped)
+from wire import (MAGIC, CAP_BINARY, CAP_COMPRESS, CAP_ARQ, CAP_FEC, CAP_BERT, CodecStats, frame_length, resync_check, is_binary_frame,
+                  encode_packet, decode_packet, format_caps, parse_caps, format_codec_stats)
+from autobaud import LinkRateNegotiator, CAP_AUTOBAUD, TYPE_LINK
+from linkarq import LinkArq, is_arq_frame, format_arq_stats
+from fec import LinkFec, is_fec_frame, format_fec_stats
+from bert import LinkBert, is_bert_frame, format_ber_report, DEFAULT_PATTERN
+from capture import open_capture, capture_tap, format_capture_stats, DIR_RX, DIR_TX
 
 # === 协议常量 ===
 TYPE_HELLO = 'HELLO'
@@ -49,9 +58,16 @@ class ReliableRouterNode:
     def __init__(self):
         self.my_id = ""
         self.running = False
+
+        # 定时器与串口参数 (默认取模块常量，可由配置文件覆盖)
+        self.hello_interval = HELLO_INTERVAL
+        self.dv_interval = DV_INTERVAL
+        self.neighbor_timeout = NEIGHBOR_TIMEOUT
+        self.serial_params = {}
+        self.max_baudrate = None  # 速率协商上限 (见 autobaud.py)
         
         self.active_ports = {}
-        self.port_locks = {}
+        self.port_writers = {}  # port_name -> PortWriter (发送队列 + 专用写线程)
         self.neighbors = {} 
         self.neighbors_lock = threading.Lock()
 
@@ -59,6 +75,28 @@ class ReliableRouterNode:
         self.routing_table = {}
         self.rt_lock = threading.Lock()
 
+        # 链路能力协商 (二进制帧, 见 wire.py)
+        self.local_caps = {CAP_BINARY, CAP_COMPRESS, CAP_AUTOBAUD, CAP_FEC, CAP_BERT}
+        self.link_caps = {}
+        # codec_stats: port -> CodecStats (压缩比与压缩/解压 CPU 时间)
+        self.codec_stats = {}
+        self.autobaud = None  # LinkRateNegotiator，bring_up 时创建
+        # 逐跳重传 (见 linkarq.py)，link_arq 为 True 时启用
+        self.link_arq = False
+        self.arq = LinkArq(lambda port, data, prio: self._send_to_port(port, data, prio, arq=False),
+                           lambda port: getattr(self.active_ports.get(port), 'baudrate', None))
+        # 前向纠错 (见 fec.py): 冗余度来自 --fec / 配置项 fec (整数或 {端口: 冗余度})，可用 fec 命令修改
+        self.fec_levels = None
+        self.fec = LinkFec()
+        # 误码率测试 (见 bert.py): BERT 帧越过 ARQ/FEC 直接进入发送队列，测的是原始链路质量
+        self.bert = LinkBert(self._send_raw)
+        # 单帧处理异常 (畸形帧、对端版本不同等) 按端口计数，丢弃该帧后继续接收
+        self.frame_errors = {}
+        # 抓包 (见 capture.py): --capture / 配置项 capture 给出环形文件路径时在 bring_up 中打开，否则为 None
+        self.capture_path = None
+        self.capture_size = None
+        self.capture = None
+
         # === 实验五新增状态 ===
         self.seq_num = 0              # 发送序号 (简单的递增整数)
         self.expected_seqs = {}       # 接收端状态: {SrcID: NextExpectedSeq}
@@ -69,32 +107,68 @@ class ReliableRouterNode:
         self.corruption_count = 0     # 剩余干扰次数
         self.simulate_loss = False    # 模拟丢包开关
 
-    def start(self):
+    def start(self, config=None):
+        """启动节点；config 为启动配置 (utils.load_node_config)，为 None 或交互模式时交互选择串口和ID"""
         print("="*60)
         print("实验五：多机可靠传输 (Transport Layer)")
         print("="*60)
         
-        # 1. 选择串口
-        target_ports = select_multiple_ports("请选择要激活的串口 (用于构建网络)")
-        if not target_ports:
-             Logger.warning("未选择有效串口，程序退出。")
-             return
+        if config:
+            configure_node(self, config)
+        if config and not config['interactive']:
+            target_ports, my_id = config['ports'], config['id']
+        else:
+            # 1. 选择串口
+            target_ports = select_multiple_ports("请选择要激活的串口 (用于构建网络)")
+            if not target_ports:
+                 Logger.warning("未选择有效串口，程序退出。")
+                 return
+            
+            # 2. 本机ID
+            my_id = ""
+            while not my_id:
+                my_id = Logger.input("请输入本机ID (例如 A, B, PC1): ").strip()
+
+        if not self.bring_up(my_id, target_ports):
+            return
+
+        if config and not config.get('console', True):
+            wait_until_stopped(self)
+            return
+
+        Logger.console("命令: send <Dest> <Msg> | table | ports | bert | corrupt on/off | loss on/off | help | exit")
+        Logger.console("输入 'help' 获取详细帮助")
+        Logger.console("="*60)
         
-        # 2. 本机ID
-        while not self.my_id:
-            self.my_id = input("请输入本机ID (例如 A, B, PC1): ").strip()
+        self._input_loop()
+
+    def bring_up(self, my_id, target_ports):
+        """非交互启动: 打开串口并启动后台线程后立即返回，成功返回 True"""
+        self.my_id = my_id
 
         # Init Routing Table
         self.routing_table[self.my_id] = {'cost': 0, 'next_hop_port': 'LOCAL', 'next_hop_id': self.my_id}
 
         self.running = True
+        self.autobaud = LinkRateNegotiator(self.my_id, self._port_control, self.max_baudrate)
+        if self.link_arq:
+            self.local_caps.add(CAP_ARQ)
+            self.arq.start()
+        try:
+            self.fec = LinkFec(self.fec_levels)
+        except ValueError as e:
+            Logger.error(f"FEC 配置无效，已关闭: {e}")
+        self.capture = open_capture(self.capture_path, self.capture_size)
         
         # Start Listeners
         for port in target_ports:
-            ser = create_serial_connection(port, timeout=0.1)
+            ser = create_serial_connection(port, timeout=0.1, **self.serial_params)
             if ser:
                 self.active_ports[port] = ser
-                self.port_locks[port] = threading.Lock()
+                self.codec_stats[port] = CodecStats()
+                self.port_writers[port] = PortWriter(ser, port, pacer=TokenBucket.for_serial(ser),
+                                                     tap=capture_tap(self.capture, port, DIR_TX))
+                self.autobaud.register(port, ser.baudrate)
                 
                 t = threading.Thread(target=self._listen_port, args=(port,), daemon=True)
                 t.start()
@@ -104,7 +178,8 @@ class ReliableRouterNode:
 
         if not self.active_ports:
             Logger.error("无可用端口，退出")
-            return
+            self.running = False
+            return False
 
         # Start Background Tasks
         threading.Thread(target=self._task_hello, daemon=True).start()
@@ -112,40 +187,82 @@ class ReliableRouterNode:
         threading.Thread(target=self._task_check_timeout, daemon=True).start()
         
         Logger.success("系统启动完成。")
-        print("命令: send <Dest> <Msg> | table | corrupt on/off | loss on/off | help | exit")
-        print("输入 'help' 获取详细帮助")
-        print("="*60)
-        
-        self._input_loop()
+        return True
 
     def _listen_port(self, port_name):
         ser = self.active_ports[port_name]
+        framer = FrameBuffer(magic=MAGIC, frame_length=frame_length,
+                             tap=capture_tap(self.capture, port_name, DIR_RX),
+                             resync=self._resync_check(port_name))
         while self.running and ser.is_open:
             try:
-                if ser.in_waiting:
-                    line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if line:
-                        self._handle_packet(line, port_name)
-                else:
-                    time.sleep(0.01)
+                for frame in framer.read_from(ser):
+                    self._receive_frame(frame, port_name)
             except Exception as e:
                 Logger.error(f"[{port_name}] 读取错误: {e}")
                 break
 
-    def _send_to_port(self, port_name, packet_str):
-        if port_name not in self.active_ports:
+    def _receive_frame(self, frame, port_name):
+        """处理接收线程切出的一帧: 处理异常只计数并丢弃该帧，不结束该端口的接收"""
+        try:
+            self._handle_packet(frame, port_name)
+        except Exception as e:
+            self.frame_errors[port_name] = self.frame_errors.get(port_name, 0) + 1
+            Logger.warning("[%s] 丢弃无法处理的帧: %s", port_name, e)
+
+    def _send_to_port(self, port_name, packet, prio=PRIO_DATA, arq=True):
+        """按优先级入队发送 (非阻塞，由该端口写线程写串口)；链路协商了 ARQ 时经逐跳重传发送"""
+        writer = self.port_writers.get(port_name)
+        if not writer:
             return False
-        
-        with self.port_locks[port_name]:
-            try:
-                data = (packet_str + '\n').encode('utf-8')
-                self.active_ports[port_name].write(data)
-                return True
-            except Exception as e:
-                Logger.error(f"[{port_name}] 发送错误: {e}")
-                return False
+        data = packet if isinstance(packet, bytes) else (packet + '\n').encode('utf-8')
+        if arq and self.arq.active(port_name):
+            return self.arq.send(port_name, data, prio)
+        # FEC 在 ARQ 之下: 重传的信封同样经过纠错编码
+        data = self.fec.encode(port_name, data, self.link_caps.get(port_name, ()))
+        return writer.send(data, prio)
     
-    def _send_to_port_with_simulation(self, port_name, packet_str):
+    def _resync_check(self, port):
+        """分帧重新同步条件: 只在已协商二进制格式的链路上，且只认通过校验的信封首部 (见 wire.resync_check)"""
+        return resync_check(lambda: CAP_BINARY in self.link_caps.get(port, ()))
+
+    def _send_raw(self, port_name, data):
+        """不经 ARQ/FEC 直接放入端口发送队列 (BERT 帧)"""
+        writer = self.port_writers.get(port_name)
+        return writer.send(data, PRIO_DATA) if writer else False
+
+    def _port_control(self, port_name, data=b'', baudrate=None):
+        """速率协商: 越过发送队列立即写出控制帧，写完后切换波特率"""
+        writer = self.port_writers.get(port_name)
+        return writer.control(data, baudrate) if writer else False
+
+    def _encode_packet(self, port_name, p_type, src, dst='', payload=''):
+        """按该链路协商的格式封装数据包: 二进制帧 (bytes) 或文本帧 (str)"""
+        caps = self.link_caps.get(port_name, ())
+        if CAP_BINARY in caps:
+            try:
+                # 双方都声明了 Z 时，足够长的负载会被压缩
+                return encode_packet(p_type, src, dst, payload, compress=CAP_COMPRESS in caps,
+                                     stats=self.codec_stats.get(port_name))
+            except ValueError:
+                pass  # 字段超长，回退到文本格式
+        if p_type == TYPE_DV:
+            return f"{TYPE_DV}{SEPARATOR}{src}{SEPARATOR}{payload}"
+        return f"{TYPE_DATA}{SEPARATOR}{src}{SEPARATOR}{dst}{SEPARATOR}{payload}"
+
+    def _send_packet(self, port_name, p_type, src, dst='', payload='', prio=None):
+        if prio is None:
+            prio = PRIO_CONTROL if p_type == TYPE_DV else PRIO_DATA
+        return self._send_to_port(port_name, self._encode_packet(port_name, p_type, src, dst, payload), prio)
+
+    def _transport_priority(self, payload):
+        """运输层 ACK / SYN-ACK 与路由控制同级，避免被大量数据挤占导致发送方超时重传"""
+        t_parts = payload.split(SEPARATOR, 5)
+        if len(t_parts) == 6 and t_parts[4] in (TRANS_TYPE_ACK, TRANS_TYPE_SYNACK):
+            return PRIO_CONTROL
+        return PRIO_DATA
+
+    def _send_to_port_with_simulation(self, port_name, packet, prio=PRIO_DATA):
         """支持模拟的发送（仅用于可靠消息）"""
         if port_name not in self.active_ports:
             return False
@@ -156,9 +273,34 @@ class ReliableRouterNode:
             self.simulate_loss = False  # 只模拟一次
             return True  # 返回True表示"发送"了，但实际没有
         
-        return self._send_to_port(port_name, packet_str)
+        return self._send_to_port(port_name, packet, prio)
+
+    def _handle_packet(self, frame, port_source):
+        if is_binary_frame(frame):
+            if is_bert_frame(frame):
+                # 误码率测试帧: 请求原样回送，回送帧交给本端测试比对
+                self.bert.on_frame(port_source, frame)
+                return
+            if is_fec_frame(frame):
+                # 前向纠错信封: 纠错后按内层帧处理，无法纠正时丢弃
+                inner = self.fec.decode(port_source, frame)
+                if inner:
+                    self._handle_packet(inner, port_source)
+                return
+            if is_arq_frame(frame):
+                for inner in self.arq.on_frame(port_source, frame):
+                    self._handle_packet(inner, port_source)
+                return
+            pkt = decode_packet(frame, self.codec_stats.get(port_source))
+            if not pkt: return
+            if pkt.p_type == TYPE_DV:
+                self._on_recv_dv(pkt.src, pkt.payload, port_source)
+            elif pkt.p_type == TYPE_DATA:
+                self._on_recv_data(pkt.src, pkt.dst, pkt.payload)
+            return
 
-    def _handle_packet(self, raw_data, port_source):
+        raw_data = decode_frame(frame)
+        if not raw_data: return
         try:
             parts = raw_data.split(SEPARATOR, 3) 
             if len(parts) < 2: return
@@ -166,8 +308,10 @@ class ReliableRouterNode:
             p_type = parts[0]
             
             if p_type == TYPE_HELLO:
+                # HELLO|SenderID|Caps (旧节点不带能力字段)
                 sender_id = parts[1]
-                self._on_recv_hello(sender_id, port_source)
+                caps = parse_caps(parts[2]) if len(parts) > 2 else set()
+                self._on_recv_hello(sender_id, port_source, caps)
                 
             elif p_type == TYPE_DV:
                 if len(parts) < 3: return
@@ -180,14 +324,20 @@ class ReliableRouterNode:
                 if len(parts) != 4: return
                 _, src_id, dst_id, payload = parts
                 self._on_recv_data(src_id, dst_id, payload)
+
+            elif p_type == TYPE_LINK:
+                # LINK|SenderID|Op|... (链路速率协商)
+                self.autobaud.handle(port_source, raw_data)
                 
         except Exception as e:
-            Logger.debug(f"[Packet Error] {e} | Raw: {raw_data}")
+            Logger.debug("[Packet Error] %s | Raw: %s", e, raw_data)
 
     # === 路由协议处理 (Exp 3/4) ===
-    def _on_recv_hello(self, sender_id, port):
+    def _on_recv_hello(self, sender_id, port, caps=frozenset()):
         with self.neighbors_lock:
             self.neighbors[port] = {'id': sender_id, 'last_seen': time.time()}
+            self.link_caps[port] = self.local_caps & caps
+            self.arq.on_hello(port, self.link_caps[port])
             with self.rt_lock:
                 current_entry = self.routing_table.get(sender_id)
                 if not current_entry or current_entry['cost'] > 1:
@@ -196,6 +346,7 @@ class ReliableRouterNode:
                         'next_hop_port': port,
                         'next_hop_id': sender_id
                     }
+        self.autobaud.on_hello(port, sender_id, caps)
 
     def _on_recv_dv(self, sender_id, dv_json, port):
         try:
@@ -249,14 +400,12 @@ class ReliableRouterNode:
         
         # Transport Frame Str
         tf_str = f"0{SEPARATOR}0{SEPARATOR}{seq_ack}{SEPARATOR}{chk}{SEPARATOR}{t_type}{SEPARATOR}"
-        # Encap in Network Packet
-        packet = f"{TYPE_DATA}{SEPARATOR}{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{tf_str}"
         
-        # 路由发送
-        Logger.info(f"[Transport DEBUG] 正在回复 {t_type} 给 {target_id} Seq={seq_ack} ...") 
-        if not self._network_send(target_id, packet):
+        # 路由发送 (由网络层封装为 DATA 包)
+        Logger.debug("[Transport] 正在回复 %s 给 %s Seq=%s ...", t_type, target_id, seq_ack) 
+        if not self._network_send(target_id, tf_str):
              Logger.error(f"[Transport] 关键错误! 收到消息但无法回复 {t_type} 给 {target_id} (没有回程路由!)")
-             print(f"!!! 请检查本机的路由表 (table命令)，确认是否有去往 {target_id} 的路径 !!!")
+             Logger.console(f"!!! 请检查本机的路由表 (table命令)，确认是否有去往 {target_id} 的路径 !!!")
         else:
              pass 
 
@@ -292,35 +441,35 @@ class ReliableRouterNode:
                 if t_type == TRANS_TYPE_SYN or t_type == TRANS_TYPE_DATA:
                     is_syn = (t_type == TRANS_TYPE_SYN)
                     if is_syn:
-                        Logger.info(f"[RX SYN] 新会话请求 来自{src_id} InitSeq={seq}: {body}")
+                        Logger.info("[RX SYN] 新会话请求 来自%s InitSeq=%s: %s", src_id, seq, body)
                         # 对于 SYN, 直接接受并重置期望序列号
                         self.expected_seqs[src_id] = seq + 1 
                         
                         if body:
-                            Logger.info(f"    >>> [交付应用层] {body}")
+                            Logger.info("    >>> [交付应用层] %s", body)
                             
                         # 发送 SYN-ACK
                         self._transport_send_ack(src_id, seq, is_syn_ack=True)
 
                     else:
                         # 普通数据包
-                        Logger.info(f"[RX] 收到数据 来自{src_id} Seq={seq}: {body}")
+                        Logger.info("[RX] 收到数据 来自%s Seq=%s: %s", src_id, seq, body)
                         expected = self.expected_seqs.get(src_id, seq) # default to seq if not found?
                         
                         if seq == expected:
                             self._transport_send_ack(src_id, seq, is_syn_ack=False)
                             if body: 
-                                Logger.info(f"    >>> [交付应用层] {body}")
+                                Logger.info("    >>> [交付应用层] %s", body)
                             self.expected_seqs[src_id] = seq + 1
                         elif seq < expected:
-                            Logger.warning(f"    [重复帧] Seq={seq}, 期望={expected}. 发送ACK.")
+                            Logger.warning("    [重复帧] Seq=%s, 期望=%s. 发送ACK.", seq, expected)
                             self._transport_send_ack(src_id, seq, is_syn_ack=False)
                         else:
-                            Logger.warning(f"    [失序帧] Seq={seq}, 期望={expected}. 暂不应答.")
+                            Logger.warning("    [失序帧] Seq=%s, 期望=%s. 暂不应答.", seq, expected)
 
                 elif t_type == TRANS_TYPE_ACK or t_type == TRANS_TYPE_SYNACK:
                     # 收到ACK或SYN-ACK
-                    Logger.info(f"[RX] 收到 {t_type} 来自{src_id} AckSeq={seq}")
+                    Logger.info("[RX] 收到 %s 来自%s AckSeq=%s", t_type, src_id, seq)
                     if seq == self.seq_num: 
                         self.received_ack_seq = seq
                         self.ack_event.set()
@@ -332,19 +481,19 @@ class ReliableRouterNode:
                 Logger.error(f"解析错误: {e}")
             return
         
-        # --- 转发 ---
+        # --- 转发 (锁内查表，锁外发送) ---
         with self.rt_lock:
             route = self.routing_table.get(dst_id)
-            if route and route['cost'] < 999:
-                next_port = route['next_hop_port']
-                packet = f"{TYPE_DATA}{SEPARATOR}{src_id}{SEPARATOR}{dst_id}{SEPARATOR}{payload}"
-                Logger.info(f"[Forward] {src_id}->{dst_id} via {next_port}")
-                self._send_to_port(next_port, packet)
-            else:
-                Logger.warning(f"[Drop] 目标不可达: {dst_id}")
+            next_port = route['next_hop_port'] if route and route['cost'] < 999 else None
 
-    def _network_send(self, target_id, packet_content):
-        """查找路由并发送完整网络层包（支持模拟丢包）"""
+        if next_port:
+            Logger.info("[Forward] %s->%s via %s", src_id, dst_id, next_port)
+            self._send_packet(next_port, TYPE_DATA, src_id, dst_id, payload, self._transport_priority(payload))
+        else:
+            Logger.warning("[Drop] 目标不可达: %s", dst_id)
+
+    def _network_send(self, target_id, payload):
+        """查找路由，封装为网络层 DATA 包并发送（支持模拟丢包）"""
         with self.rt_lock:
             route = self.routing_table.get(target_id)
             if not route:
@@ -353,10 +502,11 @@ class ReliableRouterNode:
             if route['cost'] >= 999:
                 Logger.error(f"错误: 目标 {target_id} 当前不可达")
                 return False
-            
             port = route['next_hop_port']
-            self._send_to_port_with_simulation(port, packet_content)
-            return True
+
+        packet = self._encode_packet(port, TYPE_DATA, self.my_id, target_id, payload)
+        self._send_to_port_with_simulation(port, packet, self._transport_priority(payload))
+        return True
 
     def _initiate_reliable_send(self, target_id, msg):
         """停等协议发送逻辑 (Blocking)"""
@@ -367,7 +517,7 @@ class ReliableRouterNode:
         t_type = TRANS_TYPE_SYN
         
         Logger.info(f"\n=== 开始可靠发送到 {target_id} ===")
-        print(f"[TX] 发送 SYN (Seq={seq}, 数据='{msg}')")
+        Logger.console(f"[TX] 发送 SYN (Seq={seq}, 数据='{msg}')")
         
         syn_ack_received = False
         for attempt in range(MAX_RETRIES):
@@ -385,13 +535,12 @@ class ReliableRouterNode:
                 self.simulate_error = False
 
             tf_str = f"0{SEPARATOR}0{SEPARATOR}{seq}{SEPARATOR}{chk}{SEPARATOR}{t_type}{SEPARATOR}{msg}"
-            packet = f"{TYPE_DATA}{SEPARATOR}{self.my_id}{SEPARATOR}{target_id}{SEPARATOR}{tf_str}"
 
-            if not self._network_send(target_id, packet):
+            if not self._network_send(target_id, tf_str):
                 Logger.error("发送失败: 网络层无法发送")
                 break
             
-            print(f"[TX] SYN发送 (尝试 {attempt+1}/{MAX_RETRIES})... 等待SYN-ACK")
+            Logger.console(f"[TX] SYN发送 (尝试 {attempt+1}/{MAX_RETRIES})... 等待SYN-ACK")
             
             self.ack_event.clear()
             self.received_ack_seq = -1
@@ -415,10 +564,13 @@ class ReliableRouterNode:
     # === 定时任务 (Hello/DV) ===
     def _task_hello(self):
         while self.running:
+            # Hello 始终为文本格式，携带本机能力用于协商
             packet = f"{TYPE_HELLO}{SEPARATOR}{self.my_id}"
+            if self.local_caps:
+                packet += f"{SEPARATOR}{format_caps(self.local_caps)}"
             for port in list(self.active_ports.keys()): 
-                self._send_to_port(port, packet)
-            time.sleep(HELLO_INTERVAL)
+                self._send_to_port(port, packet, PRIO_HELLO, arq=False)
+            time.sleep(self.hello_interval)
 
     def _task_broadcast_dv(self):
         while self.running:
@@ -427,10 +579,9 @@ class ReliableRouterNode:
                 for dest, info in self.routing_table.items():
                     dv_snapshot[dest] = {'cost': info['cost']}
             dv_str = json.dumps(dv_snapshot)
-            packet = f"{TYPE_DV}{SEPARATOR}{self.my_id}{SEPARATOR}{dv_str}"
             for port in list(self.active_ports.keys()):
-                self._send_to_port(port, packet)
-            time.sleep(DV_INTERVAL)
+                self._send_packet(port, TYPE_DV, self.my_id, payload=dv_str)
+            time.sleep(self.dv_interval)
 
     def _task_check_timeout(self):
         while self.running:
@@ -438,23 +589,27 @@ class ReliableRouterNode:
             timeout_ports = []
             with self.neighbors_lock:
                 for port, info in self.neighbors.items():
-                    if now - info['last_seen'] > NEIGHBOR_TIMEOUT:
+                    if now - info['last_seen'] > self.neighbor_timeout:
                         Logger.warning(f"[连接断开] 邻居 {info['id']} ({port}) 超时")
                         timeout_ports.append(port)
                 for p in timeout_ports:
                     del self.neighbors[p]
+                    self.link_caps.pop(p, None)
+                    self.arq.reset(p)
             if timeout_ports:
                 with self.rt_lock:
                     for dest, info in self.routing_table.items():
                         if info['next_hop_port'] in timeout_ports and dest != self.my_id:
                             info['cost'] = 999
+                for p in timeout_ports:
+                    self.autobaud.on_link_lost(p)
             time.sleep(1)
 
     # === UI ===
     def _input_loop(self):
         while self.running:
             try:
-                cmd = input("> ").strip()
+                cmd = Logger.input("> ").strip()
                 if not cmd: continue
                 parts = cmd.split(maxsplit=2)
                 op = parts[0].lower()
@@ -490,11 +645,22 @@ class ReliableRouterNode:
                     target = parts[1]
                     msg = parts[2]
                     self._initiate_reliable_send(target, msg)
+                elif op == 'ports' or op == 'p':
+                    self._print_ports()
+                elif op == 'fec':
+                    self._cmd_fec(cmd.split()[1:])   # parts 按 send 的消息最多切成 3 段，这里需要全部参数
+                elif op == 'bert':
+                    self._cmd_bert(cmd.split()[1:])
+                elif op == 'capture':
+                    self._cmd_capture(parts[1:])
                 elif op == 'help' or op == 'h' or op == '?':
                     self._print_help()
                 elif op == 'exit' or op == 'quit':
                     self.running = False
+                    self.arq.stop()
+                    for w in self.port_writers.values(): w.close()
                     for s in self.active_ports.values(): s.close()
+                    if self.capture: self.capture.close()
                     sys.exit(0)
                 else:
                     print(f"未知命令: {op}。输入 'help' 查看帮助。")
@@ -509,6 +675,10 @@ class ReliableRouterNode:
 === 可靠传输路由节点 - 命令帮助 ===
 命令列表:
   table (t)           - 显示当前路由表
+  ports (p)           - 显示各端口发送队列统计 (排队/丢弃/写入次数)
+  fec <端口> <K|off>  - 设置端口前向纠错冗余度 (每 K 个数据块一个校验块)
+  bert <端口> [图样] [帧数] [帧长] - 与该端口邻居做回送误码率测试 (PRBS7/9/15, ALT, ...)
+  capture [文件.pcapng] - 显示抓包统计 / 导出为 pcapng (需以 --capture 启动)
   send <ID> <MSG>     - 向目标ID发送可靠消息 (停等协议)
   corrupt on/off      - 开启/关闭模拟校验错误
   loss on/off         - 开启/关闭模拟丢包
@@ -516,21 +686,105 @@ class ReliableRouterNode:
   exit (quit)         - 退出程序
         """)
 
+    def _print_ports(self):
+        Logger.console("\n" + "="*60)
+        Logger.console("端口发送队列")
+        Logger.console("="*60)
+        for line in format_port_stats(self.port_writers):
+            Logger.console(line)
+        Logger.console("\n负载压缩 (压缩比 = 发送字节/原始字节)")
+        for line in format_codec_stats(self.codec_stats):
+            Logger.console(line)
+        if self.link_arq:
+            Logger.console("\n逐跳重传 (Retx 超时重传 / Fast 快速重传 / Reord 乱序缓存)")
+            for line in format_arq_stats(self.arq):
+                Logger.console(line)
+        Logger.console("\n前向纠错 (Corrected 已纠正 / Uncorr 无法纠正而丢弃)")
+        for line in format_fec_stats(self.fec):
+            Logger.console(line)
+        if self.frame_errors:
+            Logger.console("\n帧处理异常 (已丢弃): " + ", ".join(f"{p} {n}" for p, n in self.frame_errors.items()))
+        Logger.console("="*60 + "\n")
+
+    def _cmd_fec(self, args):
+        """fec <端口> <K|off>: 设置端口 FEC 冗余度 (每 K 个数据块一个校验块，K 越小冗余越高)"""
+        if len(args) != 2 or args[0] not in self.active_ports:
+            print("用法: fec <端口> <K|off>  (K = 1~16，对端也需支持 FEC)")
+            return
+        try:
+            self.fec.set_level(args[0], args[1])
+        except ValueError as e:
+            Logger.warning(f"{e}")
+            return
+        level = self.fec.level(args[0])
+        Logger.info(f"[{args[0]}] FEC " + (f"冗余度 K={level}" if level else "已关闭"))
+
+    def _cmd_capture(self, args):
+        """capture [文件.pcapng]: 显示抓包统计；给出文件名时把当前环中的记录导出为 pcapng"""
+        if not self.capture:
+            Logger.console("抓包未开启 (启动时加 --capture <文件>)")
+            return
+        Logger.console(format_capture_stats(self.capture))
+        if args:
+            try:
+                n = self.capture.export(args[0])
+            except OSError as e:
+                Logger.error(f"导出失败: {e}")
+                return
+            Logger.success(f"已导出 {n} 条记录到 {args[0]}")
+
+    def _cmd_bert(self, args):
+        """bert <端口> [图样] [帧数] [帧长]: 对该端口的邻居做回送误码测试 (后台运行，完成后打印报告)"""
+        if not args or args[0] not in self.active_ports:
+            print(f"用法: bert <端口> [图样={DEFAULT_PATTERN}] [帧数=200] [帧长=128]")
+            return
+        port = args[0]
+        if CAP_BERT not in self.link_caps.get(port, ()):
+            Logger.warning(f"[{port}] 邻居未声明 BER 能力，无法测试")
+            return
+        try:
+            pattern = args[1] if len(args) > 1 else DEFAULT_PATTERN
+            frames = int(args[2]) if len(args) > 2 else 200
+            size = int(args[3]) if len(args) > 3 else 128
+        except ValueError:
+            print("帧数和帧长应为整数")
+            return
+
+        def worker():
+            try:
+                stats = self.bert.run(port, pattern, frames, size)
+            except ValueError as e:
+                Logger.warning(f"{e}")
+                return
+            Logger.info(f"[{port}] 误码率测试完成")
+            for line in format_ber_report(stats):
+                Logger.console(f"  {line}")
+
+        Logger.info(f"[{port}] 开始误码率测试: {pattern.upper()} x {frames} 帧 ({size} 字节)")
+        threading.Thread(target=worker, daemon=True).start()
+
     def _print_table(self):
-        print("\n" + "="*60)
-        print("当前路由表 (Distance Vector)")
-        print("="*60)
-        print(f"{'目标':<10} {'开销':<10} {'下一跳':<10} {'接口':<15}")
-        print("-"*60)
+        Logger.console("\n" + "="*60)
+        Logger.console("当前路由表 (Distance Vector)")
+        Logger.console("="*60)
+        Logger.console(f"{'目标':<10} {'开销':<10} {'下一跳':<10} {'接口':<15} {'速率':<10}")
+        Logger.console("-"*60)
         with self.rt_lock:
             for dest, info in self.routing_table.items():
                 cost_str = str(info['cost']) if info['cost'] < 999 else "∞"
-                print(f"{dest:<10} {cost_str:<10} {info['next_hop_id']:<10} {info['next_hop_port']:<15}")
-        print("="*60 + "\n")
+                baud = self.autobaud.rate(info['next_hop_port']) or '-'
+                Logger.console(f"{dest:<10} {cost_str:<10} {info['next_hop_id']:<10} {info['next_hop_port']:<15} {baud:<10}")
+        Logger.console("="*60 + "\n")
 
 if __name__ == '__main__':
+    # python reliable_router.py --config node.toml / --id A --ports COM3,COM4 [--baud 115200 --no-console]
+    try:
+        config = load_node_config()
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
+        sys.exit(1)
     node = ReliableRouterNode()
     try:
-        node.start()
+        node.start(config)
     except KeyboardInterrupt:
         pass
@@ -21,7 +21,16 @@ except ImportError:
 
 # 导入 utils
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from utils import Logger, select_multiple_ports, create_serial_connection
+from utils import (Logger, select_multiple_ports, create_serial_connection, FrameBuffer, decode_frame,
+                   PortWriter, TokenBucket, format_port_stats, PRIO_HELLO, PRIO_CONTROL, PRIO_DATA,
+                   load_node_config, configure_node, wait_until_stopped, PortSupervisor)
+from wire import (MAGIC, CAP_BINARY, CAP_COMPRESS, CAP_ARQ, CAP_FEC, CAP_BERT, CodecStats, frame_length, resync_check, is_binary_frame,
+                  encode_packet, decode_packet, format_caps, parse_caps, format_codec_stats)
+from autobaud import LinkRateNegotiator, CAP_AUTOBAUD, TYPE_LINK
+from linkarq import LinkArq, is_arq_frame, format_arq_stats
+from fec import LinkFec, is_fec_frame, format_fec_stats
+from bert import LinkBert, is_bert_frame, format_ber_report, DEFAULT_PATTERN
+from capture import open_capture, capture_tap, format_capture_stats, DIR_RX, DIR_TX
 
 # === 协议常量 ===
 TYPE_HELLO = 'HELLO'
@@ -51,14 +60,45 @@ class NetworkNode:
         self.my_id = ""
         self.running = False
         self.viz_url = VIZ_SERVER_URL # Default
+
+        # 定时器与串口参数 (默认取模块常量，可由配置文件覆盖)
+        self.hello_interval = HELLO_INTERVAL
+        self.dv_interval = DV_INTERVAL
+        self.neighbor_timeout = NEIGHBOR_TIMEOUT
+        self.serial_params = {}
+        self.max_baudrate = None  # 速率协商上限 (见 autobaud.py)
         
         self.active_ports = {}
-        self.port_locks = {}
+        self.port_writers = {}  # port -> PortWriter (发送队列 + 专用写线程)
+        self.ports_lock = threading.Lock()  # 串口打开/关闭 (监听线程、写线程、监督线程都会触发)
+        self.port_supervisor = None         # 故障端口的热插拔恢复 (见 utils.PortSupervisor)
         self.neighbors = {} 
         self.neighbors_lock = threading.Lock()
 
         self.routing_table = {}
         self.rt_lock = threading.Lock()
+
+        # 链路能力协商 (二进制帧, 见 wire.py)
+        self.local_caps = {CAP_BINARY, CAP_COMPRESS, CAP_AUTOBAUD, CAP_FEC, CAP_BERT}
+        self.link_caps = {}
+        # codec_stats: port -> CodecStats (压缩比与压缩/解压 CPU 时间)
+        self.codec_stats = {}
+        self.autobaud = None  # LinkRateNegotiator，bring_up 时创建
+        # 逐跳重传 (见 linkarq.py)，link_arq 为 True 时启用
+        self.link_arq = False
+        self.arq = LinkArq(lambda port, data, prio: self._send_bytes(port, data, prio, arq=False),
+                           lambda port: getattr(self.active_ports.get(port), 'baudrate', None))
+        # 前向纠错 (见 fec.py): 冗余度来自 --fec / 配置项 fec (整数或 {端口: 冗余度})，可用 fec 命令修改
+        self.fec_levels = None
+        self.fec = LinkFec()
+        # 误码率测试 (见 bert.py): BERT 帧越过 ARQ/FEC 直接进入发送队列，测的是原始链路质量
+        self.bert = LinkBert(self._send_raw)
+        # 单帧处理异常 (畸形帧、对端版本不同等) 按端口计数，丢弃该帧后继续接收
+        self.frame_errors = {}
+        # 抓包 (见 capture.py): --capture / 配置项 capture 给出环形文件路径时在 bring_up 中打开，否则为 None
+        self.capture_path = None
+        self.capture_size = None
+        self.capture = None
         
         # Ping/Tracert State Management
         self.icmp_events = {}
@@ -78,40 +118,64 @@ class NetworkNode:
         # 同时打印到本地，但在非阻塞输入时可能会乱序
         # print(f"[LOG] {msg}") 
 
-    def start(self):
+    def start(self, config=None):
+        """启动节点；config 为启动配置 (utils.load_node_config)，为 None 或交互模式时交互选择串口和ID"""
         print("="*60)
         print("实验六：网络管理工具 (Ping / Traceroute)")
         
-        # 1. 选择串口
-        ports = select_multiple_ports("选择要激活的串口")
-        # 2. 本机ID
-        while not self.my_id:
-            self.my_id = input("本机ID: ").strip()
-
-        # 3. 配置可视化服务器地址
-        print("\n[可选] 配置可视化服务器 IP")
-        print("如果您是作为节点加入网络，请输入后端服务器IP（例如 192.168.1.100）")
-        print("如果在本机运行后端，直接回车即可 (默认: localhost)")
-        host_ip = input("Server IP [localhost]: ").strip()
-        if host_ip:
-            self.viz_url = f"http://{host_ip}:8000/api/report"
+        if config:
+            configure_node(self, config)
+        if config and not config['interactive']:
+            # 串口、ID、可视化地址均来自配置，不扫描串口
+            ports, my_id = config['ports'], config['id']
+        else:
+            # 1. 选择串口
+            ports = select_multiple_ports("选择要激活的串口")
+            # 2. 本机ID
+            my_id = ""
+            while not my_id:
+                my_id = Logger.input("本机ID: ").strip()
+
+            # 3. 配置可视化服务器地址 (已由 --viz-url 给出时不再询问)
+            if 'viz_url' not in (config or {}):
+                print("\n[可选] 配置可视化服务器 IP")
+                print("如果您是作为节点加入网络，请输入后端服务器IP（例如 192.168.1.100）")
+                print("如果在本机运行后端，直接回车即可 (默认: localhost)")
+                host_ip = Logger.input("Server IP [localhost]: ").strip()
+                if host_ip:
+                    self.viz_url = f"http://{host_ip}:8000/api/report"
         print(f"可视化上报地址: {self.viz_url}\n")
         
+        self.bring_up(my_id, ports, report_viz=config.get('report_viz', True) if config else True)
+        if config and not config.get('console', True):
+            wait_until_stopped(self)
+            return
+        Logger.success("系统就绪。可用命令: ping, tracert, table, ports, bert, capture, send, exit")
+        self._input_loop()
+
+    def bring_up(self, my_id, ports, report_viz=True):
+        """
+        非交互启动: 打开串口、启动后台任务后立即返回
+        :param report_viz: 是否向可视化后端上报 (同进程内运行大量节点时可关闭)
+        """
+        self.my_id = my_id
         self.routing_table[self.my_id] = {'cost': 0, 'next_hop_port': 'LOCAL', 'next_hop_id': self.my_id}
         self.running = True
+        self.autobaud = LinkRateNegotiator(self.my_id, self._port_control, self.max_baudrate)
+        if self.link_arq:
+            self.local_caps.add(CAP_ARQ)
+            self.arq.start()
+        try:
+            self.fec = LinkFec(self.fec_levels)
+        except ValueError as e:
+            Logger.error(f"FEC 配置无效，已关闭: {e}")
+        self.capture = open_capture(self.capture_path, self.capture_size)
 
+        # 端口故障 (含启动时未能打开的端口) 由监督线程扫描并按退避重新打开
+        self.port_supervisor = PortSupervisor(self._reopen_port).start()
         for p in ports:
-            try:
-                ser = create_serial_connection(p, timeout=0.1)
-                if ser:
-                    self.active_ports[p] = ser
-                    self.port_locks[p] = threading.Lock()
-                    threading.Thread(target=self._listen_port, args=(p,), daemon=True).start()
-                    Logger.info(f"[{p}] 监听中...")
-                else:
-                    Logger.error(f"[{p}] 打开失败")
-            except Exception as e:
-                Logger.error(f"[{p}] 异常: {e}")
+            if not self._open_port(p):
+                self.port_supervisor.mark_lost(p)
 
         # 启动后台任务
         threading.Thread(target=self._task_hello, daemon=True).start()
@@ -119,10 +183,9 @@ class NetworkNode:
         threading.Thread(target=self._task_check_timeout, daemon=True).start()
         
         # 启动可视化上报任务
-        threading.Thread(target=self._task_report_viz, daemon=True).start()
-
-        Logger.success("系统就绪。可用命令: ping, tracert, table, send, exit")
-        self._input_loop()
+        if report_viz:
+            threading.Thread(target=self._task_report_viz, daemon=True).start()
+        return bool(self.active_ports)
     
     def _task_report_viz(self):
         """定期上报状态给可视化后端"""
@@ -186,88 +249,209 @@ class NetworkNode:
                 self._network_send(parts[1], payload, DEFAULT_TTL)
             elif op == 'table':
                 self._print_table()
+            elif op == 'ports':
+                self._print_ports()
+            elif op == 'fec':
+                self._cmd_fec(parts[1:])
+            elif op == 'bert':
+                self._cmd_bert(parts[1:])
+            elif op == 'capture':
+                self._cmd_capture(parts[1:])
         except Exception as e:
             self._log_viz(f"Cmd Error: {e}")
 
     # === 基础通信 ===
-    def _close_port(self, port):
-        """安全关闭并移除故障串口"""
-        if port in self.active_ports:
+    def _open_port(self, port):
+        """打开串口并启动其写线程与监听线程，成功返回 True"""
+        try:
+            ser = create_serial_connection(port, timeout=0.1, **self.serial_params)
+        except Exception as e:
+            Logger.error(f"[{port}] 异常: {e}")
+            return False
+        if not ser:
+            Logger.error(f"[{port}] 打开失败")
+            return False
+
+        with self.ports_lock:
+            self.active_ports[port] = ser
+            self.codec_stats.setdefault(port, CodecStats())  # 重新打开时保留累计统计
+            self.port_writers[port] = PortWriter(
+                ser, port, pacer=TokenBucket.for_serial(ser), tap=capture_tap(self.capture, port, DIR_TX),
+                on_error=lambda name, e, ser=ser: self._on_write_error(name, e, ser))
+        # 重新打开的端口回到初始速率，下一次 HELLO 后重新协商
+        self.autobaud.register(port, ser.baudrate)
+        threading.Thread(target=self._listen_port, args=(port, ser), daemon=True).start()
+        Logger.info(f"[{port}] 监听中...")
+        return True
+
+    def _reopen_port(self, port):
+        """PortSupervisor 回调: 在监督线程中重新打开故障端口"""
+        if not self.running or port in self.active_ports:
+            return True
+        if not self._open_port(port):
+            return False
+        self._log_viz(f"Port {port} reopened.")
+        return True
+
+    def _close_port(self, port, ser=None):
+        """
+        安全关闭并移除故障串口，交给 PortSupervisor 等待设备恢复
+        :param ser: 出错的串口对象；端口已被重新打开 (对象不同) 时忽略这次迟到的故障
+        """
+        with self.ports_lock:
+            current = self.active_ports.get(port)
+            if current is None or (ser is not None and current is not ser):
+                return
+            Logger.warning(f"[{port}] 检测到通信故障，正在关闭端口...")
             try:
-                Logger.warning(f"[{port}] 检测到通信故障，正在关闭端口...")
-                self.active_ports[port].close()
+                current.close()
             except:
                 pass
             self.active_ports.pop(port, None)
-            self.port_locks.pop(port, None)
+            writer = self.port_writers.pop(port, None)
+        if writer:
+            writer.close()
+        self.autobaud.unregister(port)
+        
+        # 同时移除该端口的邻居记录
+        with self.neighbors_lock:
+            self.neighbors.pop(port, None)
+            self.link_caps.pop(port, None)
+            self.arq.reset(port)
             
-            # 同时移除该端口的邻居记录
-            with self.neighbors_lock:
-                self.neighbors.pop(port, None)
-                
-            self._log_viz(f"Port {port} removed due to error.")
-
-    def _listen_port(self, port):
-        # 只要端口在 active_ports 中，就认为是活跃的
-        while self.running and port in self.active_ports:
-            ser = self.active_ports.get(port)
-            if not ser or not ser.is_open:
+        self._log_viz(f"Port {port} removed due to error.")
+        if self.running and self.port_supervisor:
+            self.port_supervisor.mark_lost(port)
+
+    def _listen_port(self, port, ser):
+        framer = FrameBuffer(magic=MAGIC, frame_length=frame_length, tap=capture_tap(self.capture, port, DIR_RX),
+                             resync=self._resync_check(port))
+        # 只要该串口对象仍是端口当前使用的对象，就认为是活跃的
+        while self.running and self.active_ports.get(port) is ser:
+            if not ser.is_open:
                 break
             try:
-                if ser.in_waiting:
-                    line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    if line: self._handle_packet(line, port)
-                else:
-                    time.sleep(0.01)
+                for frame in framer.read_from(ser):
+                    self._receive_frame(frame, port)
             except Exception as e:
                 # 读错误通常也意味着掉线
                 Logger.error(f"Read Error on {port}: {e}")
-                self._close_port(port)
+                self._close_port(port, ser)
                 break
 
-    def _send_bytes(self, port, data_str):
-        if port not in self.active_ports: return
-        
-        # 获取锁
-        lock = self.port_locks.get(port)
-        if not lock: return
-
-        # 尝试发送
-        with lock:
+    def _receive_frame(self, frame, port_name):
+        """处理接收线程切出的一帧: 处理异常只计数并丢弃该帧，不结束该端口的接收"""
+        try:
+            self._handle_packet(frame, port_name)
+        except Exception as e:
+            self.frame_errors[port_name] = self.frame_errors.get(port_name, 0) + 1
+            Logger.warning("[%s] 丢弃无法处理的帧: %s", port_name, e)
+
+    def _send_bytes(self, port, packet, prio=PRIO_DATA, arq=True):
+        """
+        将一帧放入端口对应优先级的发送队列 (非阻塞，由写线程写串口)
+        str 为文本帧，自动追加换行；bytes 为二进制帧
+        :param arq: 链路协商了 ARQ 时经逐跳重传发送 (HELLO 传 False)
+        """
+        writer = self.port_writers.get(port)
+        if not writer: return
+        data = packet if isinstance(packet, bytes) else (packet + '\n').encode('utf-8')
+        if arq and self.arq.active(port):
+            return self.arq.send(port, data, prio)
+        # FEC 在 ARQ 之下: 重传的信封同样经过纠错编码
+        data = self.fec.encode(port, data, self.link_caps.get(port, ()))
+        return writer.send(data, prio)
+
+    def _on_write_error(self, port, e, ser=None):
+        """写线程发送失败回调"""
+        # 捕获权限错误 (设备拔出) 或 IO 错误
+        if "PermissionError" in str(e) or "拒绝访问" in str(e) or "Access is denied" in str(e):
+             Logger.error(f"Send Error on {port} (Device disconnected?): {e}")
+        else:
+             Logger.error(f"Send Error on {port}: {e}")
+        # 写失败通常意味着物理层问题，关闭后由 PortSupervisor 负责恢复
+        self._close_port(port, ser)
+
+    def _resync_check(self, port):
+        """分帧重新同步条件: 只在已协商二进制格式的链路上，且只认通过校验的信封首部 (见 wire.resync_check)"""
+        return resync_check(lambda: CAP_BINARY in self.link_caps.get(port, ()))
+
+    def _send_raw(self, port, data):
+        """不经 ARQ/FEC 直接放入端口发送队列 (BERT 帧)"""
+        writer = self.port_writers.get(port)
+        return writer.send(data, PRIO_DATA) if writer else False
+
+    def _port_control(self, port, data=b'', baudrate=None):
+        """速率协商: 越过发送队列立即写出控制帧，写完后切换波特率"""
+        writer = self.port_writers.get(port)
+        return writer.control(data, baudrate) if writer else False
+
+    def _encode_packet(self, port, p_type, src, dst='', payload='', ttl=0):
+        """按该链路协商的格式封装数据包: 二进制帧 (bytes) 或文本帧 (str)"""
+        caps = self.link_caps.get(port, ())
+        if CAP_BINARY in caps:
             try:
-                ser = self.active_ports.get(port)
-                if ser and ser.is_open:
-                    ser.write((data_str + '\n').encode('utf-8'))
-            except Exception as e:
-                # 捕获权限错误 (设备拔出) 或 IO 错误
-                if "PermissionError" in str(e) or "拒绝访问" in str(e) or "Access is denied" in str(e):
-                     Logger.error(f"Send Error on {port} (Device disconnected?): {e}")
-                     self._close_port(port)
-                else:
-                     Logger.error(f"Send Error on {port}: {e}")
-                     # 对于其他类型的写错误，可能也需要关闭以防死循环
-                     # 这里暂时选择只在明确断开时关闭，或者重试逻辑（暂不实现重试）
-                     # 为稳健起见，写失败通常意味着物理层问题，关闭是更安全的选择
-                     self._close_port(port)
+                # 双方都声明了 Z 时，足够长的负载会被压缩
+                return encode_packet(p_type, src, dst, payload, ttl, compress=CAP_COMPRESS in caps,
+                                     stats=self.codec_stats.get(port))
+            except ValueError:
+                pass  # 字段超长，回退到文本格式
+        if p_type == TYPE_DV:
+            return f"{TYPE_DV}{SEPARATOR}{src}{SEPARATOR}{payload}"
+        return f"{TYPE_DATA}{SEPARATOR}{src}{SEPARATOR}{dst}{SEPARATOR}{ttl}{SEPARATOR}{payload}"
+
+    def _send_packet(self, port, p_type, src, dst='', payload='', ttl=0):
+        # DV 走控制优先级；DATA (含 ICMP) 走数据优先级，ping 洪泛不会挤占 Hello/DV
+        prio = PRIO_CONTROL if p_type == TYPE_DV else PRIO_DATA
+        self._send_bytes(port, self._encode_packet(port, p_type, src, dst, payload, ttl), prio)
 
     # === 核心处理 ===
-    def _handle_packet(self, raw, port_src):
+    def _handle_packet(self, frame, port_src):
+        if is_binary_frame(frame):
+            if is_bert_frame(frame):
+                # 误码率测试帧: 请求原样回送，回送帧交给本端测试比对
+                self.bert.on_frame(port_src, frame)
+                return
+            if is_fec_frame(frame):
+                # 前向纠错信封: 纠错后按内层帧处理，无法纠正时丢弃
+                inner = self.fec.decode(port_src, frame)
+                if inner:
+                    self._handle_packet(inner, port_src)
+                return
+            if is_arq_frame(frame):
+                for inner in self.arq.on_frame(port_src, frame):
+                    self._handle_packet(inner, port_src)
+                return
+            pkt = decode_packet(frame, self.codec_stats.get(port_src))
+            if not pkt: return
+            if pkt.p_type == TYPE_DV:
+                self._on_recv_dv(pkt.src, pkt.payload, port_src)
+            elif pkt.p_type == TYPE_DATA:
+                self._process_network_packet(pkt.src, pkt.dst, pkt.ttl, pkt.payload)
+            return
+
+        raw = decode_frame(frame)
+        if not raw: return
         try:
+            # 只切分一次: 最多 5 段，DATA 的 Payload (Type|Body) 保持完整，交给上层再解析
             parts = raw.split(SEPARATOR, 4)
-            # 简单起见，先按最少分割，再根据类型细分
-            base_parts = raw.split(SEPARATOR)
-            p_type = base_parts[0]
+            p_type = parts[0]
             
             if p_type == TYPE_HELLO:
-                if len(base_parts) > 1: self._on_recv_hello(base_parts[1], port_src)
+                # HELLO|SenderID|Caps (旧节点不带能力字段)
+                if len(parts) > 1:
+                    caps = parse_caps(parts[2]) if len(parts) > 2 else set()
+                    self._on_recv_hello(parts[1], port_src, caps)
             elif p_type == TYPE_DV:
-                if len(base_parts) > 2: self._on_recv_dv(base_parts[1], base_parts[2], port_src)
+                if len(parts) > 2: self._on_recv_dv(parts[1], SEPARATOR.join(parts[2:]), port_src)
             elif p_type == TYPE_DATA:
                 # DATA|Src|Dst|TTL|Payload(Type|Body)
-                # Payload 内部再解析
-                if len(base_parts) < 5: return
-                src, dst, ttl_str, payload = base_parts[1], base_parts[2], base_parts[3], SEPARATOR.join(base_parts[4:])
+                if len(parts) < 5: return
+                _, src, dst, ttl_str, payload = parts
                 self._process_network_packet(src, dst, int(ttl_str), payload)
+            elif p_type == TYPE_LINK:
+                # LINK|SenderID|Op|... (链路速率协商)
+                self.autobaud.handle(port_src, raw)
                 
         except Exception as e:
             # Logger.debug(f"Parse Error: {e}")
@@ -291,17 +475,17 @@ class NetworkNode:
             self._send_icmp_time_exceeded(src_id, payload)
             return
 
-        # 查找路由转发
+        # 查找路由 (锁内)，转发 (锁外)
         with self.rt_lock:
             route = self.routing_table.get(dst_id)
-            if route and route['cost'] < 999:
-                next_port = route['next_hop_port']
-                # 重新打包
-                packet = f"{TYPE_DATA}{SEPARATOR}{src_id}{SEPARATOR}{dst_id}{SEPARATOR}{ttl}{SEPARATOR}{payload}"
-                self._send_bytes(next_port, packet)
-                self._log_viz(f"FWD: To {dst_id} via {next_port}")
-            else:
-                self._log_viz(f"DROP: No route to {dst_id}")
+            next_port = route['next_hop_port'] if route and route['cost'] < 999 else None
+
+        if next_port:
+            # 按下一跳链路的格式重新打包
+            self._send_packet(next_port, TYPE_DATA, src_id, dst_id, payload, ttl)
+            self._log_viz(f"FWD: To {dst_id} via {next_port}")
+        else:
+            self._log_viz(f"DROP: No route to {dst_id}")
 
     def _handle_application_payload(self, src_id, payload):
         """应用层/传输层分发"""
@@ -378,16 +562,15 @@ class NetworkNode:
                     self.icmp_events[seq].set()
 
     def _network_send(self, dst_id, payload, ttl):
-        packet = f"{TYPE_DATA}{SEPARATOR}{self.my_id}{SEPARATOR}{dst_id}{SEPARATOR}{ttl}{SEPARATOR}{payload}"
-        
         # 路由查找
         with self.rt_lock:
             route = self.routing_table.get(dst_id)
             if not route or route['cost'] >= 999:
                 return False
             port = route['next_hop_port']
-            self._send_bytes(port, packet)
-            return True
+
+        self._send_packet(port, TYPE_DATA, self.my_id, dst_id, payload, ttl)
+        return True
 
     # === API Ping/Traceroute ===
     
@@ -481,13 +664,17 @@ class NetworkNode:
                 self.icmp_results.pop(seq, None)
 
     # === Helper (Hello/DV/Routing) ===
-    def _on_recv_hello(self, sender_id, port):
+    def _on_recv_hello(self, sender_id, port, caps=frozenset()):
         with self.neighbors_lock:
             self.neighbors[port] = {'id': sender_id, 'last_seen': time.time()}
+            # 每个 Hello 都重新协商: 邻居换成旧节点时自动回退到文本格式
+            self.link_caps[port] = self.local_caps & caps
+            self.arq.on_hello(port, self.link_caps[port])
         with self.rt_lock:
             cur = self.routing_table.get(sender_id)
             if not cur or cur['cost'] > 1:
                 self.routing_table[sender_id] = {'cost': 1, 'next_hop_port': port, 'next_hop_id': sender_id}
+        self.autobaud.on_hello(port, sender_id, caps)
 
     def _send_dv_updates(self):
         """发送路由更新（支持毒性逆转）"""
@@ -504,8 +691,7 @@ class NetworkNode:
                     cost = 999 
                 custom_dv[dest] = {'cost': cost}
             
-            pkt = f"{TYPE_DV}{SEPARATOR}{self.my_id}{SEPARATOR}{json.dumps(custom_dv)}"
-            self._send_bytes(port_out, pkt)
+            self._send_packet(port_out, TYPE_DV, self.my_id, payload=json.dumps(custom_dv))
 
     def _on_recv_dv(self, sender_id, dv_json, port):
         """优化的 DV 处理 (Triggered Updates + Poison Reverse Support)"""
@@ -550,13 +736,17 @@ class NetworkNode:
 
     def _task_hello(self):
         while self.running:
-            for p in list(self.active_ports.keys()): self._send_bytes(p, f"{TYPE_HELLO}{SEPARATOR}{self.my_id}")
-            time.sleep(HELLO_INTERVAL)
+            # Hello 始终为文本格式，携带本机能力用于协商
+            packet = f"{TYPE_HELLO}{SEPARATOR}{self.my_id}"
+            if self.local_caps:
+                packet += f"{SEPARATOR}{format_caps(self.local_caps)}"
+            for p in list(self.active_ports.keys()): self._send_bytes(p, packet, PRIO_HELLO, arq=False)
+            time.sleep(self.hello_interval)
 
     def _task_broadcast_dv(self):
         while self.running:
             self._send_dv_updates()
-            time.sleep(DV_INTERVAL)
+            time.sleep(self.dv_interval)
 
     def _task_check_timeout(self):
         while self.running:
@@ -564,12 +754,17 @@ class NetworkNode:
             drops = []
             with self.neighbors_lock:
                 for k,v in self.neighbors.items():
-                    if now - v['last_seen'] > NEIGHBOR_TIMEOUT: drops.append(k)
-                for k in drops: del self.neighbors[k]
+                    if now - v['last_seen'] > self.neighbor_timeout: drops.append(k)
+                for k in drops:
+                    del self.neighbors[k]
+                    self.link_caps.pop(k, None)
+                    self.arq.reset(k)
             if drops:
                 with self.rt_lock:
                     for d,i in self.routing_table.items():
                         if i['next_hop_port'] in drops and d!=self.my_id: i['cost']=999
+                for k in drops:
+                    self.autobaud.on_link_lost(k)
             time.sleep(1)
 
     def _print_table(self):
@@ -577,7 +772,7 @@ class NetworkNode:
         lines.append("\n" + "="*60)
         lines.append(f"路由表 - MyID: {self.my_id}")
         lines.append("="*60)
-        lines.append(f"{'Target':<10} {'Cost':<10} {'NextHop':<10} {'Interface':<15}")
+        lines.append(f"{'Target':<10} {'Cost':<10} {'NextHop':<10} {'Interface':<15} {'Baud':<10}")
         lines.append("-"*60)
         with self.rt_lock:
              # 按Target排序
@@ -586,17 +781,97 @@ class NetworkNode:
                 cost_str = str(info['cost']) if info['cost'] < 999 else "∞"
                 next_hop = info['next_hop_id'] if info.get('next_hop_id') else "-"
                 port = info['next_hop_port']
-                lines.append(f"{dest:<10} {cost_str:<10} {next_hop:<10} {port:<15}")
+                baud = self.autobaud.rate(port) or '-'
+                lines.append(f"{dest:<10} {cost_str:<10} {next_hop:<10} {port:<15} {baud:<10}")
         lines.append("="*60 + "\n")
         
         output = "\n".join(lines)
-        print(output)
+        Logger.console(output)
         self._log_viz(output)
 
+    def _print_ports(self):
+        lines = ["\n" + "="*60, f"端口发送队列 - MyID: {self.my_id}", "="*60]
+        lines.extend(format_port_stats(self.port_writers))
+        lines.append("")
+        lines.extend(format_codec_stats(self.codec_stats))
+        if self.link_arq:
+            lines.append("")
+            lines.extend(format_arq_stats(self.arq))
+        lines.append("")
+        lines.extend(format_fec_stats(self.fec))
+        if self.frame_errors:
+            lines.append("帧处理异常 (已丢弃): " + ", ".join(f"{p} {n}" for p, n in self.frame_errors.items()))
+        if self.port_supervisor:
+            st = self.port_supervisor.stats()
+            lines.append(f"热插拔: 已恢复 {st['reopened']} 次, 失败重试 {st['failures']} 次, 扫描 {st['scans']} 次")
+            for port, info in st['lost'].items():
+                lines.append(f"  {port}: 等待恢复 (已尝试 {info['attempts']} 次, 退避 {info['backoff']:.1f}s)")
+        lines.append("="*60 + "\n")
+        output = "\n".join(lines)
+        Logger.console(output)
+        self._log_viz(output)
+
+    def _cmd_fec(self, args):
+        """fec <端口> <K|off>: 设置端口 FEC 冗余度 (每 K 个数据块一个校验块，K 越小冗余越高)"""
+        if len(args) != 2 or args[0] not in self.active_ports:
+            print("用法: fec <端口> <K|off>  (K = 1~16，对端也需支持 FEC)")
+            return
+        try:
+            self.fec.set_level(args[0], args[1])
+        except ValueError as e:
+            Logger.warning(f"{e}")
+            return
+        level = self.fec.level(args[0])
+        Logger.info(f"[{args[0]}] FEC " + (f"冗余度 K={level}" if level else "已关闭"))
+
+    def _cmd_capture(self, args):
+        """capture [文件.pcapng]: 显示抓包统计；给出文件名时把当前环中的记录导出为 pcapng"""
+        if not self.capture:
+            Logger.console("抓包未开启 (启动时加 --capture <文件>)")
+            return
+        Logger.console(format_capture_stats(self.capture))
+        if args:
+            try:
+                n = self.capture.export(args[0])
+            except OSError as e:
+                Logger.error(f"导出失败: {e}")
+                return
+            Logger.success(f"已导出 {n} 条记录到 {args[0]}")
+
+    def _cmd_bert(self, args):
+        """bert <端口> [图样] [帧数] [帧长]: 对该端口的邻居做回送误码测试 (后台运行，完成后打印报告)"""
+        if not args or args[0] not in self.active_ports:
+            print(f"用法: bert <端口> [图样={DEFAULT_PATTERN}] [帧数=200] [帧长=128]")
+            return
+        port = args[0]
+        if CAP_BERT not in self.link_caps.get(port, ()):
+            Logger.warning(f"[{port}] 邻居未声明 BER 能力，无法测试")
+            return
+        try:
+            pattern = args[1] if len(args) > 1 else DEFAULT_PATTERN
+            frames = int(args[2]) if len(args) > 2 else 200
+            size = int(args[3]) if len(args) > 3 else 128
+        except ValueError:
+            print("帧数和帧长应为整数")
+            return
+
+        def worker():
+            try:
+                stats = self.bert.run(port, pattern, frames, size)
+            except ValueError as e:
+                Logger.warning(f"{e}")
+                return
+            Logger.info(f"[{port}] 误码率测试完成")
+            for line in format_ber_report(stats):
+                Logger.console(f"  {line}")
+
+        Logger.info(f"[{port}] 开始误码率测试: {pattern.upper()} x {frames} 帧 ({size} 字节)")
+        threading.Thread(target=worker, daemon=True).start()
+
     def _input_loop(self):
         while self.running:
             try:
-                cmd = input("> ").strip().split()
+                cmd = Logger.input("> ").strip().split()
                 if not cmd: continue
                 op = cmd[0].lower()
                 if op == 'ping':
@@ -607,6 +882,14 @@ class NetworkNode:
                     else: self.do_traceroute(cmd[1])
                 elif op == 'table':
                     self._print_table()
+                elif op == 'ports':
+                    self._print_ports()
+                elif op == 'fec':
+                    self._cmd_fec(cmd[1:])
+                elif op == 'bert':
+                    self._cmd_bert(cmd[1:])
+                elif op == 'capture':
+                    self._cmd_capture(cmd[1:])
                 elif op == 'send': # 简单的不可靠发送示例
                     if len(cmd)<3: print("Usage: send <ID> <Msg>")
                     else:
@@ -614,6 +897,9 @@ class NetworkNode:
                         self._network_send(cmd[1], payload, DEFAULT_TTL)
                 elif op == 'exit':
                     self.running=False
+                    self.arq.stop()
+                    for w in self.port_writers.values(): w.close()
+                    if self.capture: self.capture.close()
                     sys.exit()
             except KeyboardInterrupt:
                 self.running=False
@@ -621,4 +907,10 @@ class NetworkNode:
                 Logger.error(f"Err: {e}")
 
 if __name__ == "__main__":
-    NetworkNode().start()
+    # python network_app.py --config node.toml / --id A --ports COM3,COM4 [--viz-url URL | --no-viz] [--no-console]
+    try:
+        config = load_node_config()
+    except ValueError as e:
+        Logger.error(f"配置错误: {e}")
+        sys.exit(1)
+    NetworkNode().start(config)
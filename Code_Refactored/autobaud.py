@@ -0,0 +1,251 @@
+"""
+链路速率协商 (自动波特率)
+
+串口先以安全速率 (配置的 baudrate，默认 9600) 打开。HELLO 中双方都声明了 AB 能力后，
+由 ID 较小的一端发起逐级升速，对每个候选速率 R:
+    1. 发起方以当前速率发送 LINK|A|TRY|R，响应方回复 LINK|B|OK|R 后切换到 R (不支持则回复 NAK)
+    2. 发起方收到 OK 后切换到 R，发送 PROBE_FRAMES 个带 CRC32 的探测帧，再发送 LINK|A|DONE|R|N
+    3. 响应方统计 CRC 正确的探测帧，回复 LINK|B|RESULT|R|good
+    4. 丢帧/错帧比例不超过 MAX_PROBE_LOSS 时发起方发送 LINK|A|COMMIT|R，响应方确认 R 并回复
+       LINK|B|ACK|R，发起方收到 ACK 后确认 R 并尝试下一档 (未收到则重发 COMMIT，最多 COMMIT_RETRIES 次)；
+       否则发起方回到上一速率，响应方超时没收到 COMMIT 也自动回退
+COMMIT 已到达而 ACK 全部丢失时，发起方回退而响应方停在 R，两端速率不一致、互相收不到 HELLO；
+邻居超时 (NEIGHBOR_TIMEOUT，约 10 秒) 后双方都回到初始速率，下一次 HELLO 后重新协商。
+其它原因的链路中断也按同样方式恢复
+
+速率切换通过 PortWriter.control() 在写线程中执行: 先写完切换前的控制帧，再修改串口波特率
+"""
+
+import random
+import threading
+import time
+import zlib
+
+from utils import Logger
+
+TYPE_LINK = 'LINK'
+CAP_AUTOBAUD = 'AB'
+SEPARATOR = '|'
+
+BAUD_CANDIDATES = (9600, 19200, 38400, 57600, 115200, 230400, 460800, 921600)
+DEFAULT_MAX_BAUDRATE = 115200  # 未配置 max_baudrate 时的升速上限
+PROBE_FRAMES = 16              # 每档探测帧数
+PROBE_SIZE = 48                # 探测帧负载长度 (字节)
+MAX_PROBE_LOSS = 0.1           # 可接受的探测帧丢失/错误比例
+REPLY_TIMEOUT = 1.5            # 等待 OK/NAK/ACK 的时间 (秒)
+COMMIT_RETRIES = 3             # COMMIT 未收到 ACK 时的发送次数
+SETTLE_TIME = 0.05             # 切换速率后等待对端完成切换 (秒)
+
+# 协商状态
+IDLE, PROBING, TRIAL, DONE = 'idle', 'probing', 'trial', 'done'
+
+
+def burst_time(baudrate, frames=PROBE_FRAMES, size=PROBE_SIZE):
+    """一轮探测帧在 baudrate 下的大致发送时间 (秒，按每字节 10 比特估算)"""
+    return frames * (size + 32) * 10 / baudrate
+
+
+def probe_crc(rate, seq, payload):
+    return zlib.crc32(f"{rate}{SEPARATOR}{seq}{SEPARATOR}{payload}".encode('utf-8'))
+
+
+class LinkRateNegotiator:
+    """
+    每个节点一个，管理所有端口的速率协商
+    :param control: control(port, data, baudrate=None) -> 立即写出 data (bytes)，写完后切换到 baudrate
+                    (通常转发给该端口 PortWriter.control)
+    """
+    def __init__(self, my_id, control, max_baudrate=None, candidates=BAUD_CANDIDATES):
+        self.my_id = my_id
+        self.control = control
+        self.max_baudrate = max_baudrate or DEFAULT_MAX_BAUDRATE
+        self.candidates = tuple(sorted(candidates))
+        self.ports = {}
+        self.lock = threading.Lock()
+
+    # --- 节点调用 ---
+
+    def register(self, port, baudrate):
+        """端口以 baudrate 打开后登记 (该速率同时作为回退速率)"""
+        with self.lock:
+            self.ports[port] = {'base': baudrate, 'rate': baudrate, 'phase': IDLE, 'peer': None,
+                                'trial': None, 'prev': None, 'seen': set(), 'timer': None,
+                                'reply': None, 'event': threading.Event()}
+
+    def unregister(self, port):
+        with self.lock:
+            st = self.ports.pop(port, None)
+            if st and st['timer']:
+                st['timer'].cancel()
+
+    def rate(self, port):
+        """端口当前速率 (未登记时返回 None)"""
+        st = self.ports.get(port)
+        return st['rate'] if st else None
+
+    def phase(self, port):
+        st = self.ports.get(port)
+        return st['phase'] if st else None
+
+    def on_hello(self, port, neighbor_id, caps):
+        """收到 HELLO: 双方都支持且本机 ID 较小时开始升速"""
+        if CAP_AUTOBAUD not in caps or not (self.my_id < neighbor_id):
+            return
+        with self.lock:
+            st = self.ports.get(port)
+            if not st or st['phase'] != IDLE:
+                return
+            st['phase'] = PROBING
+            st['peer'] = neighbor_id
+        threading.Thread(target=self._negotiate, args=(port,), daemon=True).start()
+
+    def on_link_lost(self, port):
+        """邻居超时: 回到初始速率，等待下一次 HELLO 重新协商"""
+        with self.lock:
+            st = self.ports.get(port)
+            if not st:
+                return
+            if st['timer']:
+                st['timer'].cancel()
+            st['phase'] = IDLE
+            st['trial'] = None
+            changed = st['rate'] != st['base']
+            st['rate'] = st['base']
+        if changed:
+            Logger.warning(f"[{port}] 链路中断，速率回退到 {st['base']} bps")
+            self.control(port, b'', st['base'])
+
+    def handle(self, port, raw):
+        """处理一条 LINK 控制帧 (文本): LINK|SenderID|Op|Args..."""
+        fields = raw.split(SEPARATOR)
+        if len(fields) < 4:
+            return
+        op, args = fields[2], fields[3:]
+        try:
+            rate = int(args[0])
+        except ValueError:
+            return
+        with self.lock:
+            st = self.ports.get(port)
+            if not st:
+                return
+            if op == 'TRY':
+                self._on_try(port, st, rate)
+            elif op == 'PROBE' and len(args) == 4:
+                if st['phase'] == TRIAL and rate == st['trial']:
+                    seq, payload, crc = args[1], args[2], args[3]
+                    if crc.isdigit() and int(crc) == probe_crc(rate, seq, payload):
+                        st['seen'].add(seq)
+            elif op == 'DONE':
+                if st['phase'] == TRIAL and rate == st['trial']:
+                    self._send(port, f"RESULT{SEPARATOR}{rate}{SEPARATOR}{len(st['seen'])}")
+            elif op == 'COMMIT':
+                if st['phase'] == TRIAL and rate == st['trial']:
+                    st['timer'].cancel()
+                    st['rate'] = rate
+                    st['phase'] = DONE
+                    Logger.info(f"[{port}] 链路速率提升到 {rate} bps")
+                if st['phase'] == DONE and rate == st['rate']:
+                    self._send(port, f"ACK{SEPARATOR}{rate}")  # 重发的 COMMIT 同样确认
+            elif op in ('OK', 'NAK', 'RESULT', 'ACK'):
+                if st['phase'] == PROBING:
+                    st['reply'] = (op, rate, args[1:])
+                    st['event'].set()
+
+    # --- 响应方 ---
+
+    def _on_try(self, port, st, rate):
+        if rate not in self.candidates or rate > self.max_baudrate:
+            self._send(port, f"NAK{SEPARATOR}{rate}")
+            return
+        if st['timer']:
+            st['timer'].cancel()
+        prev = st['rate']
+        st.update(phase=TRIAL, trial=rate, prev=prev, seen=set())
+        # 以当前速率回复 OK，写完后切换到 rate
+        self._send(port, f"OK{SEPARATOR}{rate}", rate)
+        # 超时未收到 COMMIT (探测失败或 COMMIT 丢失) 则回退
+        timeout = REPLY_TIMEOUT * 2 + burst_time(rate) * 2 + 1.0
+        st['timer'] = threading.Timer(timeout, self._trial_expired, args=(port, rate))
+        st['timer'].daemon = True
+        st['timer'].start()
+
+    def _trial_expired(self, port, rate):
+        with self.lock:
+            st = self.ports.get(port)
+            if not st or st['phase'] != TRIAL or st['trial'] != rate:
+                return
+            st['phase'] = DONE
+            st['rate'] = st['prev']
+            prev = st['prev']
+        Logger.warning(f"[{port}] {rate} bps 未确认，回退到 {prev} bps")
+        self.control(port, b'', prev)
+
+    # --- 发起方 ---
+
+    def _send(self, port, body, baudrate=None):
+        line = f"{TYPE_LINK}{SEPARATOR}{self.my_id}{SEPARATOR}{body}\n"
+        self.control(port, line.encode('utf-8'), baudrate)
+
+    def _request(self, port, body, timeout, baudrate=None):
+        """发送一条控制帧并等待对端回复 (OK/NAK/RESULT)，超时返回 None"""
+        st = self.ports.get(port)
+        if not st:
+            return None
+        st['event'].clear()
+        st['reply'] = None
+        self._send(port, body, baudrate)
+        if not st['event'].wait(timeout):
+            return None
+        return st['reply']
+
+    def _negotiate(self, port):
+        st = self.ports.get(port)
+        rate = st['rate']
+        try:
+            for candidate in self.candidates:
+                if candidate <= rate or candidate > self.max_baudrate:
+                    continue
+                if self.ports.get(port) is not st or st['phase'] != PROBING:
+                    return  # 链路中断或端口已移除
+                if not self._try_rate(port, st, candidate, rate):
+                    break
+                rate = candidate
+            Logger.success(f"[{port}] 与 {st['peer']} 的链路速率协商完成: {rate} bps")
+        finally:
+            with self.lock:
+                if st['phase'] == PROBING:
+                    st['phase'] = DONE
+
+    def _try_rate(self, port, st, rate, prev):
+        reply = self._request(port, f"TRY{SEPARATOR}{rate}", REPLY_TIMEOUT + burst_time(prev, 2))
+        if not reply or reply[0] != 'OK' or reply[1] != rate:
+            return False
+
+        # 对端已切换到 rate，本端跟随切换后发送探测帧
+        self.control(port, b'', rate)
+        time.sleep(SETTLE_TIME)
+        st['event'].clear()
+        st['reply'] = None
+        rng = random.Random()
+        for seq in range(PROBE_FRAMES):
+            payload = ''.join(rng.choice('0123456789ABCDEFabcdef') for _ in range(PROBE_SIZE))
+            crc = probe_crc(rate, seq, payload)
+            self._send(port, SEPARATOR.join(('PROBE', str(rate), str(seq), payload, str(crc))))
+        self._send(port, f"DONE{SEPARATOR}{rate}{SEPARATOR}{PROBE_FRAMES}")
+
+        reply = st['reply'] if st['event'].wait(REPLY_TIMEOUT + burst_time(rate) * 2) else None
+        good = int(reply[2][0]) if reply and reply[0] == 'RESULT' and reply[2] and reply[2][0].isdigit() else 0
+        if reply and reply[1] == rate and good >= PROBE_FRAMES * (1 - MAX_PROBE_LOSS):
+            for _ in range(COMMIT_RETRIES):
+                ack = self._request(port, f"COMMIT{SEPARATOR}{rate}", REPLY_TIMEOUT)
+                if ack and ack[0] == 'ACK' and ack[1] == rate:
+                    with self.lock:
+                        st['rate'] = rate
+                    return True
+            # 对端可能已切换到 rate: 两端不一致时由邻居超时恢复 (见模块说明)
+            Logger.warning(f"[{port}] {rate} bps 未收到 COMMIT 确认，回退到 {prev} bps")
+        else:
+            Logger.info(f"[{port}] {rate} bps 探测失败 ({good}/{PROBE_FRAMES})，保持 {prev} bps")
+        self.control(port, b'', prev)
+        return False
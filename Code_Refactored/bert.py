@@ -0,0 +1,368 @@
+"""
+误码率测试 (BERT)
+
+链路在开始丢弃路由流量之前，误码率通常已经在上升。这里提供两种测试方式:
+    1. 实验一回环: 满速连续发送测试图样，接收线程逐块与期望的图样流比对 (StreamChecker)
+    2. 路由端口在线诊断: 向邻居发送 BERT 帧，邻居原样回送，本端比对 (LinkBert)。
+       测的是往返两个方向的合计误码；BERT 帧越过 ARQ/FEC 直接写串口，反映的是原始链路质量
+
+测试图样: PRBS7 / PRBS9 / PRBS15 (ITU-T O.150 多项式) 以及固定图样 ALT (0x55)、ZERO、ONES、RAMP。
+PRBS 每 8 个周期按字节对齐，生成一次后缓存。
+比对把收到的块和期望的块各转成一个大整数做 XOR，误比特数为结果中 1 的个数；
+再用正则找出非零字节的连续区间，得到误字节数、突发长度分布和误码位置
+
+BERT 帧 (复用 wire.HEADER, TYPE = CODE_BERT):
+    MAGIC | CODE_BERT | FLAGS | SEQ | HCHK | 0 | LEN | 图样数据
+    - FLAGS: 第 0 位 = 回送帧，第 1~3 位 = 图样编号 (PATTERN_NAMES 下标)
+    - HCHK: 首部校验字节 (wire.envelope_check)，首部出错的帧按丢失计，不计入误码
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from itertools import accumulate
+
+from wire import MAGIC, HEADER, MAX_PAYLOAD, CODE_BERT, envelope_check
+
+# 图样名 -> (LFSR 阶数, 反馈抽头)；None 表示固定图样
+PRBS_POLYNOMIALS = {'PRBS7': (7, 6), 'PRBS9': (9, 5), 'PRBS15': (15, 14)}
+FIXED_PATTERNS = {'ALT': b'\x55', 'ZERO': b'\x00', 'ONES': b'\xff', 'RAMP': bytes(range(256))}
+PATTERN_NAMES = ('PRBS7', 'PRBS9', 'PRBS15', 'ALT', 'ZERO', 'ONES', 'RAMP')
+DEFAULT_PATTERN = 'PRBS15'
+
+FLAG_ECHO = 0x01
+MAX_POSITIONS = 64          # 记录的误码位置数上限
+BURST_BUCKETS = ((1, '1'), (2, '2'), (4, '3-4'), (8, '5-8'), (16, '9-16'), (None, '>16'))
+SYNC_BYTES = 32             # 失步后用于重新定位的字节数 (大于 PRBS 阶数，周期内唯一)
+SYNC_LOSS_RATIO = 0.25      # 一块内误字节比例超过此值视为失步 (丢字节/多字节)，重新定位
+CHECK_BLOCK = 256           # 流模式攒够这么多字节再比对 (低波特率时每次读到的字节很少)
+FRAME_TIMEOUT = 2.0         # 路由端口测试: 回送帧超时 (秒)
+
+_NONZERO = re.compile(b'[^\x00]+')
+
+
+@lru_cache(maxsize=None)
+def pattern_period(name):
+    """一个按字节对齐的图样周期 (bytes)"""
+    name = name.upper()
+    if name in FIXED_PATTERNS:
+        return FIXED_PATTERNS[name]
+    if name not in PRBS_POLYNOMIALS:
+        raise ValueError(f"未知图样 {name}，可选: {', '.join(PATTERN_NAMES)}")
+    order, tap = PRBS_POLYNOMIALS[name]
+    mask = (1 << order) - 1
+    state = mask
+    out = bytearray()
+    byte = 0
+    # 周期 2^n-1 比特，8 个周期恰好是整数个字节
+    for i in range(8 * mask):
+        bit = ((state >> (order - 1)) ^ (state >> (tap - 1))) & 1
+        state = ((state << 1) | bit) & mask
+        byte = (byte << 1) | bit
+        if i & 7 == 7:
+            out.append(byte)
+            byte = 0
+    return bytes(out)
+
+
+def pattern_chunk(name, offset, size):
+    """图样流中从 offset 开始的 size 字节"""
+    period = pattern_period(name)
+    start = offset % len(period)
+    reps = (start + size) // len(period) + 1
+    return (period * reps)[start:start + size]
+
+
+def pattern_code(name):
+    return PATTERN_NAMES.index(name.upper())
+
+
+def compare(rx, expected):
+    """
+    比对两段等长数据
+    :return: (误比特数, 逐字节 XOR 结果 bytes；无误码时为 None)
+    """
+    x = int.from_bytes(rx, 'big') ^ int.from_bytes(expected, 'big')
+    if not x:
+        return 0, None
+    return x.bit_count(), x.to_bytes(len(rx), 'big')
+
+
+def _bucket(length):
+    for limit, label in BURST_BUCKETS:
+        if limit is None or length <= limit:
+            return label
+
+
+class BerStats:
+    """误码统计 (线程安全)"""
+    def __init__(self, pattern=DEFAULT_PATTERN):
+        self.lock = threading.Lock()
+        self.pattern = pattern
+        self.bytes_compared = 0
+        self.bit_errors = 0
+        self.byte_errors = 0
+        self.bursts = Counter()     # 突发长度区间 -> 次数 (连续误字节算一次突发)
+        self.max_burst = 0
+        self.positions = []         # [(字节偏移, XOR 掩码)]，最多 MAX_POSITIONS 个
+        self.resyncs = 0            # 失步重新定位次数 (丢字节/多字节)
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.frames_lost = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        self.started = time.time()
+        self.elapsed = 0.0
+        self._open_run = 0          # 跨块延续的突发长度
+
+    def add(self, rx, expected, offset, continuous=False, result=None):
+        """
+        比对一块数据并累计
+        :param offset: 该块在流中的字节偏移 (用于记录误码位置)
+        :param continuous: 与上一块首尾相连 (流模式)，跨块的连续误字节合并为一次突发
+        :param result: 已算好的 compare(rx, expected) 结果 (可选)
+        """
+        bits, diff = result or compare(rx, expected)
+        with self.lock:
+            self.bytes_compared += len(rx)
+            if not continuous:
+                self._close_run()
+            if diff is None:
+                self._close_run()
+                return 0
+            self.bit_errors += bits
+            self.byte_errors += len(diff) - diff.count(0)
+            for m in _NONZERO.finditer(diff):
+                start, end = m.span()
+                room = MAX_POSITIONS - len(self.positions)
+                if room > 0:
+                    self.positions.extend((offset + i, diff[i]) for i in range(start, min(end, start + room)))
+                if start == 0 and self._open_run:
+                    self._open_run += end - start
+                else:
+                    self._close_run()
+                    self._open_run = end - start
+                if end < len(diff):
+                    self._close_run()
+            return bits
+
+    def _close_run(self):
+        if self._open_run:
+            self.bursts[_bucket(self._open_run)] += 1
+            self.max_burst = max(self.max_burst, self._open_run)
+            self._open_run = 0
+
+    def finish(self):
+        with self.lock:
+            self._close_run()
+            self.elapsed = time.time() - self.started
+
+    def ber(self):
+        with self.lock:
+            return self.bit_errors / (self.bytes_compared * 8) if self.bytes_compared else None
+
+
+def format_ber_report(stats):
+    """将 BerStats 格式化为报告行 (list of str)"""
+    ber = stats.ber()
+    rate = stats.bytes_compared / stats.elapsed if stats.elapsed else 0.0
+    lines = [f"图样 {stats.pattern}: 比对 {stats.bytes_compared} 字节 ({stats.elapsed:.1f}s, {rate / 1024:.1f} KB/s)",
+             f"误比特 {stats.bit_errors}, 误字节 {stats.byte_errors}, BER = " + (f"{ber:.2e}" if ber is not None else "-")]
+    if stats.frames_sent:
+        avg = stats.rtt_sum / stats.frames_received * 1000 if stats.frames_received else 0.0
+        lines.append(f"帧: 发送 {stats.frames_sent}, 收回 {stats.frames_received}, 丢失 {stats.frames_lost}, "
+                     f"RTT 平均 {avg:.1f}ms / 最大 {stats.rtt_max * 1000:.1f}ms")
+    if stats.resyncs:
+        lines.append(f"失步重新定位 {stats.resyncs} 次 (发生了丢字节或多字节)")
+    if stats.bursts:
+        dist = ', '.join(f"{label}: {stats.bursts[label]}" for _, label in BURST_BUCKETS if stats.bursts[label])
+        lines.append(f"突发长度分布 (字节): {dist}; 最长 {stats.max_burst}")
+    if stats.positions:
+        shown = ', '.join(f"{off}(^{mask:02X})" for off, mask in stats.positions[:16])
+        more = f" ... 共记录 {len(stats.positions)} 处" if len(stats.positions) > 16 else ""
+        lines.append(f"误码位置 (字节偏移^掩码): {shown}{more}")
+    return lines
+
+
+class StreamChecker:
+    """
+    回环流比对 (实验一): 把收到的字节流与期望的图样流逐块比对
+    丢字节或多字节会使后续数据整体错位，一块内误字节比例过高时用最近 SYNC_BYTES 字节在图样周期内重新定位
+    """
+    def __init__(self, pattern=DEFAULT_PATTERN):
+        self.pattern = pattern.upper()
+        self.period = pattern_period(self.pattern)
+        self._search = self.period * (SYNC_BYTES // len(self.period) + 2)
+        self.stats = BerStats(self.pattern)
+        self.offset = 0        # 期望图样中的位置
+        self.received = 0      # 已比对字节 (误码位置按此计)
+        self._pending = bytearray()
+
+    def feed(self, data):
+        """接收线程对每次读到的数据调用 (可直接传入环形缓冲区切片)，攒够 CHECK_BLOCK 字节后比对"""
+        if self._pending or len(data) < CHECK_BLOCK:
+            self._pending += data
+            if len(self._pending) < CHECK_BLOCK:
+                return
+            data, self._pending = bytes(self._pending), bytearray()
+        self._check(data)
+
+    def finish(self):
+        """测试结束: 比对剩余不足一块的数据"""
+        if self._pending:
+            data, self._pending = bytes(self._pending), bytearray()
+            self._check(data)
+        self.stats.finish()
+        return self.stats
+
+    def _check(self, data):
+        n = len(data)
+        expected = pattern_chunk(self.pattern, self.offset, n)
+        result = compare(data, expected)
+        diff = result[1]
+        if diff is not None and n >= SYNC_BYTES and self._lost_sync(diff) and self._resync(data, expected, diff):
+            return
+        self._count(data, expected, result)
+        self.offset += n
+
+    def _count(self, data, expected, result=None):
+        self.stats.add(data, expected, self.received, continuous=True, result=result)
+        self.received += len(data)
+
+    @staticmethod
+    def _lost_sync(diff):
+        """整块误字节过多，或块尾 SYNC_BYTES 字节大半出错 (错位后几乎每个字节都不同)"""
+        tail_errors = SYNC_BYTES - diff[-SYNC_BYTES:].count(0)
+        return len(diff) - diff.count(0) > len(diff) * SYNC_LOSS_RATIO or tail_errors > SYNC_BYTES // 2
+
+    def _resync(self, data, expected, diff):
+        """
+        按块尾 (含误码时依次向前) 在图样周期中重新定位。成功时找出块内的错位点: 之前按原对齐比对，之后按新对齐比对，
+        错位造成的差异不计入误码
+        """
+        n = len(data)
+        # 定位窗口本身可能含误码: 从块尾向前依次尝试
+        for back in range(0, min(n, 4 * SYNC_BYTES) - SYNC_BYTES + 1, SYNC_BYTES):
+            pos = self._search.find(bytes(data[n - back - SYNC_BYTES:n - back]))
+            if pos >= 0:
+                break
+        else:
+            return False
+        end = pos + SYNC_BYTES + back
+        new_expected = pattern_chunk(self.pattern, end - n, n)
+        new_diff = compare(data, new_expected)[1] or bytes(n)
+        # 错位点 split 使 (之前按原对齐的误字节 + 之后按新对齐的误字节) 最少
+        old_bad = list(accumulate((b != 0 for b in diff), initial=0))
+        new_bad = list(accumulate((b != 0 for b in reversed(new_diff)), initial=0))
+        split = min(range(n + 1), key=lambda i: old_bad[i] + new_bad[n - i])
+        if split:
+            self._count(data[:split], expected[:split])
+        if split < n:
+            self._count(data[split:], new_expected[split:])
+        with self.stats.lock:
+            self.stats.resyncs += 1
+        self.offset = end
+        return True
+
+
+def is_bert_frame(frame):
+    """判断二进制帧是否为 BERT 帧"""
+    return len(frame) > 1 and frame[0] == MAGIC and frame[1] == CODE_BERT
+
+
+def bert_frame(pattern, seq, payload, echo=False):
+    flags = (pattern_code(pattern) << 1) | (FLAG_ECHO if echo else 0)
+    head = HEADER.pack(MAGIC, CODE_BERT, flags, seq, envelope_check(flags, seq, len(payload)), 0, len(payload))
+    return head + payload
+
+
+class LinkBert:
+    """
+    路由端口在线误码诊断 (每个节点一个)
+    :param send_raw: send_raw(port, data) -> 直接写入该端口发送队列 (不经 ARQ/FEC)
+    """
+    def __init__(self, send_raw):
+        self.send_raw = send_raw
+        self.sessions = {}   # port -> {'stats', 'pattern', 'size', 'outstanding': {seq: (index, sent_at)}}
+        self.cond = threading.Condition()
+
+    def on_frame(self, port, frame):
+        """收到 BERT 帧: 请求帧原样回送；回送帧交给本端正在进行的测试"""
+        flags, seq = frame[2], frame[3]
+        payload = bytes(frame[HEADER.size:])
+        if not flags & FLAG_ECHO:
+            code = flags >> 1
+            if code >= len(PATTERN_NAMES):
+                return  # 未知图样 (对端版本不同或误码): 丢弃
+            self.send_raw(port, bert_frame(PATTERN_NAMES[code], seq, payload, echo=True))
+            return
+        with self.cond:
+            session = self.sessions.get(port)
+            entry = session and session['outstanding'].pop(seq, None)
+            if not entry:
+                return  # 超时后才到达或重复
+            index, sent_at = entry
+            self.cond.notify_all()
+        stats = session['stats']
+        expected = pattern_chunk(session['pattern'], index * session['size'], session['size'])
+        rtt = time.time() - sent_at
+        with stats.lock:
+            stats.frames_received += 1
+            stats.rtt_sum += rtt
+            stats.rtt_max = max(stats.rtt_max, rtt)
+        if len(payload) == len(expected):
+            stats.add(payload, expected, index * session['size'])
+
+    def running(self, port):
+        return port in self.sessions
+
+    def run(self, port, pattern=DEFAULT_PATTERN, frames=200, size=128, window=8):
+        """
+        在端口上运行一次测试 (阻塞直到完成)，返回 BerStats
+        window: 同时在途的帧数上限 (不超过 128，保证 8 位序号无歧义)
+        """
+        pattern = pattern.upper()
+        pattern_code(pattern)  # 校验图样名
+        if not 1 <= size <= MAX_PAYLOAD:
+            raise ValueError(f"帧长应为 1~{MAX_PAYLOAD} 字节")
+        window = max(1, min(window, 128))
+        stats = BerStats(pattern)
+        session = {'stats': stats, 'pattern': pattern, 'size': size, 'outstanding': {}}
+        with self.cond:
+            if port in self.sessions:
+                raise ValueError(f"{port} 上已有测试在进行")
+            self.sessions[port] = session
+        try:
+            for index in range(frames):
+                with self.cond:
+                    while len(session['outstanding']) >= window:
+                        self._expire(session)
+                        self.cond.wait(0.05)
+                    seq = index & 0xFF
+                    session['outstanding'][seq] = (index, time.time())
+                payload = pattern_chunk(pattern, index * size, size)
+                if self.send_raw(port, bert_frame(pattern, seq, payload)):
+                    stats.frames_sent += 1
+                else:
+                    with self.cond:
+                        session['outstanding'].pop(seq, None)
+                        stats.frames_lost += 1
+            with self.cond:
+                while session['outstanding']:
+                    self._expire(session)
+                    self.cond.wait(0.05)
+        finally:
+            with self.cond:
+                self.sessions.pop(port, None)
+        stats.finish()
+        return stats
+
+    def _expire(self, session):
+        """在 cond 内调用: 超时未回送的帧计为丢失"""
+        now = time.time()
+        for seq, (_, sent_at) in list(session['outstanding'].items()):
+            if now - sent_at > FRAME_TIMEOUT:
+                del session['outstanding'][seq]
+                session['stats'].frames_lost += 1
@@ -0,0 +1,278 @@
+"""
+报文抓包 (内存映射环形文件 + pcapng 导出)
+
+调试输出逐字节生成 repr/十六进制字符串，开销大且看完即丢。抓包把收发的原始帧连同纳秒时间戳、
+端口名和方向写入一个内存映射的环形文件，事后导出为 pcapng 用 Wireshark 离线分析:
+    - 写入: 每条记录一次 struct.pack_into + 两次切片赋值，直接落在映射页上，不经 write() 系统调用，
+      进程崩溃后文件中仍保留最近的记录
+    - 环形: 文件写满后覆盖最旧的记录，占用空间固定 (默认 4 MB)
+    - 未开启抓包时节点持有的 capture 为 None，收发路径上只多一次判断
+    - 接收方向在 FrameBuffer 切帧时记录 (每帧一条，文本帧含分隔符)，发送方向在 PortWriter 写串口前记录，
+      两者都只接收一个 tap 回调 (CaptureRing.tap)，utils 不依赖本模块
+
+环形文件格式 (小端):
+    文件头 (64 字节): MAGIC 'SCAP' | 版本 | 保留 | 数据区容量 | HEAD | TAIL | 存活记录数 | 累计记录数 | 被覆盖记录数
+    记录: 总长(4) | 时间戳 ns(8) | 原始长度(4) | 方向(1) | 端口名长度(1) | 端口名 | 数据 (超过 snaplen 截断)
+    - HEAD 为下一条记录的写入位置，TAIL 为最旧记录的位置
+    - 数据区尾部放不下一条记录时写入总长为 0 的回绕标记 (剩余不足 4 字节时省略)，从头继续
+
+pcapng: 每个端口一个接口 (if_name = 端口名，if_tsresol = 纳秒)，链路类型 LINKTYPE_USER0 (147)，
+帧方向写入 epb_flags。Wireshark 中可在 DLT_User 表里为 User 0 指定解析器 (如按 wire.py 格式编写的 Lua 解析器)
+
+用法:
+    python router.py --capture node_a.cap [--capture-size 8]   开启抓包 (环形文件大小单位 MB)
+    python capture.py export node_a.cap node_a.pcapng          导出
+    python capture.py info node_a.cap                          查看统计
+"""
+
+import mmap
+import struct
+import sys
+import threading
+import time
+from functools import partial
+
+from utils import Logger
+
+MAGIC = b'SCAP'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHQQQQQQ')   # magic, version, reserved, capacity, head, tail, live, records, overwritten
+FILE_HEADER_SIZE = 64
+STATE = struct.Struct('<QQQQQ')              # head, tail, live, records, overwritten (紧跟 capacity)
+STATE_OFFSET = 16
+RECORD = struct.Struct('<IqIBB')             # 总长, 时间戳 ns, 原始长度, 方向, 端口名长度
+
+DIR_RX = 1
+DIR_TX = 2
+DIR_NAMES = {DIR_RX: 'RX', DIR_TX: 'TX'}
+
+DEFAULT_SIZE = 4 * 1024 * 1024
+MIN_SIZE = 64 * 1024
+SNAPLEN = 65535
+LINKTYPE_USER0 = 147
+
+
+class CaptureRing:
+    """
+    内存映射的环形抓包文件 (多线程写入，内部加锁)
+    :param path: 环形文件路径 (已存在时覆盖)
+    :param size: 数据区容量 (字节)
+    """
+    def __init__(self, path, size=DEFAULT_SIZE, snaplen=SNAPLEN):
+        if size < MIN_SIZE:
+            raise ValueError(f"抓包文件至少 {MIN_SIZE // 1024} KB")
+        self.path = path
+        self.capacity = size
+        self.snaplen = min(snaplen, size // 2)
+        self.lock = threading.Lock()
+        self.head = self.tail = 0
+        self.live = self.records = self.overwritten = 0
+        self._names = {}   # 端口名 -> 编码后的 bytes
+
+        with open(path, 'w+b') as f:
+            f.truncate(FILE_HEADER_SIZE + size)
+            self.mm = mmap.mmap(f.fileno(), FILE_HEADER_SIZE + size)
+        FILE_HEADER.pack_into(self.mm, 0, MAGIC, VERSION, 0, size, 0, 0, 0, 0, 0)
+
+    def record(self, port, direction, data):
+        """追加一条记录 (data 为 bytes/bytearray/memoryview)"""
+        ts = time.time_ns()
+        name = self._names.get(port)
+        if name is None:
+            name = self._names[port] = str(port).encode('utf-8')[:255]
+        orig = len(data)
+        if orig > self.snaplen:
+            data = data[:self.snaplen]
+        total = RECORD.size + len(name) + len(data)
+        with self.lock:
+            if self.mm is None:
+                return
+            if self.head + total > self.capacity:
+                self._evict(self.head, self.capacity)
+                if self.capacity - self.head >= 4:
+                    struct.pack_into('<I', self.mm, FILE_HEADER_SIZE + self.head, 0)   # 回绕标记
+                self.head = 0
+            self._evict(self.head, self.head + total)
+            if not self.live:
+                self.tail = self.head
+
+            pos = FILE_HEADER_SIZE + self.head
+            RECORD.pack_into(self.mm, pos, total, ts, orig, direction, len(name))
+            pos += RECORD.size
+            self.mm[pos:pos + len(name)] = name
+            pos += len(name)
+            self.mm[pos:pos + len(data)] = data
+            self.head += total
+            self.live += 1
+            self.records += 1
+            STATE.pack_into(self.mm, STATE_OFFSET, self.head, self.tail, self.live, self.records, self.overwritten)
+
+    def tap(self, port, direction):
+        """返回 tap(data) 回调，供 FrameBuffer / PortWriter 等按帧调用"""
+        return partial(self.record, port, direction)
+
+    def _evict(self, start, end):
+        """在锁内调用: 丢弃起始位置落在 [start, end) 中的最旧记录"""
+        while self.live and start <= self.tail < end:
+            if self.tail + 4 > self.capacity:
+                self.tail = 0
+                continue
+            length = struct.unpack_from('<I', self.mm, FILE_HEADER_SIZE + self.tail)[0]
+            if not length:
+                self.tail = 0
+                continue
+            self.tail += length
+            self.live -= 1
+            self.overwritten += 1
+
+    def stats(self):
+        with self.lock:
+            return {'path': self.path, 'capacity': self.capacity, 'live': self.live,
+                    'records': self.records, 'overwritten': self.overwritten}
+
+    def snapshot(self):
+        """当前文件内容的一致副本 (bytes)，用于运行中导出"""
+        with self.lock:
+            return bytes(self.mm) if self.mm is not None else b''
+
+    def export(self, out_path):
+        """把当前环中的记录导出为 pcapng，返回导出的记录数"""
+        return write_pcapng(iter_records(self.snapshot()), out_path)
+
+    def close(self):
+        with self.lock:
+            if self.mm is not None:
+                self.mm.flush()
+                self.mm.close()
+                self.mm = None
+
+
+def open_capture(path, size_mb=None):
+    """按配置打开抓包文件，失败时记录错误并返回 None (节点照常运行，只是不抓包)"""
+    if not path:
+        return None
+    try:
+        ring = CaptureRing(path, int(size_mb * 1024 * 1024) if size_mb else DEFAULT_SIZE)
+    except (OSError, ValueError) as e:
+        Logger.error(f"无法打开抓包文件 {path}: {e}")
+        return None
+    Logger.info(f"抓包已开启: {path} ({ring.capacity // 1024} KB 环形文件)")
+    return ring
+
+
+def capture_tap(ring, port, direction):
+    """ring 为 None (未开启抓包) 时返回 None，否则返回该端口/方向的 tap 回调"""
+    return ring.tap(port, direction) if ring else None
+
+
+def read_header(buf):
+    """解析环形文件头，返回 dict；不是抓包文件时抛出 ValueError"""
+    if len(buf) < FILE_HEADER_SIZE:
+        raise ValueError("文件过短")
+    magic, version, _, capacity, head, tail, live, records, overwritten = FILE_HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("不是抓包环形文件")
+    if len(buf) < FILE_HEADER_SIZE + capacity:
+        raise ValueError("文件被截断")
+    return {'capacity': capacity, 'head': head, 'tail': tail, 'live': live,
+            'records': records, 'overwritten': overwritten}
+
+
+def iter_records(buf):
+    """
+    按时间顺序 (从 TAIL 开始) 产出环中的记录: (时间戳 ns, 端口名, 方向, 原始长度, 数据 bytes)
+    """
+    hdr = read_header(buf)
+    capacity, pos = hdr['capacity'], hdr['tail']
+    for _ in range(hdr['live']):
+        if pos + 4 > capacity or not struct.unpack_from('<I', buf, FILE_HEADER_SIZE + pos)[0]:
+            pos = 0
+        start = FILE_HEADER_SIZE + pos
+        total, ts, orig, direction, name_len = RECORD.unpack_from(buf, start)
+        if total < RECORD.size + name_len or pos + total > capacity:
+            break   # 文件损坏 (如写入过程中进程被杀)，停止解析
+        name_start = start + RECORD.size
+        name = bytes(buf[name_start:name_start + name_len]).decode('utf-8', 'replace')
+        data = bytes(buf[name_start + name_len:start + total])
+        yield ts, name, direction, orig, data
+        pos += total
+
+
+def _option(code, value):
+    pad = -len(value) % 4
+    return struct.pack('<HH', code, len(value)) + value + bytes(pad)
+
+
+def _block(block_type, body):
+    length = 12 + len(body)
+    return struct.pack('<II', block_type, length) + body + struct.pack('<I', length)
+
+
+def write_pcapng(records, out_path, linktype=LINKTYPE_USER0):
+    """
+    把记录写成 pcapng (每个端口一个接口，纳秒时间戳)
+    :return: 写出的记录数
+    """
+    interfaces = {}
+    count = 0
+    with open(out_path, 'wb') as f:
+        shb = struct.pack('<IHHq', 0x1A2B3C4D, 1, 0, -1) + _option(4, b'SerialNet capture.py') + _option(0, b'')
+        f.write(_block(0x0A0D0D0A, shb))
+        for ts, name, direction, orig, data in records:
+            if name not in interfaces:
+                interfaces[name] = len(interfaces)
+                idb = (struct.pack('<HHI', linktype, 0, SNAPLEN) + _option(2, name.encode('utf-8'))
+                       + _option(9, b'\x09') + _option(0, b''))
+                f.write(_block(0x00000001, idb))
+            flags = 1 if direction == DIR_RX else 2   # epb_flags 方向位: 01 入站, 10 出站
+            epb = (struct.pack('<IIIII', interfaces[name], ts >> 32, ts & 0xFFFFFFFF, len(data), orig)
+                   + data + bytes(-len(data) % 4) + _option(2, struct.pack('<I', flags)) + _option(0, b''))
+            f.write(_block(0x00000006, epb))
+            count += 1
+    return count
+
+
+def export_file(ring_path, out_path):
+    """离线导出环形文件，返回记录数"""
+    with open(ring_path, 'rb') as f:
+        buf = f.read()
+    return write_pcapng(iter_records(buf), out_path)
+
+
+def format_capture_stats(ring):
+    st = ring.stats()
+    return (f"抓包 {st['path']}: 环中 {st['live']} 条, 累计 {st['records']} 条, "
+            f"已覆盖 {st['overwritten']} 条 (容量 {st['capacity'] // 1024} KB)")
+
+
+def main(args):
+    if len(args) >= 3 and args[0] == 'export':
+        try:
+            n = export_file(args[1], args[2])
+        except (OSError, ValueError) as e:
+            Logger.error(f"导出失败: {e}")
+            return
+        Logger.success(f"已导出 {n} 条记录到 {args[2]}")
+    elif len(args) >= 2 and args[0] == 'info':
+        try:
+            with open(args[1], 'rb') as f:
+                buf = f.read()
+            hdr = read_header(buf)
+        except (OSError, ValueError) as e:
+            Logger.error(f"读取失败: {e}")
+            return
+        print(f"容量 {hdr['capacity'] // 1024} KB, 环中 {hdr['live']} 条, 累计 {hdr['records']} 条, "
+              f"已覆盖 {hdr['overwritten']} 条")
+        ports = {}
+        for ts, name, direction, orig, data in iter_records(buf):
+            key = (name, DIR_NAMES.get(direction, '?'))
+            n, size = ports.get(key, (0, 0))
+            ports[key] = (n + 1, size + orig)
+        for (name, d), (n, size) in sorted(ports.items()):
+            print(f"  {name:<20} {d:<3} {n:>8} 帧 {size:>10} 字节")
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
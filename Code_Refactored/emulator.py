@@ -0,0 +1,507 @@
+"""
+多进程拓扑仿真器 (无需硬件)
+
+在一台机器上运行 10~200 个路由节点:
+- 父进程用 PtyFabric 为每条链路创建一对 pty，并负责转发 (波特率限速 / 时延 / 误码 / 通断)
+- 节点分散到多个工作进程中，以 bring_up 非交互方式启动 (不经过串口选择与命令行)
+- 父进程按脚本注入事件: 链路断开/恢复、节点崩溃、突发流量
+
+测量结果:
+- 每个拓扑事件之后的路由收敛时间 (与父进程按当前拓扑 BFS 得到的最短跳数及下一跳比对)
+- 流量事件的投递数量与吞吐量
+- 每个工作进程 / 每个节点的 CPU 时间
+
+拓扑文件 (JSON):
+{
+    "exp": "4",                       // 节点类型: 4 / 5 / 6
+    "processes": 4,                   // 工作进程数 (默认 CPU 核数)
+    "duration": 120,                  // 仿真时长 (秒)
+    "nodes": ["A", "B", "C"],
+    "links": [{"a": "A", "b": "B", "baudrate": 9600, "latency": 0.002, "error_rate": 0}],
+    "events": [
+        {"at": 30, "action": "link_down", "a": "A", "b": "B"},
+        {"at": 50, "action": "link_up",   "a": "A", "b": "B"},
+        {"at": 70, "action": "crash",     "node": "C"},
+        {"at": 80, "action": "traffic",   "src": "A", "dst": "B", "count": 100, "size": 32, "interval": 0.01}
+    ]
+}
+
+用法 (仅 Linux/macOS):
+    python Code_Refactored/emulator.py topo.json [--out report.json] [--processes 8] [--verbose]
+    python Code_Refactored/emulator.py --ring 50 [--exp 4] [--duration 120] [--save topo.json]
+    python Code_Refactored/emulator.py --grid 8x8 --latency 0.005 --error-rate 1e-5
+"""
+
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from utils import Logger
+from virtual_serial import PtyFabric, load_node_class
+
+REPORT_INTERVAL = 0.5    # 工作进程上报节点状态的间隔 (秒)
+TICK = 0.25              # 父进程主循环间隔 (秒)
+INFINITY = 999           # 与各实验路由表中的 "不可达" 取值一致
+
+
+# === 工作进程 ===
+
+def _instrument(node_class, exp):
+    """
+    为节点类加上投递/转发计数与统一的发送接口 (不修改实验代码本身)
+    实验四/五在 _on_recv_data 中处理数据包，实验六在 _process_network_packet 中处理
+    """
+    hook = '_process_network_packet' if exp == '6' else '_on_recv_data'
+    module = sys.modules[node_class.__module__]
+
+    class EmulatedNode(node_class):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.counters = {'delivered': 0, 'delivered_bytes': 0, 'forwarded': 0, 'last_delivery': 0.0}
+            self.counters_lock = threading.Lock()
+
+        def count_packet(self, dst_id, payload):
+            with self.counters_lock:
+                if dst_id == self.my_id:
+                    self.counters['delivered'] += 1
+                    self.counters['delivered_bytes'] += len(payload)
+                    self.counters['last_delivery'] = time.time()
+                else:
+                    self.counters['forwarded'] += 1
+
+        def send_message(self, dst_id, body):
+            """由本节点发起一条应用消息"""
+            if exp == '6':
+                self._network_send(dst_id, f"{module.PROTO_TRANSPORT}{module.SEPARATOR}{body}", module.DEFAULT_TTL)
+            elif exp == '5':
+                self._initiate_reliable_send(dst_id, body)   # 停等协议，阻塞直到确认或放弃
+            else:
+                self._initiate_send(dst_id, body)
+
+        def snapshot(self):
+            with self.rt_lock:
+                routes = {d: (r['cost'], r['next_hop_id']) for d, r in self.routing_table.items()}
+            with self.counters_lock:
+                counters = dict(self.counters)
+            return {'routes': routes, 'counters': counters, 'time': time.time()}
+
+    original = getattr(node_class, hook)
+
+    def counted(self, src_id, dst_id, *rest):
+        self.count_packet(dst_id, rest[-1])
+        return original(self, src_id, dst_id, *rest)
+
+    setattr(EmulatedNode, hook, counted)
+    return EmulatedNode
+
+
+def _crash(node):
+    """模拟节点崩溃: 停止所有任务并关闭串口，不再发送 Hello/DV"""
+    node.running = False
+    for writer in list(node.port_writers.values()):
+        writer.close()
+    time.sleep(0.3)  # 等待监听线程从读超时中退出，再关闭串口
+    for ser in list(node.active_ports.values()):
+        try:
+            ser.close()
+        except Exception:
+            pass
+
+
+def _send_traffic(node, dst_id, count, size, interval):
+    for i in range(count):
+        node.send_message(dst_id, f"{i:06d}".ljust(size, 'x'))
+        if interval:
+            time.sleep(interval)
+
+
+def _worker(index, exp, node_options, assignments, conn, status_queue, verbose):
+    """工作进程: 启动分配到的节点，执行父进程命令，并定期上报节点状态"""
+    if not verbose:
+        # 节点日志量很大，默认丢弃，避免拖慢仿真
+        sys.stdout = open(os.devnull, 'w')
+        sys.stderr = sys.stdout
+
+    NodeClass = _instrument(load_node_class(exp), exp)
+    nodes = {}
+    for name, ports in assignments:
+        node = NodeClass(**node_options)
+        ok = node.bring_up(name, ports, report_viz=False) if exp == '6' else node.bring_up(name, ports)
+        if ok:
+            nodes[name] = node
+
+    def report(kind):
+        cpu = os.times()
+        snapshot = {name: node.snapshot() for name, node in nodes.items() if node.running}
+        status_queue.put((kind, index, cpu.user + cpu.system, snapshot))
+
+    last_report = 0.0
+    while True:
+        if conn.poll(TICK):
+            cmd = conn.recv()
+            if cmd[0] == 'stop':
+                break
+            if cmd[0] == 'crash' and cmd[1] in nodes:
+                _crash(nodes[cmd[1]])
+            elif cmd[0] == 'traffic' and cmd[1] in nodes:
+                _, src, dst, count, size, interval = cmd
+                threading.Thread(target=_send_traffic, args=(nodes[src], dst, count, size, interval),
+                                 daemon=True).start()
+        now = time.monotonic()
+        if now - last_report >= REPORT_INTERVAL:
+            report('status')
+            last_report = now
+
+    report('final')
+    for node in nodes.values():
+        node.running = False
+
+
+# === 父进程 ===
+
+def _generate(kind, spec, baudrate=9600, latency=0.0, error_rate=0.0):
+    """生成常用拓扑: line / ring (spec 为节点数)，grid (spec 为 '行x列')"""
+    edges = []
+    if kind == 'grid':
+        rows, cols = (int(x) for x in spec.lower().split('x'))
+        names = [f"R{r}C{c}" for r in range(rows) for c in range(cols)]
+        for r in range(rows):
+            for c in range(cols):
+                if c + 1 < cols:
+                    edges.append((f"R{r}C{c}", f"R{r}C{c + 1}"))
+                if r + 1 < rows:
+                    edges.append((f"R{r}C{c}", f"R{r + 1}C{c}"))
+    else:
+        count = int(spec)
+        names = [f"N{i}" for i in range(count)]
+        edges = [(names[i], names[i + 1]) for i in range(count - 1)]
+        if kind == 'ring' and count > 2:
+            edges.append((names[-1], names[0]))
+
+    links = [{'a': a, 'b': b, 'baudrate': baudrate, 'latency': latency, 'error_rate': error_rate}
+             for a, b in edges]
+    return {'nodes': names, 'links': links, 'events': []}
+
+
+class Emulator:
+    """在父进程中运行: 创建链路、启动工作进程、注入事件并汇总测量结果"""
+
+    def __init__(self, topology, processes=None, verbose=False):
+        self.topology = topology
+        self.exp = str(topology.get('exp', '4'))
+        self.duration = float(topology.get('duration', 60))
+        self.names = list(topology['nodes'])
+        self.processes = max(1, min(processes or topology.get('processes') or os.cpu_count() or 1,
+                                    len(self.names)))
+        self.verbose = verbose
+        self.node_options = {'use_reactor': True} if self.exp == '4' and topology.get('reactor') else {}
+
+        self.fabric = PtyFabric(seed=topology.get('seed'))
+        self.links = {}            # (a, b) -> PtyLink
+        self.ports = {n: [] for n in self.names}
+        self.alive = set(self.names)
+
+        self.owner = {}            # 节点 -> 工作进程编号
+        self.workers = []          # [(Process, Connection)]
+        self.status_queue = None
+        self.snapshots = {}        # 节点 -> 最近一次上报
+        self.cpu = {}              # 工作进程编号 -> CPU 秒
+        self.finished = set()
+
+        self.convergence = []      # 每个拓扑事件的收敛记录
+        self.traffic = []
+        self._expected = None      # 当前拓扑下的期望路由 (缓存)
+
+    # --- 拓扑 ---
+
+    def _build_links(self):
+        for spec in self.topology['links']:
+            a, b = spec['a'], spec['b']
+            link = self.fabric.connect(spec.get('baudrate', 9600), spec.get('latency', 0.0),
+                                       spec.get('error_rate', 0.0))
+            self.links[(a, b)] = link
+            self.ports[a].append(link.path_a)
+            self.ports[b].append(link.path_b)
+
+    def _find_link(self, a, b):
+        return self.links.get((a, b)) or self.links.get((b, a))
+
+    def _adjacency(self):
+        adj = {n: set() for n in self.alive}
+        for (a, b), link in self.links.items():
+            if link.up and a in self.alive and b in self.alive:
+                adj[a].add(b)
+                adj[b].add(a)
+        return adj
+
+    def _expected_routes(self):
+        """按当前拓扑 (存活节点 + 连通链路) BFS 计算每个节点到其它节点的跳数"""
+        if self._expected is None:
+            adj = self._adjacency()
+            dist = {}
+            for src in self.alive:
+                d = {src: 0}
+                queue = deque([src])
+                while queue:
+                    u = queue.popleft()
+                    for v in adj[u]:
+                        if v not in d:
+                            d[v] = d[u] + 1
+                            queue.append(v)
+                dist[src] = d
+            self._expected = (adj, dist)
+        return self._expected
+
+    def _node_converged(self, name, since):
+        snap = self.snapshots.get(name)
+        if not snap or snap['time'] < since:
+            return False
+        adj, dist = self._expected_routes()
+        mine = dist[name]
+        routes = snap['routes']
+        for dest, (cost, next_hop) in routes.items():
+            if dest == name:
+                continue
+            if dest not in mine:
+                if cost < INFINITY:
+                    return False
+            elif cost != mine[dest] or next_hop not in adj[name] or dist[next_hop].get(dest) != cost - 1:
+                return False
+        # 所有可达节点都必须出现在路由表中
+        return all(dest in routes for dest in mine)
+
+    def _converged(self, since):
+        return all(self._node_converged(n, since) for n in self.alive)
+
+    # --- 事件 ---
+
+    def _topology_changed(self, label, now):
+        for record in self.convergence:
+            if record['converged_after'] is None and not record.get('interrupted'):
+                record['interrupted'] = True   # 上一次变化尚未收敛又发生了新的变化
+        self._expected = None
+        self.convergence.append({'event': label, 'at': round(now - self.start, 2),
+                                 'wall': time.time(), 'converged_after': None})
+
+    def _fire(self, event, now):
+        action = event['action']
+        if action in ('link_down', 'link_up'):
+            link = self._find_link(event['a'], event['b'])
+            if not link:
+                Logger.warning(f"[Emulator] 链路不存在: {event['a']}-{event['b']}")
+                return
+            link.set_up(action == 'link_up')
+            self._topology_changed(f"{action} {event['a']}-{event['b']}", now)
+        elif action == 'crash':
+            node = event['node']
+            if node not in self.alive:
+                return
+            self.alive.discard(node)
+            self.workers[self.owner[node]][1].send(('crash', node))
+            self._topology_changed(f"crash {node}", now)
+        elif action == 'traffic':
+            src, dst = event['src'], event['dst']
+            count, size = int(event.get('count', 100)), int(event.get('size', 32))
+            base = self.snapshots.get(dst, {}).get('counters', {}).get('delivered', 0)
+            self.traffic.append({'src': src, 'dst': dst, 'count': count, 'size': size,
+                                 'start': time.time(), 'base': base})
+            self.workers[self.owner[src]][1].send(('traffic', src, dst, count, size,
+                                                   float(event.get('interval', 0))))
+        else:
+            Logger.warning(f"[Emulator] 未知事件: {action}")
+            return
+        Logger.info(f"[Emulator] t={now - self.start:.1f}s {action} {event}")
+
+    # --- 运行 ---
+
+    def _drain_status(self, block=False):
+        import queue
+        while True:
+            try:
+                kind, index, cpu, snapshot = self.status_queue.get(timeout=1.0 if block else 0)
+            except queue.Empty:
+                return
+            self.cpu[index] = cpu
+            self.snapshots.update(snapshot)
+            if kind == 'final':
+                self.finished.add(index)
+                if block and len(self.finished) == len(self.workers):
+                    return
+
+    def run(self):
+        self._build_links()
+        ctx = multiprocessing.get_context('spawn')
+        self.status_queue = ctx.Queue()
+        groups = [[] for _ in range(self.processes)]
+        for i, name in enumerate(self.names):
+            self.owner[name] = i % self.processes
+            groups[i % self.processes].append((name, self.ports[name]))
+
+        Logger.info(f"[Emulator] 实验{self.exp}: {len(self.names)} 个节点, {len(self.links)} 条链路, "
+                    f"{self.processes} 个工作进程")
+        for index, group in enumerate(groups):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker, daemon=True,
+                               args=(index, self.exp, self.node_options, group, child_conn,
+                                     self.status_queue, self.verbose))
+            proc.start()
+            self.workers.append((proc, parent_conn))
+
+        self.start = time.monotonic()
+        self._topology_changed('startup', self.start)
+        events = sorted(self.topology.get('events', []), key=lambda e: e['at'])
+        pending = deque(events)
+
+        try:
+            while True:
+                now = time.monotonic()
+                if now - self.start >= self.duration:
+                    break
+                while pending and now - self.start >= pending[0]['at']:
+                    self._fire(pending.popleft(), now)
+                self._drain_status()
+                self._check_convergence(now)
+                time.sleep(TICK)
+        except KeyboardInterrupt:
+            Logger.warning("[Emulator] 已中断，正在汇总结果...")
+        finally:
+            self._stop()
+        return self.report()
+
+    def _check_convergence(self, now):
+        record = self.convergence[-1]
+        if record['converged_after'] is not None:
+            return
+        if self._converged(record['wall']):
+            record['converged_after'] = round(now - self.start - record['at'], 2)
+            Logger.success(f"[Emulator] {record['event']} 后收敛，用时 {record['converged_after']}s")
+
+    def _stop(self):
+        for _, conn in self.workers:
+            try:
+                conn.send(('stop',))
+            except (BrokenPipeError, OSError):
+                pass
+        deadline = time.monotonic() + 5
+        while len(self.finished) < len(self.workers) and time.monotonic() < deadline:
+            self._drain_status(block=True)
+        for proc, _ in self.workers:
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+        self.fabric.close()
+
+    # --- 汇总 ---
+
+    def report(self):
+        traffic = []
+        for t in self.traffic:
+            counters = self.snapshots.get(t['dst'], {}).get('counters', {})
+            delivered = counters.get('delivered', 0) - t['base']
+            elapsed = counters.get('last_delivery', 0) - t['start']
+            rate = delivered / elapsed if delivered > 0 and elapsed > 0 else 0.0
+            traffic.append({'src': t['src'], 'dst': t['dst'], 'sent': t['count'], 'delivered': delivered,
+                            'loss': round(1 - delivered / t['count'], 4) if t['count'] else 0.0,
+                            'msgs_per_s': round(rate, 1), 'bytes_per_s': round(rate * t['size'], 1)})
+
+        per_process = [round(self.cpu.get(i, 0.0), 2) for i in range(len(self.workers))]
+        per_node = [self.cpu.get(self.owner[n], 0.0) / sum(1 for m in self.names if self.owner[m] == self.owner[n])
+                    for n in self.names]
+        forwarded = {n: s['counters']['forwarded'] for n, s in self.snapshots.items()}
+
+        line_bytes = line_errors = line_dropped = 0
+        for link in self.links.values():
+            stats = link.stats()
+            line_bytes += sum(stats['bytes'])
+            line_errors += sum(stats['errors'])
+            line_dropped += sum(stats['dropped'])
+
+        return {
+            'exp': self.exp,
+            'nodes': len(self.names),
+            'links': len(self.links),
+            'processes': self.processes,
+            'duration': self.duration,
+            'convergence': [{k: v for k, v in r.items() if k != 'wall'} for r in self.convergence],
+            'traffic': traffic,
+            'cpu': {
+                'per_process': per_process,
+                'per_node_avg': round(sum(per_node) / len(per_node), 3) if per_node else 0.0,
+                'per_node_max': round(max(per_node), 3) if per_node else 0.0,
+            },
+            'forwarded_total': sum(forwarded.values()),
+            'line': {'bytes': line_bytes, 'bit_errors': line_errors, 'dropped_bytes': line_dropped},
+        }
+
+
+def print_report(report):
+    Logger.console("=" * 60)
+    Logger.console(f"仿真结果: 实验{report['exp']}, {report['nodes']} 节点 / {report['links']} 链路 / "
+          f"{report['processes']} 进程, {report['duration']:.0f}s")
+    Logger.console("-" * 60)
+    Logger.console(f"{'事件':<28} | {'时刻(s)':<8} | 收敛用时(s)")
+    for r in report['convergence']:
+        if r['converged_after'] is not None:
+            result = f"{r['converged_after']}"
+        else:
+            result = "被后续事件打断" if r.get('interrupted') else "未收敛"
+        Logger.console(f"{r['event']:<28} | {r['at']:<8} | {result}")
+    if report['traffic']:
+        Logger.console("-" * 60)
+        Logger.console(f"{'流量':<12} | {'发送':<6} | {'送达':<6} | {'丢失率':<8} | {'msg/s':<8} | B/s")
+        for t in report['traffic']:
+            Logger.console(f"{t['src'] + '->' + t['dst']:<12} | {t['sent']:<6} | {t['delivered']:<6} | "
+                  f"{t['loss']:<8} | {t['msgs_per_s']:<8} | {t['bytes_per_s']}")
+    Logger.console("-" * 60)
+    cpu = report['cpu']
+    Logger.console(f"CPU: 每节点平均 {cpu['per_node_avg']}s, 最大 {cpu['per_node_max']}s, 各进程 {cpu['per_process']}")
+    line = report['line']
+    Logger.console(f"线路: {line['bytes']} 字节, {line['bit_errors']} 个误码, 断链丢弃 {line['dropped_bytes']} 字节; "
+          f"转发 {report['forwarded_total']} 包")
+    Logger.console("=" * 60)
+
+
+def _arg(args, name, default=None):
+    return args[args.index(name) + 1] if name in args else default
+
+
+def main():
+    args = sys.argv[1:]
+    for kind in ('line', 'ring', 'grid'):
+        if f'--{kind}' in args:
+            topology = _generate(kind, _arg(args, f'--{kind}'), int(_arg(args, '--baud', 9600)),
+                                 float(_arg(args, '--latency', 0.0)), float(_arg(args, '--error-rate', 0.0)))
+            break
+    else:
+        files = [a for a in args if a.endswith('.json') and a not in (_arg(args, '--out'), _arg(args, '--save'))]
+        if not files:
+            print(__doc__)
+            return
+        with open(files[0], encoding='utf-8') as f:
+            topology = json.load(f)
+
+    if '--exp' in args:
+        topology['exp'] = _arg(args, '--exp')
+    if '--duration' in args:
+        topology['duration'] = float(_arg(args, '--duration'))
+    if '--reactor' in args:
+        topology['reactor'] = True
+    if '--save' in args:
+        with open(_arg(args, '--save'), 'w', encoding='utf-8') as f:
+            json.dump(topology, f, indent=2, ensure_ascii=False)
+
+    processes = int(_arg(args, '--processes')) if '--processes' in args else None
+    report = Emulator(topology, processes, verbose='--verbose' in args).run()
+    print_report(report)
+    if '--out' in args:
+        with open(_arg(args, '--out'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        Logger.info(f"报告已写入 {_arg(args, '--out')}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+链路层前向纠错 (交织 XOR 校验)
+
+长线缆上的误码是稳定、分散的: 每个错字节都会让整帧被丢弃，实验五要等停等超时重传，
+启用 ARQ 时也要付出一次逐跳重传。FEC 用一部分带宽换重传: 每个二进制帧按 FEC_BLOCK 字节切块，
+每块附带校验，每 K 个数据块增加一个 XOR 校验块，同组内任意一块出错都可以在接收端直接恢复。
+
+信封格式 (复用 wire.HEADER, TYPE = CODE_FEC):
+    MAGIC | CODE_FEC | K | PAD | HCHK | 0 | LEN | 单元 * M
+    - 单元: 块 (FEC_BLOCK 字节) + 该块的 CRC32 低 16 位；前 N 个为数据块，后 G = ceil(N / K) 个为校验块，
+      M = N + G = (LEN + PAD) / (FEC_BLOCK + 2)
+    - 末个数据块按补零 PAD 字节计算校验与 XOR，但补零部分不发送 (接收方按 PAD 还原)
+    - 交织: 第 j 个数据块属于第 j % G 组，连续的突发错误落在不同组中
+    - 第 g 个校验块 = 第 g 组所有数据块的 XOR
+    - HCHK: 首部校验字节 (wire.envelope_check)，首部本身出错时整帧丢弃 (无法纠正)
+一组内只有一块校验失败时由其余块异或恢复 (corrected)；一组内两块以上失败则整帧丢弃 (uncorrectable)
+
+冗余度按端口设置 (K 越小冗余越高，0 为关闭)，只对二进制帧生效，HELLO/LINK 等文本控制帧不编码。
+对端在 HELLO 中声明了 FEC 能力才会发送 FEC 帧；解码不依赖本端设置
+"""
+
+import threading
+import time
+import zlib
+
+from wire import MAGIC, HEADER, CODE_FEC, CAP_FEC, CAP_BINARY, FEC_BLOCK, FEC_CRC, FEC_MAX_LEVEL, envelope_check
+
+UNIT = FEC_BLOCK + FEC_CRC
+
+
+def _block_crc(block):
+    return (zlib.crc32(block) & 0xFFFF).to_bytes(FEC_CRC, 'big')
+
+
+def _xor(blocks):
+    """按大整数异或一组等长块"""
+    acc = 0
+    for block in blocks:
+        acc ^= int.from_bytes(block, 'big')
+    return acc.to_bytes(FEC_BLOCK, 'big')
+
+
+def is_fec_frame(frame):
+    """判断二进制帧是否为 FEC 信封"""
+    return len(frame) > 1 and frame[0] == MAGIC and frame[1] == CODE_FEC
+
+
+def fec_encode(frame, level):
+    """
+    将一个二进制帧装入 FEC 信封
+    :param level: 每个校验块保护的数据块数 K (1..FEC_MAX_LEVEL)
+    """
+    data = bytes(frame)
+    n = -(-len(data) // FEC_BLOCK)
+    pad = n * FEC_BLOCK - len(data)
+    data += bytes(pad)
+    blocks = [data[i * FEC_BLOCK:(i + 1) * FEC_BLOCK] for i in range(n)]
+    groups = -(-n // level)
+    blocks += [_xor(blocks[g::groups]) for g in range(groups)]
+
+    units = [block + _block_crc(block) for block in blocks]
+    units[n - 1] = blocks[n - 1][:FEC_BLOCK - pad] + _block_crc(blocks[n - 1])  # 补零部分不发送
+    length = len(units) * UNIT - pad
+    head = HEADER.pack(MAGIC, CODE_FEC, level, pad, envelope_check(level, pad, length), 0, length)
+    return head + b''.join(units)
+
+
+def fec_decode(frame):
+    """
+    解开 FEC 信封
+    :return: (内层帧 bytes 或 None, 恢复的块数)；无法纠正时内层帧为 None
+    """
+    level, pad, length = frame[2], frame[3], len(frame) - HEADER.size
+    units = (length + pad) // UNIT
+    groups = -(-units // (level + 1))
+    n = units - groups
+
+    blocks, bad = [], []
+    pos = HEADER.size
+    for i in range(units):
+        size = FEC_BLOCK - pad if i == n - 1 else FEC_BLOCK
+        block = bytes(frame[pos:pos + size]) + bytes(FEC_BLOCK - size)
+        if _block_crc(block) != bytes(frame[pos + size:pos + size + FEC_CRC]):
+            bad.append(i)
+        blocks.append(block)
+        pos += size + FEC_CRC
+
+    repaired = 0
+    missing = {}
+    for i in bad:
+        g = i % groups if i < n else i - n
+        if g in missing:
+            return None, 0  # 同一组两块出错
+        missing[g] = i
+    for g, i in missing.items():
+        if i < n:
+            members = [blocks[j] for j in range(g, n, groups) if j != i] + [blocks[n + g]]
+            blocks[i] = _xor(members)
+            repaired += 1
+        # 校验块本身出错不影响数据
+
+    data = b''.join(blocks[:n])
+    return data[:len(data) - pad], repaired
+
+
+def parse_level(text):
+    """命令行/配置中的冗余度: 'off' 为 0，否则为整数 K"""
+    return 0 if str(text).lower() == 'off' else int(text)
+
+
+class FecStats:
+    """单个端口的 FEC 统计"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.encoded = 0        # 编码发送的帧数
+        self.raw_out = 0        # 编码前字节
+        self.wire_out = 0       # 编码后字节
+        self.received = 0       # 收到的 FEC 帧
+        self.clean = 0          # 无错误
+        self.corrected = 0      # 有错误但已纠正的帧
+        self.blocks_fixed = 0   # 纠正的块数
+        self.uncorrectable = 0  # 无法纠正而丢弃的帧
+        self.cpu = 0.0          # 编码+解码 CPU 时间 (秒)
+
+    def overhead(self):
+        """发送方向的带宽开销 (编码后/编码前 - 1)，无数据时为 None"""
+        with self.lock:
+            return self.wire_out / self.raw_out - 1 if self.raw_out else None
+
+
+class LinkFec:
+    """
+    每个节点一个，按端口管理 FEC 冗余度与统计
+    :param levels: 默认冗余度 (int，对所有端口生效) 或 {port: K}；0/None 表示关闭
+    """
+    def __init__(self, levels=None):
+        self.default = 0
+        self.levels = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        if isinstance(levels, dict):
+            for port, level in levels.items():
+                self.set_level(port, level)
+        elif levels:
+            self.default = self._check(levels)
+
+    @staticmethod
+    def _check(level):
+        level = parse_level(level)
+        if not 0 <= level <= FEC_MAX_LEVEL:
+            raise ValueError(f"FEC 冗余度应为 0~{FEC_MAX_LEVEL} (每个校验块保护的数据块数，0 为关闭)")
+        return level
+
+    def set_level(self, port, level):
+        """设置端口冗余度 K (0 为关闭)"""
+        with self.lock:
+            self.levels[port] = self._check(level)
+
+    def level(self, port):
+        with self.lock:
+            return self.levels.get(port, self.default)
+
+    def port_stats(self, port):
+        with self.lock:
+            st = self.stats.get(port)
+            if st is None:
+                st = self.stats[port] = FecStats()
+            return st
+
+    def encode(self, port, data, caps):
+        """
+        发送前调用: 链路协商了 FEC 且端口冗余度非 0 时编码二进制帧，否则原样返回
+        :param caps: 该端口协商一致的能力
+        """
+        level = self.level(port)
+        if not level or CAP_FEC not in caps or CAP_BINARY not in caps or not data or data[0] != MAGIC:
+            return data
+        start = time.thread_time()
+        out = fec_encode(data, level)
+        st = self.port_stats(port)
+        with st.lock:
+            st.cpu += time.thread_time() - start
+            st.encoded += 1
+            st.raw_out += len(data)
+            st.wire_out += len(out)
+        return out
+
+    def decode(self, port, frame):
+        """接收到 FEC 信封时调用，返回内层帧；无法纠正时返回 None"""
+        start = time.thread_time()
+        inner, repaired = fec_decode(frame)
+        st = self.port_stats(port)
+        with st.lock:
+            st.cpu += time.thread_time() - start
+            st.received += 1
+            if inner is None:
+                st.uncorrectable += 1
+            elif repaired:
+                st.corrected += 1
+                st.blocks_fixed += repaired
+            else:
+                st.clean += 1
+        return inner
+
+
+def format_fec_stats(fec):
+    """将各端口 FEC 统计格式化为表格行 (list of str)"""
+    lines = [f"{'Port':<15} {'K':<4} {'Overhead':<10} {'Sent':<8} {'Recv':<8} {'Clean':<8} "
+             f"{'Corrected':<10} {'Blocks':<8} {'Uncorr':<8} {'CPU ms':<8}"]
+    lines.append("-" * 96)
+    with fec.lock:
+        ports = sorted(set(fec.stats) | set(fec.levels))
+    for port in ports:
+        st = fec.port_stats(port)
+        overhead = st.overhead()
+        overhead_str = f"{overhead * 100:.0f}%" if overhead is not None else "-"
+        lines.append(f"{port:<15} {fec.level(port) or 'off':<4} {overhead_str:<10} {st.encoded:<8} {st.received:<8} "
+                     f"{st.clean:<8} {st.corrected:<10} {st.blocks_fixed:<8} {st.uncorrectable:<8} {st.cpu * 1000:<8.1f}")
+    return lines
@@ -0,0 +1,336 @@
+"""
+逐跳链路层可靠传输 (选择重传 ARQ)
+
+实验五的端到端停等协议要等 TIMEOUT_RETRANSMIT (3 秒) 才能发现丢帧，多跳时延迟成倍增加。
+启用后 (--arq / 配置项 link_arq)，相邻节点在 HELLO 中声明 ARQ 能力，双方都支持 (且支持 BIN)
+的链路上，DV/DATA 帧装入带序号和 CRC32 的信封逐跳确认，丢帧或错帧在出错的那一跳以毫秒级重传修复。
+HELLO、LINK 等链路控制帧仍然直接发送。路由与运输层逻辑不变。
+
+信封格式 (复用 wire.HEADER, TYPE = CODE_ARQ):
+    DATA: MAGIC | CODE_ARQ | KIND_DATA | SEQ  | HCHK | 0 | LEN | EPOCH(1) | 内层帧 | CRC32(4)
+    ACK:  MAGIC | CODE_ARQ | KIND_ACK  | NEXT | HCHK | 0 | LEN | EPOCH(1) | BITMAP(4) | CRC32(4)
+    - HCHK: 首部校验字节 (wire.envelope_check)，分帧时即可丢弃长度被改写的首部
+    - SEQ: 8 位链路序号；发送窗口 WINDOW 帧 (选择重传要求 WINDOW <= 128)
+    - NEXT: 接收方下一个期望的序号 (之前的帧都已收到)；BITMAP 第 i 位表示 NEXT+1+i 已缓存
+    - EPOCH: 发送方会话号，节点重启或放弃重传后更换，接收方据此重新同步到序号 0
+      (接收方自身状态刚建立时则同步到收到的第一个序号)
+    - CRC32 覆盖 CRC 之前的全部字节，校验失败的帧直接丢弃 (不确认)，由发送方重传
+
+发送方按 RFC 6298 估计 RTT 计算重传超时 (Karn 算法: 重传过的帧不采样)，且不低于按当前波特率
+发送整个窗口所需的时间 (计时从入队开始，帧可能还排在队列中)；
+ACK 的 BITMAP 显示后续帧已到而 NEXT 缺失时立即快速重传 (每个 RTT 至多一次)
+"""
+
+import random
+import threading
+import time
+import zlib
+from collections import deque
+
+from utils import Logger, PRIO_HELLO, PRIO_CONTROL
+from wire import MAGIC, HEADER, MAX_PAYLOAD, CODE_ARQ, CAP_ARQ, CAP_BINARY, envelope_check
+
+KIND_DATA = 0
+KIND_ACK = 1
+
+WINDOW = 16           # 发送窗口 (帧)
+BITMAP_BITS = 32      # ACK 中选择确认的范围 (不小于 WINDOW)
+MAX_BACKLOG = 256     # 窗口满时等待的帧数上限，超过则丢弃 (与 PortWriter 队列满时一致)
+INITIAL_RTO = 0.5     # 秒
+MIN_RTO = 0.05
+MAX_RTO = 3.0
+MAX_RETRIES = 8       # 超过后放弃窗口内的帧并更换 EPOCH
+QUEUE_ALLOWANCE = 512 # 帧在发送队列中可能排在其后的字节数 (PortWriter 单批上限)
+TICK = 0.01           # 重传定时器精度 (秒)
+
+CRC_SIZE = 4
+
+
+def _seal(kind, seq, epoch, body=b''):
+    """封装信封并追加 CRC32"""
+    length = 1 + len(body) + CRC_SIZE
+    head = HEADER.pack(MAGIC, CODE_ARQ, kind, seq, envelope_check(kind, seq, length), 0, length)
+    data = b''.join((head, bytes((epoch,)), body))
+    return data + zlib.crc32(data).to_bytes(CRC_SIZE, 'big')
+
+
+def is_arq_frame(frame):
+    """判断二进制帧是否为 ARQ 信封"""
+    return len(frame) > 1 and frame[0] == MAGIC and frame[1] == CODE_ARQ
+
+
+class _Link:
+    """单个端口的 ARQ 状态 (发送窗口 + 接收窗口 + 统计)"""
+    def __init__(self, epoch=None):
+        self.epoch = epoch or random.randint(1, 255)
+        self.base = 0           # 最早未确认的序号
+        self.next_seq = 0
+        self.window = {}        # seq -> {'data', 'prio', 'frame', 'sent_at', 'retries'}
+        self.backlog = deque()  # [(data, prio)]: 窗口满时等待
+
+        self.rx_epoch = None
+        self.expected = 0
+        self.rx_buf = {}        # seq -> 内层帧 (乱序到达，等待按序交付)
+
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+
+        # 统计
+        self.sent = 0           # 首次发送的帧
+        self.retransmits = 0    # 超时重传
+        self.fast = 0           # 快速重传
+        self.acked = 0
+        self.delivered = 0      # 按序交付给上层的帧
+        self.reordered = 0      # 乱序到达 (缓存后交付)
+        self.dup = 0            # 重复帧
+        self.crc_errors = 0
+        self.lost = 0           # 放弃重传的帧
+        self.backlog_drops = 0
+        self.resets = 0
+
+
+class LinkArq:
+    """
+    每个节点一个，管理所有端口的逐跳 ARQ
+    :param send_raw: send_raw(port, data, prio) -> 直接把一帧放入该端口发送队列 (不再经过 ARQ)
+    :param baudrate_of: baudrate_of(port) -> 端口当前波特率 (可选，用于计算重传超时下限)
+    """
+    def __init__(self, send_raw, baudrate_of=None, window=WINDOW):
+        self.send_raw = send_raw
+        self.baudrate_of = baudrate_of
+        self.window = window
+        self.links = {}
+        self.lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def active(self, port):
+        """该端口是否已协商 ARQ"""
+        return port in self.links
+
+    def on_hello(self, port, caps):
+        """按 HELLO 协商结果启用/停用端口 ARQ (caps 为双方能力的交集)"""
+        enable = CAP_ARQ in caps and CAP_BINARY in caps
+        with self.lock:
+            link = self.links.get(port)
+            if enable and not link:
+                self.links[port] = _Link()
+                Logger.info(f"[{port}] 逐跳重传已启用 (窗口 {self.window})")
+            elif not enable and link:
+                # 邻居换成不支持 ARQ 的节点: 未确认与等待中的帧改为直接发送
+                del self.links[port]
+                pending = [f['data'] for _, f in sorted(link.window.items(), key=lambda kv: (kv[0] - link.base) & 0xFF)]
+                pending += [data for data, _ in link.backlog]
+                for data in pending:
+                    self.send_raw(port, data, PRIO_CONTROL)
+
+    def reset(self, port):
+        """邻居超时或端口关闭: 丢弃该端口 ARQ 状态，下一次 HELLO 后以新 EPOCH 重新开始"""
+        with self.lock:
+            self.links.pop(port, None)
+
+    def send(self, port, data, prio):
+        """
+        可靠发送一帧 (bytes)；未协商 ARQ 或帧过长时直接发送
+        :return: False 表示等待队列已满被丢弃
+        """
+        with self.lock:
+            link = self.links.get(port)
+            if link is None or len(data) + 1 + CRC_SIZE > MAX_PAYLOAD:
+                return self.send_raw(port, data, prio)
+            if self._window_full(link):
+                if len(link.backlog) >= MAX_BACKLOG:
+                    link.backlog_drops += 1
+                    return False
+                link.backlog.append((data, prio))
+                return True
+            self._admit(port, link, data, prio)
+            return True
+
+    def on_frame(self, port, frame):
+        """
+        处理收到的 ARQ 信封
+        :return: 按序交付的内层帧列表 (由节点继续按普通帧处理)
+        """
+        if len(frame) < HEADER.size + 1 + CRC_SIZE:
+            return []
+        _, _, kind, seq, _, _, _ = HEADER.unpack_from(frame, 0)
+        end = len(frame) - CRC_SIZE
+        ok = zlib.crc32(frame[:end]) == int.from_bytes(frame[end:], 'big')
+        epoch = frame[HEADER.size]
+        body = frame[HEADER.size + 1:end]
+
+        with self.lock:
+            link = self.links.get(port)
+            if link is None:
+                return []  # 尚未收到对方 HELLO，不确认，发送方稍后重传
+            if not ok:
+                link.crc_errors += 1
+                return []
+            if kind == KIND_ACK:
+                if len(body) == BITMAP_BITS // 8:
+                    self._on_ack(port, link, epoch, seq, int.from_bytes(body, 'big'))
+                return []
+            out = self._on_data(link, epoch, seq, body)
+            self._send_ack(port, link)
+        return out
+
+    # --- 发送方 ---
+
+    def _window_full(self, link):
+        # 按序号跨度而非帧数判断: 最早未确认的帧之后最多再发 window-1 个序号，否则超出接收窗口
+        return ((link.next_seq - link.base) & 0xFF) >= self.window
+
+    def _admit(self, port, link, data, prio):
+        seq = link.next_seq
+        link.next_seq = (seq + 1) & 0xFF
+        entry = {'data': data, 'prio': prio, 'frame': _seal(KIND_DATA, seq, link.epoch, data),
+                 'sent_at': time.monotonic(), 'retries': 0}
+        link.window[seq] = entry
+        link.sent += 1
+        self.send_raw(port, entry['frame'], prio)
+
+    def _retransmit(self, port, link, seq, fast=False):
+        entry = link.window[seq]
+        entry['retries'] += 1
+        entry['sent_at'] = time.monotonic()
+        if fast:
+            link.fast += 1
+        else:
+            link.retransmits += 1
+        # 重传帧提到控制优先级，尽快填补接收方窗口中的空洞
+        self.send_raw(port, entry['frame'], min(entry['prio'], PRIO_CONTROL))
+
+    def _on_ack(self, port, link, epoch, cum, bitmap):
+        if epoch != link.epoch:
+            return
+        now = time.monotonic()
+        span = (cum - link.base) & 0xFF
+        if span > self.window:
+            span = 0  # 过时的 ACK，只看 BITMAP
+        for seq in list(link.window):
+            if ((seq - link.base) & 0xFF) >= span:
+                bit = (seq - cum - 1) & 0xFF
+                if bit >= BITMAP_BITS or not (bitmap >> bit) & 1:
+                    continue
+            entry = link.window.pop(seq)
+            link.acked += 1
+            if entry['retries'] == 0:
+                self._update_rtt(link, now - entry['sent_at'])
+            elif link.srtt is not None:
+                # 有新帧被确认: 撤销指数退避 (RFC 6298 5.7)，否则持续丢包时 RTO 一直停在上限
+                link.rto = self._rto(link)
+
+        # 后续帧已到而 cum 缺失: 距上次发送超过一个 RTT 就立即重传，不等超时
+        if bitmap and cum in link.window:
+            if now - link.window[cum]['sent_at'] > (link.srtt or MIN_RTO):
+                self._retransmit(port, link, cum, fast=True)
+
+        while link.base != link.next_seq and link.base not in link.window:
+            link.base = (link.base + 1) & 0xFF
+        while link.backlog and not self._window_full(link):
+            self._admit(port, link, *link.backlog.popleft())
+
+    def _min_rto(self, port, link):
+        """重传超时下限: 往返各发送一次窗口与队列余量所需时间"""
+        baudrate = self.baudrate_of(port) if self.baudrate_of else None
+        if not baudrate:
+            return MIN_RTO
+        pending = sum(len(e['frame']) for e in link.window.values()) + QUEUE_ALLOWANCE
+        return MIN_RTO + 2 * pending * 10 / baudrate
+
+    def _update_rtt(self, link, sample):
+        if link.srtt is None:
+            link.srtt = sample
+            link.rttvar = sample / 2
+        else:
+            link.rttvar = 0.75 * link.rttvar + 0.25 * abs(link.srtt - sample)
+            link.srtt = 0.875 * link.srtt + 0.125 * sample
+        link.rto = self._rto(link)
+
+    def _rto(self, link):
+        return min(max(link.srtt + 4 * link.rttvar, MIN_RTO), MAX_RTO)
+
+    def _give_up(self, port, link):
+        """重传次数耗尽: 放弃窗口内的帧，更换 EPOCH 让接收方重新同步"""
+        Logger.warning(f"[{port}] 逐跳重传失败 {len(link.window)} 帧，重置链路序号")
+        link.lost += len(link.window)
+        link.resets += 1
+        link.window.clear()
+        epoch = link.epoch
+        while link.epoch == epoch:
+            link.epoch = random.randint(1, 255)
+        link.base = link.next_seq = 0
+        link.rto = INITIAL_RTO
+        while link.backlog and not self._window_full(link):
+            self._admit(port, link, *link.backlog.popleft())
+
+    def _run(self):
+        """重传定时器"""
+        while self.running:
+            time.sleep(TICK)
+            now = time.monotonic()
+            with self.lock:
+                for port, link in list(self.links.items()):
+                    rto = max(link.rto, self._min_rto(port, link))
+                    expired = [seq for seq, e in link.window.items() if now - e['sent_at'] > rto]
+                    if not expired:
+                        continue
+                    if any(link.window[seq]['retries'] >= MAX_RETRIES for seq in expired):
+                        self._give_up(port, link)
+                        continue
+                    link.rto = min(link.rto * 2, MAX_RTO)  # 指数退避
+                    for seq in expired:
+                        self._retransmit(port, link, seq)
+
+    # --- 接收方 ---
+
+    def _on_data(self, link, epoch, seq, body):
+        if epoch != link.rx_epoch:
+            # 对端换了会话 (重启或放弃重传) 从序号 0 重新开始；本端状态刚建立 (如误码的 HELLO
+            # 使 ARQ 被短暂停用) 时对端仍在原会话中，直接同步到当前序号
+            link.expected = 0 if link.rx_epoch is not None else seq
+            link.rx_epoch = epoch
+            link.rx_buf.clear()
+        offset = (seq - link.expected) & 0xFF
+        if offset >= self.window or seq in link.rx_buf:
+            link.dup += 1  # 已交付过的帧 (ACK 丢失后的重传)，仍需再次确认
+            return []
+        link.rx_buf[seq] = body
+        if offset:
+            link.reordered += 1
+        out = []
+        while link.expected in link.rx_buf:
+            out.append(link.rx_buf.pop(link.expected))
+            link.expected = (link.expected + 1) & 0xFF
+        link.delivered += len(out)
+        return out
+
+    def _send_ack(self, port, link):
+        bitmap = 0
+        for i in range(BITMAP_BITS):
+            if ((link.expected + 1 + i) & 0xFF) in link.rx_buf:
+                bitmap |= 1 << i
+        frame = _seal(KIND_ACK, link.expected, link.rx_epoch, bitmap.to_bytes(BITMAP_BITS // 8, 'big'))
+        self.send_raw(port, frame, PRIO_HELLO)
+
+
+def format_arq_stats(arq):
+    """将各端口 ARQ 统计格式化为表格行 (list of str)"""
+    lines = [f"{'Port':<15} {'Sent':<8} {'Retx':<8} {'Fast':<6} {'Lost':<6} {'Deliv':<8} "
+             f"{'Reord':<6} {'Dup':<6} {'CRC':<6} {'RTO ms':<8} {'SRTT ms':<8}"]
+    lines.append("-" * 96)
+    with arq.lock:
+        for port, l in arq.links.items():
+            srtt = f"{l.srtt * 1000:.1f}" if l.srtt is not None else "-"
+            lines.append(f"{port:<15} {l.sent:<8} {l.retransmits:<8} {l.fast:<6} {l.lost:<6} {l.delivered:<8} "
+                         f"{l.reordered:<6} {l.dup:<6} {l.crc_errors:<6} {l.rto * 1000:<8.0f} {srtt:<8}")
+    return lines
@@ -1,32 +1,196 @@
+import atexit
+import json
+import os
 import serial
 import serial.tools.list_ports
 import sys
 import time
+import threading
+from collections import deque
+
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'SUCCESS': 25, 'WARNING': 30, 'ERROR': 40, 'OFF': 100}
+
 
 class Logger:
     """
-    简单的日志工具，用于统一输出格式
+    分级异步日志，统一输出格式 ([LEVEL] 消息)
+    - 调用方只把记录放入有界环形队列 (不格式化、不写 stdout)，由后台线程批量格式化并一次写出；
+      stdout 慢 (终端滚动、管道阻塞) 时队列满后丢弃新记录并计数，调用方永远不会被阻塞
+    - 延迟格式化: Logger.info("[转发] %s->%s", a, b) 的 % 格式化在后台线程中进行，
+      低于当前级别的记录直接返回，连参数都不格式化
+    - 级别: 全局默认 INFO，可按模块 (源文件名，如 router、linkarq) 单独设置，见 configure()
+    - 控制台输出 (命令结果、表格、提示符) 用 console() 放入同一队列，与日志保持先后顺序且不阻塞；
+      等待键盘输入用 input()，先写完队列再显示提示
+    - 进程退出时 (atexit) 写出队列中剩余的记录
     """
+    capacity = 4096          # 队列上限 (条)
+    level = LOG_LEVELS['INFO']
+    module_levels = {}       # 模块名 -> 级别
+    _modules = {}            # 源文件路径 -> 模块名 (缓存)
+    dropped = 0              # 队列满被丢弃的记录数 (累计)
+    enqueued = 0
+    written = 0
+    _queue = deque()
+    _lock = threading.Lock()
+    _wakeup = threading.Event()
+    _written = threading.Condition(_lock)
+    _thread = None
+    _reported = 0            # 已在输出中提示过的丢弃数
+
+    @staticmethod
+    def info(msg, *args):
+        Logger.log(LOG_LEVELS['INFO'], 'INFO', msg, args)
+
+    @staticmethod
+    def error(msg, *args):
+        Logger.log(LOG_LEVELS['ERROR'], 'ERROR', msg, args)
+
+    @staticmethod
+    def debug(msg, *args):
+        Logger.log(LOG_LEVELS['DEBUG'], 'DEBUG', msg, args)
+
+    @staticmethod
+    def success(msg, *args):
+        Logger.log(LOG_LEVELS['SUCCESS'], 'SUCCESS', msg, args)
+
+    @staticmethod
+    def warning(msg, *args):
+        Logger.log(LOG_LEVELS['WARNING'], 'WARNING', msg, args)
+
+    @staticmethod
+    def console(text='', end='\n'):
+        """原样输出一段文本 (不加级别前缀，不受日志级别限制)，代替直接 print 以免与日志错位"""
+        with Logger._lock:
+            if len(Logger._queue) >= Logger.capacity:
+                Logger.dropped += 1
+                return
+            Logger._queue.append((None, text + end, ()))
+            Logger.enqueued += 1
+            if Logger._thread is None:
+                Logger._start()
+        if not Logger._wakeup.is_set():
+            Logger._wakeup.set()
+
+    @staticmethod
+    def input(text=''):
+        """交互输入: 先写出排队中的日志和控制台输出，避免提示符与日志错位"""
+        Logger.flush()
+        return input(text)
+
     @staticmethod
-    def info(msg):
-        print(f"[INFO] {msg}")
+    def log(level, name, msg, args=()):
+        if Logger.module_levels:
+            filename = sys._getframe(2).f_code.co_filename
+            module = Logger._modules.get(filename)
+            if module is None:
+                module = Logger._modules[filename] = os.path.splitext(os.path.basename(filename))[0]
+            if level < Logger.module_levels.get(module, Logger.level):
+                return
+        elif level < Logger.level:
+            return
+        with Logger._lock:
+            if len(Logger._queue) >= Logger.capacity:
+                Logger.dropped += 1
+                return
+            Logger._queue.append((name, msg, args))
+            Logger.enqueued += 1
+            if Logger._thread is None:
+                Logger._start()
+        if not Logger._wakeup.is_set():
+            Logger._wakeup.set()
 
     @staticmethod
-    def error(msg):
-        print(f"[ERROR] {msg}")
+    def configure(spec):
+        """
+        按字符串设置级别: "INFO" 或 "WARNING,router=DEBUG,linkarq=ERROR" (不带模块名的一项为全局级别)
+        :raises ValueError: 级别名无效
+        """
+        levels = {}
+        for item in str(spec).split(','):
+            item = item.strip()
+            if not item:
+                continue
+            module, _, name = item.rpartition('=')
+            if name.upper() not in LOG_LEVELS:
+                raise ValueError(f"未知日志级别 {name}，可选: {', '.join(LOG_LEVELS)}")
+            if module:
+                levels[module.strip()] = LOG_LEVELS[name.upper()]
+            else:
+                Logger.level = LOG_LEVELS[name.upper()]
+        Logger.module_levels = levels
 
     @staticmethod
-    def debug(msg):
-        # 可以在这里控制是否显示调试信息
-        print(f"[DEBUG] {msg}")
+    def flush(timeout=2.0):
+        """等待此前放入队列的记录全部写出 (需要与 print / input 提示保持先后顺序时调用)"""
+        if Logger._thread is None or threading.current_thread() is Logger._thread:
+            return
+        with Logger._lock:
+            target = Logger.enqueued
+            Logger._written.wait_for(lambda: Logger.written >= target, timeout)
 
     @staticmethod
-    def success(msg):
-        print(f"[SUCCESS] {msg}")
+    def stats():
+        with Logger._lock:
+            return {'queued': len(Logger._queue), 'written': Logger.written, 'dropped': Logger.dropped}
 
     @staticmethod
-    def warning(msg):
-        print(f"[WARNING] {msg}")
+    def _start():
+        """在锁内调用: 启动后台写线程 (首次记录时)"""
+        Logger._thread = threading.Thread(target=Logger._drain_loop, name='logger', daemon=True)
+        Logger._thread.start()
+
+    @staticmethod
+    def _after_fork():
+        """fork 出的子进程中没有写线程: 重置状态 (父进程未写出的记录由父进程负责)，下一条记录时重新启动"""
+        Logger._queue = deque()
+        Logger._lock = threading.Lock()
+        Logger._wakeup = threading.Event()
+        Logger._written = threading.Condition(Logger._lock)
+        Logger._thread = None
+
+    @staticmethod
+    def _drain_loop():
+        while True:
+            Logger._wakeup.wait()
+            Logger._wakeup.clear()
+            Logger._drain()
+
+    @staticmethod
+    def _drain():
+        """取出队列中全部记录，格式化后一次写出"""
+        with Logger._lock:
+            records = list(Logger._queue)
+            Logger._queue.clear()
+            dropped = Logger.dropped - Logger._reported
+            Logger._reported = Logger.dropped
+        if not records and not dropped:
+            return
+        lines = []
+        if dropped:
+            lines.append(f"[WARNING] 日志输出跟不上，丢弃了 {dropped} 条记录\n")
+        for name, msg, args in records:
+            if name is None:
+                lines.append(msg)   # console(): 原样输出
+                continue
+            if args:
+                try:
+                    msg = msg % args
+                except (TypeError, ValueError):
+                    msg = f"{msg} {args!r}"
+            lines.append(f"[{name}] {msg}\n")
+        try:
+            sys.stdout.write(''.join(lines))
+            sys.stdout.flush()
+        except (OSError, ValueError, AttributeError):
+            pass   # stdout 已关闭 (退出过程中) 或被替换为不可写对象
+        with Logger._lock:
+            Logger.written += len(records)
+            Logger._written.notify_all()
+
+
+atexit.register(Logger.flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=Logger._after_fork)
 
 
 def get_available_ports():
@@ -50,20 +214,20 @@ def select_serial_port(prompt="请选择串口", allow_refresh=True):
             Logger.warning("未检测到可用的串口设备。")
             if not allow_refresh:
                 return None
-            choice = input("按 Enter 刷新，输入 'q' 退出: ").strip().lower()
+            choice = Logger.input("按 Enter 刷新，输入 'q' 退出: ").strip().lower()
             if choice == 'q':
                 return None
             continue
 
-        print(f"\n--- {prompt} ---")
+        Logger.console(f"\n--- {prompt} ---")
         for idx, port in enumerate(ports):
-            print(f"[{idx + 1}] {port.device} ({port.description})")
+            Logger.console(f"[{idx + 1}] {port.device} ({port.description})")
         
         if allow_refresh:
-            print("[r] 刷新列表")
-        print("[q] 退出")
+            Logger.console("[r] 刷新列表")
+        Logger.console("[q] 退出")
 
-        choice = input("请输入序号选择: ").strip().lower()
+        choice = Logger.input("请输入序号选择: ").strip().lower()
 
         if choice == 'q':
             return None
@@ -95,22 +259,22 @@ def select_multiple_ports(prompt="请选择串口 (多选)", allow_refresh=True)
             Logger.warning("未检测到可用的串口设备。")
             if not allow_refresh:
                 return []
-            choice = input("按 Enter 刷新，输入 'q' 退出: ").strip().lower()
+            choice = Logger.input("按 Enter 刷新，输入 'q' 退出: ").strip().lower()
             if choice == 'q':
                 return []
             continue
 
-        print(f"\n--- {prompt} ---")
+        Logger.console(f"\n--- {prompt} ---")
         for idx, port in enumerate(ports):
-            print(f"[{idx + 1}] {port.device} ({port.description})")
+            Logger.console(f"[{idx + 1}] {port.device} ({port.description})")
         
-        print(f"[a] 全选 (All)")
+        Logger.console(f"[a] 全选 (All)")
         if allow_refresh:
-            print("[r] 刷新列表")
-        print("[q] 退出")
-        print("提示: 输入多个序号用逗号或空格分隔 (例如: 1,2)")
+            Logger.console("[r] 刷新列表")
+        Logger.console("[q] 退出")
+        Logger.console("提示: 输入多个序号用逗号或空格分隔 (例如: 1,2)")
 
-        choice = input("请输入: ").strip().lower()
+        choice = Logger.input("请输入: ").strip().lower()
 
         if choice == 'q':
             return []
@@ -147,45 +311,651 @@ def select_multiple_ports(prompt="请选择串口 (多选)", allow_refresh=True)
             Logger.error("输入格式错误，请输入数字序号。")
 
 
+# URL 协议 -> 端口工厂 (例如 virtual_serial.VirtualFabric 注册的 'vser')
+_port_factories = {}
+
+
+def register_port_factory(scheme, factory):
+    """
+    注册自定义端口类型: 之后 create_serial_connection("<scheme>://...") 将调用
+    factory(port_name, baudrate=..., bytesize=..., stopbits=..., parity=..., timeout=...)
+    """
+    _port_factories[scheme] = factory
+
+
 def create_serial_connection(port_name, baudrate=9600, timeout=1, 
                              bytesize=serial.EIGHTBITS, 
                              stopbits=serial.STOPBITS_ONE, 
                              parity=serial.PARITY_NONE):
     """
     创建并打开串口连接的工厂函数
+    port_name 可以是设备名 (COM3, /dev/ttyUSB0)，也可以是 URL:
+    已注册的自定义协议 (如 vser://A-0)，或 pyserial 支持的 loop:// / socket:// 等
     """
+    params = dict(baudrate=baudrate, bytesize=bytesize, stopbits=stopbits,
+                  parity=parity, timeout=timeout)
     try:
-        ser = serial.Serial(
-            port=port_name,
-            baudrate=baudrate,
-            bytesize=bytesize,
-            stopbits=stopbits,
-            parity=parity,
-            timeout=timeout
-        )
+        scheme = port_name.split('://', 1)[0] if '://' in port_name else None
+        if scheme in _port_factories:
+            ser = _port_factories[scheme](port_name, **params)
+        elif scheme:
+            ser = serial.serial_for_url(port_name, **params)
+        else:
+            ser = serial.Serial(port=port_name, **params)
         # Logger.success(f"串口 {port_name} 打开成功 (Baud: {baudrate})")
         return ser
-    except serial.SerialException as e:
+    except (serial.SerialException, ValueError) as e:
         Logger.error(f"无法打开串口 {port_name}: {e}")
         return None
 
+# 串口格式字符 -> pyserial 常量 (例如 "8N1")
+DATA_BITS = {'7': serial.SEVENBITS, '8': serial.EIGHTBITS}
+STOP_BITS = {'1': serial.STOPBITS_ONE, '2': serial.STOPBITS_TWO}
+PARITIES = {'N': serial.PARITY_NONE, 'E': serial.PARITY_EVEN, 'O': serial.PARITY_ODD}
+
+
 def choose_serial_format():
     """交互选择串口格式，返回 (bytesize, stopbits, parity, label)"""
-    data_map = {'7': serial.SEVENBITS, '8': serial.EIGHTBITS}
-    stop_map = {'1': serial.STOPBITS_ONE, '2': serial.STOPBITS_TWO}
-    parity_map = {'N': serial.PARITY_NONE, 'E': serial.PARITY_EVEN, 'O': serial.PARITY_ODD}
-
     def ask(prompt, mapping, default_key):
         while True:
-            val = input(prompt).strip().upper()
+            val = Logger.input(prompt).strip().upper()
             if not val:
                 val = default_key
             if val in mapping:
                 return mapping[val], val
-            print("[错误] 输入无效，请重试")
+            Logger.console("[错误] 输入无效，请重试")
 
-    data_bits, data_key = ask("请选择数据位 (7/8，默认8): ", data_map, '8')
-    stop_bits, stop_key = ask("请选择停止位 (1/2，默认1): ", stop_map, '1')
-    parity_val, parity_key = ask("请选择校验位 (N/E/O，默认N): ", parity_map, 'N')
+    data_bits, data_key = ask("请选择数据位 (7/8，默认8): ", DATA_BITS, '8')
+    stop_bits, stop_key = ask("请选择停止位 (1/2，默认1): ", STOP_BITS, '1')
+    parity_val, parity_key = ask("请选择校验位 (N/E/O，默认N): ", PARITIES, 'N')
     label = f"{data_key}{parity_key}{stop_key}"
     return data_bits, stop_bits, parity_val, label
+
+
+def parse_serial_format(label):
+    """
+    解析串口格式字符串 (数据位 校验位 停止位，例如 "8N1" / "7E2")
+    :return: (bytesize, stopbits, parity, label)，与 choose_serial_format 相同
+    """
+    label = str(label).strip().upper()
+    if len(label) != 3 or label[0] not in DATA_BITS or label[1] not in PARITIES or label[2] not in STOP_BITS:
+        raise ValueError(f"无效的串口格式: {label} (例如 8N1)")
+    return DATA_BITS[label[0]], STOP_BITS[label[2]], PARITIES[label[1]], label
+
+
+# === 非交互启动配置 ===
+# 命令行参数 -> (配置键, 类型)；list 表示逗号分隔的列表
+CONFIG_OPTIONS = {
+    '--id':       ('id', str),
+    '--ports':    ('ports', list),
+    '--baud':     ('baudrate', int),
+    '--format':   ('format', str),
+    '--hello':    ('hello_interval', float),
+    '--dv':       ('dv_interval', float),
+    '--timeout':  ('neighbor_timeout', float),
+    '--viz-url':  ('viz_url', str),
+    '--max-baud': ('max_baudrate', int),
+    '--fec':      ('fec', int),
+    '--capture':  ('capture', str),
+    '--capture-size': ('capture_size', float),
+    '--log-level': ('log_level', str),
+}
+# 无参数的开关 -> (配置键, 取值)
+CONFIG_FLAGS = {
+    '--no-viz':     ('report_viz', False),
+    '--no-console': ('console', False),
+    '--reactor':    ('reactor', True),
+    '--arq':        ('link_arq', True),
+}
+
+
+def read_config_file(path):
+    """读取 JSON 或 TOML (.toml, 需要 Python 3.11+ 或 tomli) 配置文件"""
+    if path.lower().endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("读取 TOML 需要 Python 3.11+ 或安装 tomli，也可以改用 JSON 配置")
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _option_value(args, option):
+    """取命令行选项后面的值，选项在末尾或后面紧跟另一个选项时抛出 ValueError"""
+    idx = args.index(option) + 1
+    if idx >= len(args) or args[idx].startswith('--'):
+        raise ValueError(f"{option} 缺少参数值")
+    return args[idx]
+
+
+def load_node_config(argv=None, required=('id', 'ports')):
+    """
+    读取非交互启动配置: --config <file.json|file.toml> 与命令行参数 (命令行优先)
+        python router.py --id A --ports /dev/ttyUSB0,/dev/ttyUSB1 --baud 115200 --format 8N1
+        python router.py --config node_a.toml --no-console
+    支持的键: id, ports, baudrate, format, hello_interval, dv_interval, neighbor_timeout,
+              viz_url, report_viz, console, reactor, max_baudrate, link_arq,
+              fec (所有端口的 FEC 冗余度，或 {端口: 冗余度}),
+              capture (抓包环形文件路径，见 capture.py), capture_size (环形文件大小，MB),
+              log_level (日志级别，如 "INFO" 或 "WARNING,router=DEBUG"，读取配置时即生效)
+    只有给出 --config / --id / --ports 时才是非交互启动，此时检查 required 中的键；
+    否则其余选项 (--log-level、--capture、--baud 等) 叠加在交互选择之上:
+    返回的字典中 'interactive' 为 True，串口和ID仍由调用方交互选择
+    :return: 配置字典 (其中 'serial' 为 create_serial_connection 的参数)；
+             一个选项都没有给出时返回 None，由调用方走交互流程
+    :raises ValueError: 配置文件无法读取、选项缺少参数值或缺少必需的键
+    """
+    args = sys.argv[1:] if argv is None else argv
+    config = {}
+    if '--config' in args:
+        path = _option_value(args, '--config')
+        try:
+            config.update(read_config_file(path))
+        except (OSError, ValueError) as e:
+            raise ValueError(f"无法读取配置文件 {path}: {e}")
+
+    for option, (key, kind) in CONFIG_OPTIONS.items():
+        if option in args:
+            value = _option_value(args, option)
+            try:
+                config[key] = value if kind is list else kind(value)
+            except ValueError:
+                raise ValueError(f"{option} 的值无效: {value}")
+    for option, (key, value) in CONFIG_FLAGS.items():
+        if option in args:
+            config[key] = value
+    if not config:
+        return None
+    config['interactive'] = not any(option in args for option in ('--config', '--id', '--ports'))
+
+    if 'log_level' in config:
+        Logger.configure(config['log_level'])
+    if isinstance(config.get('ports'), str):
+        config['ports'] = [p.strip() for p in config['ports'].split(',') if p.strip()]
+    for key in () if config['interactive'] else required:
+        if not config.get(key):
+            raise ValueError(f"配置缺少 {key}")
+
+    params = {}
+    if 'baudrate' in config:
+        params['baudrate'] = int(config['baudrate'])
+    if 'format' in config:
+        params['bytesize'], params['stopbits'], params['parity'], config['format'] = parse_serial_format(config['format'])
+    config['serial'] = params
+    return config
+
+
+def configure_node(node, config):
+    """把配置中的串口参数与定时器应用到路由节点 (实验四/五/六)"""
+    node.serial_params = dict(config.get('serial', {}))
+    for key in ('hello_interval', 'dv_interval', 'neighbor_timeout', 'viz_url', 'max_baudrate', 'link_arq'):
+        if key in config:
+            setattr(node, key, config[key])
+    if config.get('reactor'):
+        node.use_reactor = True
+    if 'fec' in config:
+        node.fec_levels = config['fec']
+    if config.get('capture'):
+        node.capture_path = config['capture']
+        node.capture_size = config.get('capture_size')
+
+
+def wait_until_stopped(node):
+    """无命令行模式: 阻塞直到节点停止或 Ctrl+C"""
+    try:
+        while node.running:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        node.running = False
+
+
+class FrameBuffer:
+    """
+    增量分帧缓冲区 (替代 readline)
+    - read_from(): 一次读出串口中全部可用字节，追加到 bytearray
+    - frames(): 批量切出所有完整帧，不完整的尾部留到下一次读取
+    返回的帧是 memoryview 切片，由包处理函数各自解码一次 (decode_frame)
+
+    可选支持长度前缀的二进制帧 (见 wire.py): 以 magic 字节开头的帧按
+    frame_length(buf, pos) 给出的长度切分，其余按分隔符切分
+
+    可选 resync(buf, pos): 文本帧中间的 magic 字节处该回调返回真时，从该处重新同步 (前面的字节是
+    首部或分隔符被误码破坏的残帧)，否则残帧会一直吞到下一个分隔符，期间的二进制帧全部丢失。
+    文本负载本身可能含 magic 字节 (UTF-8)，判断条件由调用方给出 (见 wire.resync_check)，未给出时不重新同步
+
+    串口波特率改变 (速率协商) 时丢弃缓冲区中的半帧: 切换前后收到的乱码可能含有
+    magic 字节，按其伪造的长度等待会使后续正常帧长时间无法切出
+
+    tap: 可选回调 (抓包，见 capture.py)，对切出的每一帧调用一次，文本帧包含分隔符
+    """
+    def __init__(self, delimiter=b'\n', max_size=65536, magic=None, frame_length=None, tap=None, resync=None):
+        self.delimiter = delimiter
+        self.max_size = max_size   # 长时间凑不出完整帧时丢弃的上限，防止内存无限增长
+        self.magic = magic
+        self.frame_length = frame_length
+        self.resync = resync
+        self.tap = tap
+        self._buf = bytearray()
+        self._baudrate = None
+
+    def feed(self, data):
+        """追加新收到的字节"""
+        self._buf += data
+
+    def frames(self):
+        """切出当前缓冲区中所有完整帧"""
+        buf = self._buf
+        step = len(self.delimiter)
+        spans = []
+        pos = 0
+        while pos < len(buf):
+            if self.magic is not None and buf[pos] == self.magic:
+                length = self.frame_length(buf, pos)
+                if length is None:
+                    break           # 二进制帧不完整，等待后续数据
+                if length == 0:
+                    pos += 1        # 首部非法，跳过 magic 字节重新同步
+                    continue
+                spans.append((pos, pos + length))
+                pos += length
+            else:
+                idx = buf.find(self.delimiter, pos)
+                if self.resync is not None:
+                    start = self._find_header(buf, pos + 1, idx if idx >= 0 else len(buf))
+                    if start is not None:
+                        pos = start
+                        continue
+                if idx < 0:
+                    break
+                if idx > pos:
+                    spans.append((pos, idx))
+                pos = idx + step
+
+        if pos == 0:
+            if len(buf) > self.max_size:
+                buf.clear()
+            return []
+
+        # 每次读取突发只复制一次；memoryview 引用不可变的 bytes，缓冲区可继续安全修改
+        chunk = bytes(buf[:pos])
+        del buf[:pos]
+        view = memoryview(chunk)
+        if self.tap:
+            self._tap_frames(view, spans, step)
+        return [view[a:b] for a, b in spans]
+
+    def _tap_frames(self, view, spans, step):
+        for a, b in spans:
+            if (self.magic is None or view[a] != self.magic) and view[b:b + step] == self.delimiter:
+                b += step
+            self.tap(view[a:b])
+
+    def _find_header(self, buf, start, end):
+        """在 [start, end) 中查找第一个 resync 认可的 magic 字节"""
+        magic = bytes((self.magic,))
+        while True:
+            pos = buf.find(magic, start, end)
+            if pos < 0:
+                return None
+            if self.resync(buf, pos):
+                return pos
+            start = pos + 1
+
+    def read_from(self, ser):
+        """读取串口当前全部可用数据并返回完整帧 (无数据时阻塞至串口 timeout)"""
+        data = ser.read(ser.in_waiting or 1)
+        baudrate = getattr(ser, 'baudrate', None)
+        if baudrate != self._baudrate:
+            self._buf.clear()
+            self._baudrate = baudrate
+        if data:
+            self.feed(data)
+        return self.frames()
+
+
+def decode_frame(frame):
+    """将一帧 (memoryview/bytes/str) 解码为去除首尾空白的字符串"""
+    if isinstance(frame, str):
+        return frame.strip()
+    return str(frame, 'utf-8', 'ignore').strip()
+
+
+def bits_per_char(bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE):
+    """每个字符在线路上占用的比特数: 起始位 + 数据位 + 校验位 + 停止位"""
+    return 1 + bytesize + (0 if parity == serial.PARITY_NONE else 1) + stopbits
+
+
+class TokenBucket:
+    """
+    按比特速率限速的令牌桶 (线程安全)
+    速率和每字节开销由波特率与串口格式 (数据位/校验位/停止位) 推算，
+    发送方在写串口前先取令牌，令牌不足时阻塞等待，避免突发写入冲垮对端 UART FIFO
+    """
+    def __init__(self, baudrate, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE,
+                 stopbits=serial.STOPBITS_ONE, utilization=1.0, burst_bytes=16):
+        self.bits_per_byte = bits_per_char(bytesize, parity, stopbits)
+        self.rate_bps = baudrate * utilization       # 令牌速率 (比特/秒)
+        self.burst_bytes = burst_bytes               # 单次写入块大小 (默认常见 UART FIFO 深度)
+        self.capacity = burst_bytes * self.bits_per_byte
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_serial(cls, ser, **kwargs):
+        """根据已打开串口的波特率与格式创建令牌桶"""
+        return cls(ser.baudrate, ser.bytesize, ser.parity, ser.stopbits, **kwargs)
+
+    @property
+    def rate_bytes(self):
+        """配置的有效字节速率 (字节/秒)"""
+        return self.rate_bps / self.bits_per_byte
+
+    def consume(self, nbytes):
+        """取走 nbytes 字节所需的令牌，令牌不足时阻塞到足够为止"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate_bps)
+            self.last = now
+            self.tokens -= nbytes * self.bits_per_byte
+            wait = -self.tokens / self.rate_bps if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def paced_write(self, ser, data):
+        """按令牌桶速率分块写串口"""
+        view = memoryview(data)
+        for i in range(0, len(view), self.burst_bytes):
+            chunk = view[i:i + self.burst_bytes]
+            self.consume(len(chunk))
+            ser.write(chunk)
+
+
+# 发送优先级 (数值越小优先级越高，严格优先级调度)
+PRIO_HELLO   = 0   # 邻居发现: 被数据挤占会导致邻居误判超时
+PRIO_CONTROL = 1   # DV 路由通告 / 运输层 ACK
+PRIO_DATA    = 2   # 普通数据 (send / ping 等)
+PRIO_NAMES = ('HELLO', 'CTRL', 'DATA')
+
+
+class PortWriter:
+    """
+    串口发送队列 + 专用写线程 (每个端口一个)
+    - send(): 非阻塞入队，队列满时丢弃并计数；调用方 (监听线程/DV广播/用户输入) 不会被慢速串口阻塞
+    - 每个优先级一个独立有界队列，写线程严格按优先级取帧 (HELLO > DV/ACK > DATA)
+    - 写线程: 取出所有待发帧合并为一次 write() 调用，写完等待串口发送完毕 (flush)，
+      使链路上同一时刻只有一批数据在途，高优先级帧不会排在大量数据之后
+    - 可选 pacer (TokenBucket): 按线路速率分块限速写入，队列吸收突发而不是灌满对端 FIFO
+    - control(): 链路控制动作 (如速率协商)，排在所有队列之前执行，可在写完后切换波特率
+    - 可选 tap (抓包，见 capture.py): 写串口前对批次中的每一帧调用一次
+    """
+    def __init__(self, ser, name="", max_frames=(16, 64, 256), max_batch=512, on_error=None, pacer=None,
+                 tap=None):
+        self.ser = ser
+        self.name = name or getattr(ser, 'port', '')
+        self.queues = [deque() for _ in PRIO_NAMES]
+        self.max_frames = max_frames   # 各优先级队列长度上限
+        self.max_batch = max_batch     # 单次合并写入的最大字节数 (越小则高优先级帧等待越短)
+        self.on_error = on_error       # 写失败回调: on_error(name, exception)
+        self.pacer = pacer
+        self.tap = tap
+        self.running = True
+        self.cond = threading.Condition()
+        self.controls = deque()        # [(data, baudrate)]: 由写线程在批次之间执行
+
+        # 统计 (按优先级)
+        self.dropped = [0] * len(PRIO_NAMES)
+        self.sent_frames = [0] * len(PRIO_NAMES)
+        self.sent_bytes = 0
+        self.write_calls = 0
+        # 实测发送速率 (每秒滚动计算一次)
+        self.effective_rate = 0.0
+        self._rate_start = time.monotonic()
+        self._rate_bytes = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def send(self, data, prio=PRIO_DATA):
+        """入队一帧 (bytes)，成功返回 True，队列满或已关闭返回 False"""
+        with self.cond:
+            if not self.running:
+                return False
+            q = self.queues[prio]
+            if len(q) >= self.max_frames[prio]:
+                self.dropped[prio] += 1
+                return False
+            q.append(data)
+            self.cond.notify()
+            return True
+
+    def control(self, data=b'', baudrate=None):
+        """
+        控制动作 (不受队列上限限制): 在当前批次写完后、所有排队帧之前写出 data，
+        等待发送完毕后切换到 baudrate (为 None 时不切换)，并按新速率重建 pacer
+        """
+        with self.cond:
+            if not self.running:
+                return False
+            self.controls.append((data, baudrate))
+            self.cond.notify()
+            return True
+
+    def depth(self):
+        """当前排队帧数 (全部优先级)"""
+        with self.cond:
+            return sum(len(q) for q in self.queues)
+
+    def stats(self):
+        """统计快照"""
+        with self.cond:
+            return {
+                'depth': [len(q) for q in self.queues],
+                'dropped': list(self.dropped),
+                'frames': list(self.sent_frames),
+                'bytes': self.sent_bytes,
+                'writes': self.write_calls,
+                'rate': self.effective_rate,
+                'line_rate': self.pacer.rate_bytes if self.pacer else None,
+            }
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def _take_batch(self):
+        """按严格优先级取出一批帧，返回 [(prio, frame), ...]"""
+        batch = []
+        size = 0
+        for prio, q in enumerate(self.queues):
+            while q and (not batch or size + len(q[0]) <= self.max_batch):
+                frame = q.popleft()
+                batch.append((prio, frame))
+                size += len(frame)
+            if size >= self.max_batch:
+                break
+        return batch
+
+    def _apply_control(self, data, baudrate):
+        if data:
+            if self.tap:
+                self.tap(data)
+            if self.pacer:
+                self.pacer.paced_write(self.ser, data)
+            else:
+                self.ser.write(data)
+            self.ser.flush()
+        if baudrate and baudrate != self.ser.baudrate:
+            self.ser.baudrate = baudrate
+            if self.pacer:
+                self.pacer = TokenBucket.for_serial(self.ser)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not any(self.queues) and not self.controls:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                control = self.controls.popleft() if self.controls else None
+                batch = [] if control else self._take_batch()
+
+            data = b''.join(frame for _, frame in batch)
+            if self.tap:
+                for _, frame in batch:
+                    self.tap(frame)
+            try:
+                if control:
+                    self._apply_control(*control)
+                    continue
+                if self.pacer:
+                    self.pacer.paced_write(self.ser, data)
+                else:
+                    self.ser.write(data)
+                self.ser.flush()
+            except Exception as e:
+                with self.cond:
+                    self.running = False
+                if self.on_error:
+                    self.on_error(self.name, e)
+                else:
+                    Logger.error(f"[{self.name}] 发送错误: {e}")
+                return
+
+            with self.cond:
+                for prio, _ in batch:
+                    self.sent_frames[prio] += 1
+                self.sent_bytes += len(data)
+                self.write_calls += 1
+                self._update_rate(len(data))
+
+    def _update_rate(self, nbytes):
+        self._rate_bytes += nbytes
+        elapsed = time.monotonic() - self._rate_start
+        if elapsed >= 1.0:
+            self.effective_rate = self._rate_bytes / elapsed
+            self._rate_start += elapsed
+            self._rate_bytes = 0
+
+
+def format_port_stats(writers):
+    """将各端口 PortWriter 的统计格式化为表格行 (list of str)，按优先级显示 HELLO/CTRL/DATA"""
+    lines = [f"{'Port':<15} {'Queue H/C/D':<13} {'Dropped H/C/D':<15} {'Frames H/C/D':<20} {'Bytes':<10} {'Writes':<8} {'Rate B/s (line)':<16}"]
+    lines.append("-" * 102)
+    for port, writer in writers.items():
+        st = writer.stats()
+        queue_str = '/'.join(map(str, st['depth']))
+        drop_str = '/'.join(map(str, st['dropped']))
+        frame_str = '/'.join(map(str, st['frames']))
+        line_rate = f"{st['line_rate']:.0f}" if st['line_rate'] else "-"
+        rate_str = f"{st['rate']:.0f} ({line_rate})"
+        lines.append(f"{port:<15} {queue_str:<13} {drop_str:<15} {frame_str:<20} {st['bytes']:<10} {st['writes']:<8} {rate_str:<16}")
+    return lines
+
+
+class PortSupervisor:
+    """
+    串口热插拔恢复 (端口监督线程)
+    - 定期扫描 comports()，缓存设备集合并与上次结果做差分，只对变化做出反应
+    - 节点通过 mark_lost(port) 报告故障端口；设备重新出现后调用 reopen(port) 重新打开
+    - 无法枚举的端口 (URL、pty 等从未出现在扫描结果中) 直接按退避时间重试
+    - 重开失败按指数退避；扫描和重开都只在监督线程中进行，不阻塞收发/转发线程
+    """
+    def __init__(self, reopen, interval=1.0, idle_interval=10.0, min_backoff=0.5, max_backoff=30.0,
+                 lister=get_available_ports):
+        self.reopen = reopen               # reopen(port) -> bool: 重新打开并启动监听/写线程
+        self.interval = interval           # 有故障端口时的扫描间隔 (秒)
+        self.idle_interval = idle_interval # 没有故障端口时的扫描间隔 (秒)，仅用于保持缓存新鲜
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.lister = lister
+
+        self.present = frozenset()         # 最近一次扫描到的设备 (缓存)
+        self.seen = set()                  # 曾经出现在扫描结果中的设备
+        self.lost = {}                     # port -> {'next_try', 'backoff', 'attempts'}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.scans = 0
+        self.reopened = 0
+        self.failures = 0
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def mark_lost(self, port):
+        """报告端口故障 (可在任意线程调用，立即返回)"""
+        with self.lock:
+            if port not in self.lost:
+                self.lost[port] = {'next_try': time.monotonic() + self.min_backoff,
+                                   'backoff': self.min_backoff, 'attempts': 0}
+        self.wakeup.set()
+
+    def stats(self):
+        with self.lock:
+            lost = {p: dict(s) for p, s in self.lost.items()}
+        return {'present': sorted(self.present), 'lost': lost, 'scans': self.scans,
+                'reopened': self.reopened, 'failures': self.failures}
+
+    def scan(self):
+        """重新枚举串口并与缓存比较，返回 (新增设备, 消失设备)"""
+        try:
+            current = frozenset(p.device for p in self.lister())
+        except Exception as e:
+            Logger.warning(f"[PortSupervisor] 枚举串口失败: {e}")
+            return frozenset(), frozenset()
+        self.scans += 1
+        added, removed = current - self.present, self.present - current
+        self.present = current
+        self.seen |= current
+        return added, removed
+
+    def _run(self):
+        while self.running:
+            with self.lock:
+                has_lost = bool(self.lost)
+            self.wakeup.wait(self.interval if has_lost else self.idle_interval)
+            self.wakeup.clear()
+            if not self.running:
+                break
+
+            added, _ = self.scan()
+            now = time.monotonic()
+            with self.lock:
+                for port in added & self.lost.keys():
+                    # 设备重新出现: 立即重试，不再等待退避
+                    Logger.info(f"[PortSupervisor] {port} 重新出现")
+                    self.lost[port]['next_try'] = now
+                due = [p for p, s in self.lost.items()
+                       if now >= s['next_try'] and (p in self.present or p not in self.seen)]
+
+            for port in due:
+                ok = False
+                try:
+                    ok = self.reopen(port)
+                except Exception as e:
+                    Logger.error(f"[PortSupervisor] 重新打开 {port} 异常: {e}")
+                with self.lock:
+                    state = self.lost.get(port)
+                    if ok:
+                        self.lost.pop(port, None)
+                        self.reopened += 1
+                    elif state:
+                        self.failures += 1
+                        state['attempts'] += 1
+                        state['backoff'] = min(state['backoff'] * 2, self.max_backoff)
+                        state['next_try'] = time.monotonic() + state['backoff']
+                if ok:
+                    Logger.success(f"[PortSupervisor] {port} 已恢复")
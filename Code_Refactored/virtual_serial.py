@@ -0,0 +1,463 @@
+"""
+虚拟串口链路 (无需 USB-TTL 硬件即可搭建拓扑)
+
+两种端点:
+1. 内存端点 (VirtualSerial): 同一进程内成对连接，可替代 create_serial_connection 返回的 serial.Serial
+   fabric = VirtualFabric()
+   fabric.install()                                   # 注册 vser:// 协议
+   fabric.connect('A-0', 'B-0', latency=0.005, error_rate=1e-5)
+   ser = create_serial_connection('vser://A-0', timeout=0.1)
+2. pty 端点 (open_pty_link / PtyFabric): Linux/macOS 伪终端对，路径可交给其它进程按普通串口打开
+
+两种链路都支持:
+- 波特率限速: 每个方向按 波特率 与 串口格式 (起始/数据/校验/停止位) 计算发送时间，数据依次排队
+- 传播时延 latency (秒)
+- 字节错误率 error_rate: 每个字节以该概率翻转其中一个比特
+- 链路通断 set_up(False): 断开期间写入的数据全部丢失
+- 内存端点两端波特率不一致时收到乱码；超过 max_baudrate 时误码率升高 (用于测试速率协商)
+
+运行演示 (链状拓扑，单进程多节点):
+    python Code_Refactored/virtual_serial.py --nodes 50 --exp 4
+"""
+
+import heapq
+import itertools
+import math
+import os
+import random
+import selectors
+import sys
+import threading
+import time
+
+import serial
+
+from utils import Logger, bits_per_char, register_port_factory
+
+SCHEME = 'vser'
+OVERSPEED_ERROR_RATE = 0.05  # 超过链路 max_baudrate 时的字节错误率 (模拟线缆/适配器跟不上)
+
+
+class _Scheduler:
+    """按时间顺序投递数据的调度线程 (整个 fabric 共用一个)"""
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, when, callback, data):
+        with self.cond:
+            heapq.heappush(self.heap, (when, next(self.counter), callback, data))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.heap:
+                    self.cond.wait()
+                when, _, callback, data = self.heap[0]
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+            try:
+                callback(data)
+            except Exception as e:
+                Logger.error(f"[VirtualFabric] 投递失败: {e}")
+
+
+def corrupt(data, error_rate, rng=random):
+    """以 error_rate 的逐字节概率翻转随机比特 (几何分布跳跃，低误码率时开销很小)"""
+    if error_rate <= 0 or not data:
+        return data, 0
+    buf = bytearray(data)
+    errors = 0
+    log_q = math.log(1.0 - error_rate) if error_rate < 1 else None
+    pos = -1
+    while True:
+        if log_q is None:
+            pos += 1
+        else:
+            pos += 1 + int(math.log(1.0 - rng.random()) / log_q)
+        if pos >= len(buf):
+            break
+        buf[pos] ^= 1 << rng.randrange(8)
+        errors += 1
+    return bytes(buf), errors
+
+
+class _Direction:
+    """链路的一个方向: 维护线路忙碌时间，实现波特率限速 + 时延 + 误码"""
+    def __init__(self, link, deliver):
+        self.link = link
+        self.deliver = deliver
+        self.busy_until = 0.0
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def transmit(self, data, baudrate, bits):
+        """把 data 放到线路上，返回发送完毕的时间点"""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.busy_until)
+            if baudrate:
+                self.busy_until = start + len(data) * bits / baudrate
+            else:
+                self.busy_until = start
+            done = self.busy_until
+            if not self.link.up:
+                self.dropped += len(data)
+                return done
+            error_rate = self.link.error_rate
+            if self.link.max_baudrate and baudrate > self.link.max_baudrate:
+                error_rate = max(error_rate, OVERSPEED_ERROR_RATE)
+            data, errors = corrupt(data, error_rate, self.link.rng)
+            self.bytes += len(data)
+            self.errors += errors
+        self.link.scheduler.schedule(done + self.link.latency, self.deliver, data)
+        return done
+
+
+class VirtualLink:
+    """两个端点之间的全双工虚拟链路"""
+    def __init__(self, scheduler, baudrate=None, latency=0.0, error_rate=0.0, seed=None, max_baudrate=None):
+        self.scheduler = scheduler
+        self.baudrate = baudrate      # None 表示使用发送端串口自身的波特率
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_baudrate = max_baudrate  # 高于此速率时误码率升至 OVERSPEED_ERROR_RATE (None 表示不限)
+        self.rng = random.Random(seed)
+        self.up = True
+        self.forward = None   # a -> b
+        self.backward = None  # b -> a
+
+    def set_up(self, up):
+        """设置链路通断"""
+        self.up = up
+
+    def stats(self):
+        return {
+            'up': self.up,
+            'bytes': (self.forward.bytes, self.backward.bytes),
+            'errors': (self.forward.errors, self.backward.errors),
+            'dropped': (self.forward.dropped, self.backward.dropped),
+        }
+
+
+class VirtualSerial:
+    """
+    内存虚拟串口端点，实现节点用到的 serial.Serial 子集:
+    is_open / in_waiting / read / readline / write / flush / close / fileno
+    以及 baudrate / bytesize / parity / stopbits / timeout 属性
+    """
+    def __init__(self, name):
+        self.port = f"{SCHEME}://{name}"
+        self.name = name
+        self.baudrate = 9600
+        self.bytesize = serial.EIGHTBITS
+        self.parity = serial.PARITY_NONE
+        self.stopbits = serial.STOPBITS_ONE
+        self.timeout = None
+        self.is_open = False
+
+        self._tx = None   # _Direction
+        self._peer = None # 对端 VirtualSerial
+        self._rx = bytearray()
+        self._cond = threading.Condition()
+        self._pipe = None       # (r, w): 供 selectors 使用的可读通知
+        self._signaled = False
+
+    # --- 由 fabric 调用 ---
+    def _attach(self, direction, peer):
+        self._tx = direction
+        self._peer = peer
+
+    def _deliver(self, data):
+        with self._cond:
+            if not self.is_open:
+                return
+            self._rx += data
+            if self._pipe and not self._signaled:
+                os.write(self._pipe[1], b'\0')
+                self._signaled = True
+            self._cond.notify_all()
+
+    # --- serial.Serial 兼容接口 ---
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            return len(self._rx)
+
+    def fileno(self):
+        """返回一个可 select 的描述符: 有数据可读时可读"""
+        with self._cond:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                if self._rx:
+                    os.write(self._pipe[1], b'\0')
+                    self._signaled = True
+            return self._pipe[0]
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while not self._rx and self.is_open:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self.is_open:
+                raise serial.SerialException(f"{self.port} 已关闭")
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            if not self._rx and self._signaled:
+                os.read(self._pipe[0], 64)
+                self._signaled = False
+            return data
+
+    def readline(self):
+        line = bytearray()
+        while True:
+            c = self.read(1)
+            if not c:
+                return bytes(line)
+            line += c
+            if c == b'\n':
+                return bytes(line)
+
+    def write(self, data):
+        if not self.is_open:
+            raise serial.SerialException(f"{self.port} 已关闭")
+        data = bytes(data)
+        if self._peer.baudrate != self.baudrate:
+            # 两端波特率不一致: 接收端 UART 只能采样到乱码
+            rng = self._tx.link.rng
+            data = bytes(rng.getrandbits(8) for _ in data)
+        baudrate = self._tx.link.baudrate or self.baudrate
+        self._tx.transmit(data, baudrate, bits_per_char(self.bytesize, self.parity, self.stopbits))
+        return len(data)
+
+    def flush(self):
+        """等待已写入的数据在线路上发送完毕 (对应 tcdrain)"""
+        delay = self._tx.busy_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx.clear()
+
+
+class VirtualFabric:
+    """
+    进程内虚拟串口网络
+    - connect(a, b, ...): 创建一条链路，两端点名为 a 和 b
+    - install(): 注册 vser:// 协议，使 create_serial_connection('vser://a') 返回对应端点
+    """
+    def __init__(self, seed=None):
+        self.scheduler = _Scheduler()
+        self.endpoints = {}   # name -> VirtualSerial
+        self.links = {}       # (a, b) -> VirtualLink
+        self.seed = seed
+
+    def connect(self, name_a, name_b, baudrate=None, latency=0.0, error_rate=0.0, max_baudrate=None):
+        for name in (name_a, name_b):
+            if name in self.endpoints:
+                raise ValueError(f"端点 {name} 已存在")
+        seed = None if self.seed is None else f"{self.seed}:{name_a}:{name_b}"
+        link = VirtualLink(self.scheduler, baudrate, latency, error_rate, seed, max_baudrate)
+        a = VirtualSerial(name_a)
+        b = VirtualSerial(name_b)
+        link.forward = _Direction(link, b._deliver)
+        link.backward = _Direction(link, a._deliver)
+        a._attach(link.forward, b)
+        b._attach(link.backward, a)
+        self.endpoints[name_a] = a
+        self.endpoints[name_b] = b
+        self.links[(name_a, name_b)] = link
+        return link
+
+    def open(self, port_name, baudrate=9600, bytesize=serial.EIGHTBITS,
+             stopbits=serial.STOPBITS_ONE, parity=serial.PARITY_NONE, timeout=None):
+        """create_serial_connection 的工厂回调"""
+        name = port_name.split('://', 1)[-1]
+        ser = self.endpoints.get(name)
+        if ser is None:
+            raise serial.SerialException(f"虚拟端点 {name} 不存在")
+        if ser.is_open:
+            raise serial.SerialException(f"虚拟端点 {name} 已被占用")
+        ser.baudrate = baudrate
+        ser.bytesize = bytesize
+        ser.stopbits = stopbits
+        ser.parity = parity
+        ser.timeout = timeout
+        ser.open()
+        return ser
+
+    def install(self):
+        register_port_factory(SCHEME, self.open)
+        return self
+
+
+class PtyLink(VirtualLink):
+    """
+    基于伪终端对的链路 (仅 Linux/macOS)
+    path_a / path_b 是两个 pty 从设备路径，可在任意进程中按普通串口打开；
+    由 PtyFabric 的中继线程在两个主设备之间转发数据，并施加限速/时延/误码
+    """
+    def __init__(self, scheduler, baudrate=9600, latency=0.0, error_rate=0.0, seed=None):
+        import tty
+        super().__init__(scheduler, baudrate, latency, error_rate, seed)
+        self.masters = []
+        self.paths = []
+        self._slaves = []
+        for _ in range(2):
+            master, slave = os.openpty()
+            tty.setraw(slave)
+            os.set_blocking(master, False)
+            self.masters.append(master)
+            self._slaves.append(slave)   # 保持从设备打开，避免对端未打开时主设备读到 EIO
+            self.paths.append(os.ttyname(slave))
+        self.path_a, self.path_b = self.paths
+        self.forward = _Direction(self, lambda d: self._write_master(1, d))
+        self.backward = _Direction(self, lambda d: self._write_master(0, d))
+
+    def _write_master(self, idx, data):
+        """写入对端主设备；对端进程已退出、缓冲区写满时丢弃 (不能阻塞共用的调度线程)"""
+        direction = self.forward if idx == 1 else self.backward
+        try:
+            written = os.write(self.masters[idx], data)
+        except (BlockingIOError, OSError):
+            written = 0
+        if written < len(data):
+            direction.dropped += len(data) - written
+
+    def close(self):
+        for fd in self.masters + self._slaves:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class PtyFabric:
+    """
+    管理多条 pty 链路: 共用一个调度线程和一个中继线程 (selectors 等待所有主设备)，
+    可支撑上百条链路，供多进程拓扑仿真使用 (见 emulator.py)
+    """
+    def __init__(self, seed=None):
+        self.scheduler = _Scheduler()
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.links = []
+        self.seed = seed
+        self.running = True
+        threading.Thread(target=self._relay, daemon=True).start()
+
+    def connect(self, baudrate=9600, latency=0.0, error_rate=0.0):
+        """创建一条 pty 链路，返回 PtyLink (path_a / path_b 为两端设备路径)"""
+        seed = None if self.seed is None else f"{self.seed}:{len(self.links)}"
+        link = PtyLink(self.scheduler, baudrate, latency, error_rate, seed)
+        with self.lock:
+            self.selector.register(link.masters[0], selectors.EVENT_READ, (link, link.forward))
+            self.selector.register(link.masters[1], selectors.EVENT_READ, (link, link.backward))
+            self.links.append(link)
+        return link
+
+    def _relay(self):
+        bits = bits_per_char()
+        while self.running:
+            with self.lock:
+                has_links = bool(self.links)
+            if not has_links:
+                time.sleep(0.1)
+                continue
+            for key, _ in self.selector.select(0.5):
+                link, direction = key.data
+                try:
+                    data = os.read(key.fd, 4096)
+                except (BlockingIOError, OSError):
+                    continue
+                if data:
+                    direction.transmit(data, link.baudrate, bits)
+
+    def close(self):
+        self.running = False
+        for link in self.links:
+            link.close()
+
+
+def open_pty_link(baudrate=9600, latency=0.0, error_rate=0.0):
+    """创建一条独立的 pty 链路，返回 PtyLink (path_a / path_b 为两端设备路径)"""
+    return PtyFabric().connect(baudrate, latency, error_rate)
+
+
+def load_node_class(exp):
+    """按实验编号 ('4' / '5' / '6') 导入对应的节点类"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    if exp == '4':
+        sys.path.append(os.path.join(base, 'Experiment4'))
+        from router import RouterNode as NodeClass
+    elif exp == '5':
+        sys.path.append(os.path.join(base, 'Experiment5'))
+        from reliable_router import ReliableRouterNode as NodeClass
+    else:
+        sys.path.append(os.path.join(base, 'Experiment6'))
+        from network_app import NetworkNode as NodeClass
+    return NodeClass
+
+
+def _demo():
+    """链状拓扑演示: N 个节点通过虚拟链路串联，等待 DV 收敛"""
+    args = sys.argv[1:]
+    count = int(args[args.index('--nodes') + 1]) if '--nodes' in args else 5
+    exp = args[args.index('--exp') + 1] if '--exp' in args else '4'
+    NodeClass = load_node_class(exp)
+
+    fabric = VirtualFabric().install()
+    names = [f"N{i}" for i in range(count)]
+    ports = {n: [] for n in names}
+    for i in range(count - 1):
+        a, b = f"{names[i]}-r", f"{names[i + 1]}-l"
+        fabric.connect(a, b, latency=0.001)
+        ports[names[i]].append(f"{SCHEME}://{a}")
+        ports[names[i + 1]].append(f"{SCHEME}://{b}")
+
+    nodes = []
+    for name in names:
+        node = NodeClass()
+        if exp == '6':
+            node.bring_up(name, ports[name], report_viz=False)
+        else:
+            node.bring_up(name, ports[name])
+        nodes.append(node)
+
+    start = time.time()
+    while time.time() - start < 60 * 5:
+        time.sleep(1)
+        converged = all(
+            len([d for d, r in n.routing_table.items() if r['cost'] < 999]) == count for n in nodes)
+        if converged:
+            break
+    elapsed = time.time() - start
+    state = "收敛" if converged else "未收敛"
+    print(f"[VirtualFabric] {count} 个节点 {state}，用时 {elapsed:.1f}s")
+    for n in nodes:
+        n.running = False
+
+
+if __name__ == '__main__':
+    _demo()
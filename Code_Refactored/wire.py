@@ -0,0 +1,274 @@
+"""
+二进制帧格式 (与 '|' 文本协议并存，按链路协商)
+
+文本协议每一跳都要 f-string 拼接、UTF-8 编码、str.split 解析，且负载中的 '|' 有歧义。
+二进制帧使用 struct 打包的定长首部 + 长度前缀字段，负载可包含任意字符。
+
+帧结构 (网络字节序, 首部 8 字节):
+    MAGIC(1) | TYPE(1) | FLAGS(1) | TTL(1) | SRC_LEN(1) | DST_LEN(1) | PAYLOAD_LEN(2)
+    后接 SRC | DST | PAYLOAD
+
+协商方式:
+    HELLO 始终以文本发送，并在第三个字段携带能力列表: HELLO|SenderID|BIN,Z
+    旧节点只读取前两个字段，会忽略能力列表；只有对端声明了 BIN 的链路才发送二进制帧
+
+负载压缩 (能力 Z，仅二进制帧):
+    负载不短于 COMPRESS_THRESHOLD 且压缩后更短时，使用预置字典 (ZDICT) 的 raw deflate 压缩，
+    并在 FLAGS 中置 FLAG_COMPRESSED。低波特率链路上 DV 路由表 JSON 和重复的文本负载可明显缩短
+
+逐跳重传 (能力 ARQ，需同时支持 BIN): 见 linkarq.py
+前向纠错 (能力 FEC，需同时支持 BIN): 见 fec.py
+误码率测试 (能力 BER，需同时支持 BIN): 见 bert.py
+"""
+
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# 0xA5 在 UTF-8 中只能作为后续字节出现，不可能是文本帧的首字节，因此可无歧义地区分两种帧
+MAGIC = 0xA5
+HEADER = struct.Struct('!BBBBBBH')  # magic, type, flags, ttl, src_len, dst_len, payload_len
+MAX_PAYLOAD = 16384  # 超过此长度视为损坏的首部，丢弃 MAGIC 重新同步
+
+# 一字节类型码
+CODE_HELLO = 0x01
+CODE_DV    = 0x02
+CODE_DATA  = 0x03
+CODE_ICMP  = 0x04
+CODE_ARQ   = 0x05  # 逐跳可靠传输信封 (见 linkarq.py)，不是独立的数据包类型
+CODE_FEC   = 0x06  # 前向纠错信封 (见 fec.py)
+CODE_BERT  = 0x07  # 误码率测试帧 (见 bert.py)
+
+# 类型码 <-> 文本协议类型名
+CODE_NAMES = {
+    CODE_HELLO: 'HELLO',
+    CODE_DV:    'DV',
+    CODE_DATA:  'DATA',
+    CODE_ICMP:  'DATA',  # ICMP 是 DATA 负载中的子协议，解码后还原为 DATA|...|ICMP|...
+    CODE_ARQ:   'ARQ',
+    CODE_FEC:   'FEC',
+    CODE_BERT:  'BERT',
+}
+NAME_CODES = {'HELLO': CODE_HELLO, 'DV': CODE_DV, 'DATA': CODE_DATA}
+
+ICMP_PREFIX = 'ICMP|'
+
+# 能力协商
+CAP_BINARY = 'BIN'
+CAP_COMPRESS = 'Z'
+CAP_ARQ = 'ARQ'
+CAP_FEC = 'FEC'
+CAP_BERT = 'BER'
+CAP_SEPARATOR = ','
+
+# FLAGS 位
+FLAG_COMPRESSED = 0x01
+
+# 压缩参数
+COMPRESS_THRESHOLD = 48   # 负载短于此长度时不压缩 (收益抵不过 CPU 开销)
+COMPRESS_LEVEL = 6
+MAX_INFLATE = 4 * MAX_PAYLOAD  # 解压上限，防止损坏/恶意帧膨胀
+# 预置字典: deflate 可以直接引用其中的子串，对短帧效果远好于普通 zlib。
+# 越常见的片段放得越靠后 (距离越短，编码越省)
+ZDICT = (b'ECHO_REQ|ECHO_REP|TIME_EXC|ICMP|TRA|DAT|SYN|SAK|ACK|0|0|'
+         b'{"cost": 999}, "{"cost": 3}, "{"cost": 2}, "{"cost": 1}, "{"cost": 0}, "')
+
+# 解码结果 (与文本协议字段一一对应)
+Packet = namedtuple('Packet', ['p_type', 'src', 'dst', 'ttl', 'payload', 'flags'])
+
+
+def format_caps(caps):
+    """能力集合 -> HELLO 中的能力字段"""
+    return CAP_SEPARATOR.join(sorted(caps))
+
+
+def parse_caps(field):
+    """HELLO 中的能力字段 -> 能力集合"""
+    return {c for c in field.split(CAP_SEPARATOR) if c}
+
+
+def is_binary_frame(frame):
+    """判断一帧是否为二进制帧"""
+    return not isinstance(frame, str) and len(frame) > 0 and frame[0] == MAGIC
+
+
+# 信封 (ARQ/FEC) 的块参数
+FEC_BLOCK = 16      # 数据块长度 (字节)
+FEC_CRC = 2         # 每块校验 (CRC32 低 16 位)
+FEC_MAX_LEVEL = 16  # 每个校验块最多保护的数据块数
+
+
+def envelope_check(flags, ttl, payload_len):
+    """信封首部校验字节 (覆盖 FLAGS/TTL/LEN 三个字段)"""
+    return zlib.crc32(bytes((flags, ttl, payload_len >> 8, payload_len & 0xFF))) & 0xFF
+
+
+def frame_length(buf, pos=0):
+    """
+    供 FrameBuffer 使用: 计算从 pos 开始的二进制帧总长度
+    :return: 总长度；None 表示数据尚不完整；0 表示首部非法
+    """
+    if len(buf) - pos < HEADER.size:
+        return None
+    _, code, flags, _, src_len, dst_len, payload_len = HEADER.unpack_from(buf, pos)
+    if code not in CODE_NAMES or payload_len > MAX_PAYLOAD:
+        return 0
+    if code in (CODE_ARQ, CODE_FEC, CODE_BERT):
+        # 信封没有地址字段，SRC_LEN 位置是首部校验字节: 长度字段被误码改写时立即重新同步，
+        # 而不是按伪造的长度一直等待 (期间到达的帧全部被吞掉)
+        if dst_len or src_len != envelope_check(flags, buf[pos + 3], payload_len):
+            return 0
+        if code == CODE_ARQ and flags > 1 or code == CODE_BERT and flags > 0x0F:
+            return 0
+        if code == CODE_FEC and (not 1 <= flags <= FEC_MAX_LEVEL or buf[pos + 3] >= FEC_BLOCK
+                                 or not payload_len or (payload_len + buf[pos + 3]) % (FEC_BLOCK + FEC_CRC)):
+            return 0
+        src_len = 0
+    total = HEADER.size + src_len + dst_len + payload_len
+    if len(buf) - pos < total:
+        return None
+    return total
+
+
+def resync_check(binary_link):
+    """
+    供 FrameBuffer 的 resync 使用: 文本帧中间的 magic 字节只有在
+        - 该链路已协商二进制格式 (binary_link() 为真)，且
+        - 其后已收到完整首部，是带校验字节的信封 (ARQ/FEC/BERT) 且通过 frame_length 的校验
+    时才视为二进制帧的起点。UTF-8 文本常含 0xA5 (如 "好" = E5 A5 BD)，普通二进制首部没有校验，
+    不完整的首部更无法判断，据此重新同步会丢掉正常的文本帧
+    """
+    def check(buf, pos):
+        if not binary_link() or len(buf) - pos < HEADER.size:
+            return False
+        if buf[pos + 1] not in (CODE_ARQ, CODE_FEC, CODE_BERT):
+            return False
+        return frame_length(buf, pos) != 0
+    return check
+
+
+class CodecStats:
+    """单个端口的压缩统计: 压缩前后字节数与压缩/解压占用的 CPU 时间"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.raw_out = 0       # 参与压缩的负载原始字节
+        self.wire_out = 0      # 上述负载实际发送的字节
+        self.compressed = 0    # 压缩发送的帧数
+        self.skipped = 0       # 太短或压缩无收益而原样发送的帧数
+        self.raw_in = 0        # 解压后的字节
+        self.wire_in = 0       # 收到的压缩字节
+        self.cpu = 0.0         # 压缩+解压 CPU 时间 (秒)
+
+    def ratio(self):
+        """发送方向压缩比 (压缩后/压缩前)，无数据时为 None"""
+        with self.lock:
+            return self.wire_out / self.raw_out if self.raw_out else None
+
+
+def compress_payload(payload_b, stats=None):
+    """
+    尝试压缩负载
+    :return: (bytes, compressed)；太短或压缩后不更短时原样返回
+    """
+    if len(payload_b) < COMPRESS_THRESHOLD:
+        if stats:
+            with stats.lock:
+                stats.skipped += 1
+        return payload_b, False
+    start = time.thread_time()
+    comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15, zdict=ZDICT)
+    packed = comp.compress(payload_b) + comp.flush()
+    elapsed = time.thread_time() - start
+    useful = len(packed) < len(payload_b)
+    if stats:
+        with stats.lock:
+            stats.cpu += elapsed
+            stats.raw_out += len(payload_b)
+            stats.wire_out += len(packed) if useful else len(payload_b)
+            if useful:
+                stats.compressed += 1
+            else:
+                stats.skipped += 1
+    return (packed, True) if useful else (payload_b, False)
+
+
+def decompress_payload(data, stats=None):
+    """解压负载，数据损坏或超过 MAX_INFLATE 时抛出 zlib.error"""
+    start = time.thread_time()
+    decomp = zlib.decompressobj(-15, zdict=ZDICT)
+    raw = decomp.decompress(bytes(data), MAX_INFLATE)
+    if decomp.unconsumed_tail or not decomp.eof:
+        raise zlib.error("压缩负载不完整或过大")
+    if stats:
+        with stats.lock:
+            stats.cpu += time.thread_time() - start
+            stats.wire_in += len(data)
+            stats.raw_in += len(raw)
+    return raw
+
+
+def format_codec_stats(stats_by_port):
+    """将各端口 CodecStats 格式化为表格行 (list of str)"""
+    lines = [f"{'Port':<15} {'Ratio':<8} {'Raw Out':<10} {'Wire Out':<10} {'Z/Skip':<12} {'Wire In':<10} {'Raw In':<10} {'CPU ms':<8}"]
+    lines.append("-" * 88)
+    for port, st in stats_by_port.items():
+        ratio = st.ratio()
+        ratio_str = f"{ratio:.2f}" if ratio is not None else "-"
+        lines.append(f"{port:<15} {ratio_str:<8} {st.raw_out:<10} {st.wire_out:<10} "
+                     f"{f'{st.compressed}/{st.skipped}':<12} {st.wire_in:<10} {st.raw_in:<10} {st.cpu * 1000:<8.1f}")
+    return lines
+
+
+def encode_packet(p_type, src, dst='', payload='', ttl=0, flags=0, compress=False, stats=None):
+    """
+    将一个数据包编码为二进制帧 (bytes)
+    :param compress: 链路协商了 CAP_COMPRESS 时为 True，负载足够长且有收益时压缩
+    :param stats: 该端口的 CodecStats (可选)
+    """
+    code = NAME_CODES[p_type]
+    if code == CODE_DATA and payload.startswith(ICMP_PREFIX):
+        code = CODE_ICMP
+        payload = payload[len(ICMP_PREFIX):]
+
+    src_b = src.encode('utf-8')
+    dst_b = dst.encode('utf-8')
+    payload_b = payload if isinstance(payload, bytes) else payload.encode('utf-8')
+    if compress:
+        payload_b, packed = compress_payload(payload_b, stats)
+        if packed:
+            flags |= FLAG_COMPRESSED
+    if len(src_b) > 255 or len(dst_b) > 255 or len(payload_b) > MAX_PAYLOAD:
+        raise ValueError("字段过长，无法编码为二进制帧")
+
+    header = HEADER.pack(MAGIC, code, flags, ttl & 0xFF, len(src_b), len(dst_b), len(payload_b))
+    return b''.join((header, src_b, dst_b, payload_b))
+
+
+def decode_packet(frame, stats=None):
+    """
+    解码一个二进制帧 (memoryview/bytes)，压缩负载在此解压
+    :param stats: 接收端口的 CodecStats (可选)
+    :return: Packet；帧不完整、非法或解压失败时返回 None
+    """
+    if frame_length(frame) != len(frame):
+        return None
+    _, code, flags, ttl, src_len, dst_len, payload_len = HEADER.unpack_from(frame, 0)
+
+    pos = HEADER.size
+    src = str(frame[pos:pos + src_len], 'utf-8', 'ignore')
+    pos += src_len
+    dst = str(frame[pos:pos + dst_len], 'utf-8', 'ignore')
+    pos += dst_len
+    payload_b = frame[pos:pos + payload_len]
+    if flags & FLAG_COMPRESSED:
+        try:
+            payload_b = decompress_payload(payload_b, stats)
+        except zlib.error:
+            return None
+    payload = str(payload_b, 'utf-8', 'ignore')
+
+    if code == CODE_ICMP:
+        payload = ICMP_PREFIX + payload
+    return Packet(CODE_NAMES[code], src, dst, ttl, payload, flags)
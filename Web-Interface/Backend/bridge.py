@@ -7,26 +7,45 @@ import threading
 import time
 from typing import Callable
 
+import serial
+import serial.tools.list_ports
+
 # Add the Code directory to sys.path to import Experiment5
 # Assuming this file is in Web-Interface/Backend/
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
 # SWITCHED TO EXPERIMENT 5 FOR COMPATIBILITY WITH ORIGINAL CODE
 sys.path.append(os.path.join(PROJECT_ROOT, 'Code', 'Experiment5'))
+# Shared config loader (JSON/TOML file or CLI args) from the refactored code
+sys.path.append(os.path.join(PROJECT_ROOT, 'Code_Refactored'))
 
+import reliable_router
 from reliable_router import ReliableRouterNode
+from utils import load_node_config
 
 class WebNetworkNode(ReliableRouterNode):
-    def __init__(self, log_callback: Callable[[str], None], topo_callback: Callable[[dict], None]):
+    def __init__(self, log_callback: Callable[[str], None], topo_callback: Callable[[dict], None],
+                 config: dict = None):
         # Initialize parent specific variables (seq_num, ack_event, etc.)
         super().__init__()
         self.log_callback = log_callback
         self.topo_callback = topo_callback
+        # Startup config (utils.load_node_config): id/ports given -> skip the setup prompts,
+        # otherwise its timers / serial settings apply on top of the web console setup
+        self.config = config
         
         # Setup State
         self.setup_phase = 'ID' # ID -> PORTS -> READY
         self.selected_ports = []
         self.configured_event = threading.Event()
 
+    @classmethod
+    def from_args(cls, log_callback, topo_callback, argv=None):
+        """
+        Build from --config node.toml / --id A --ports COM3,COM4 (no id/ports -> setup via web console)
+        :raises ValueError: bad or incomplete config (see utils.load_node_config)
+        """
+        return cls(log_callback, topo_callback, load_node_config(argv))
+
     def log(self, *args, **kwargs):
         """Redirects print output to WebSocket"""
         sep = kwargs.get('sep', ' ')
@@ -50,31 +69,21 @@ class WebNetworkNode(ReliableRouterNode):
         self.log("Web Bridge for Experiment 5 (Reliable Transport)")
         self.log("="*40)
         
-        # Step 1: Detect Ports
-        import serial.tools.list_ports
-        self.available_ports = [p.device for p in serial.tools.list_ports.comports()]
-        
-        if not self.available_ports:
-            self.log("Warning: No Serial Ports Detected!")
-            self.log("You can strictly test logic, but no network IO will happen.")
+        if self.config:
+            self._apply_timers()
+        if self.config and not self.config['interactive']:
+            self._apply_config()
         else:
-            self.log(f"Detected Ports: {self.available_ports}")
+            self._interactive_setup()
 
-        # Step 2: Waiting for ID
-        self.log("\n[SETUP REQUIRED]")
-        self.log("Please enter this Node's ID (e.g., A, B, WEB):")
-        self.log("(Type in the command bar below)")
-        
-        self.setup_phase = 'ID'
-        
-        # Wait for configuration to complete
-        self.configured_event.wait()
-        
         # Step 3: Start Node Logic (Copied/Adapted from reliable_router.py start logic)
         self.log(f"Initializing Node {self.my_id} on ports {self.selected_ports}...")
         
         self.routing_table[self.my_id] = {'cost': 0, 'next_hop_port': 'LOCAL', 'next_hop_id': self.my_id}
         self.running = True
+        serial_params = {'baudrate': 9600}
+        if self.config:
+            serial_params.update(self.config.get('serial', {}))
 
         for p in self.selected_ports:
             try:
@@ -85,7 +94,7 @@ class WebNetworkNode(ReliableRouterNode):
                 # But parent start() does this inside itself.
                 # Since we overrode start(), we must do it manually.
                 
-                ser = serial.Serial(p, 9600, timeout=0.1)
+                ser = serial.Serial(p, timeout=0.1, **serial_params)
                 self.active_ports[p] = ser
                 self.port_locks[p] = threading.Lock()
                 threading.Thread(target=self._listen_port, args=(p,), daemon=True).start()
@@ -100,6 +109,43 @@ class WebNetworkNode(ReliableRouterNode):
 
         self.log("\n>>> System Ready. Waiting for commands...")
 
+    def _apply_timers(self):
+        """The original Experiment 5 code reads its timers from module constants"""
+        for key, const in (('hello_interval', 'HELLO_INTERVAL'), ('dv_interval', 'DV_INTERVAL'),
+                           ('neighbor_timeout', 'NEIGHBOR_TIMEOUT')):
+            if key in self.config:
+                setattr(reliable_router, const, self.config[key])
+
+    def _apply_config(self):
+        """Headless setup: ID and ports come from the config, no port enumeration"""
+        self.my_id = self.config['id']
+        self.selected_ports = list(self.config['ports'])
+        self.available_ports = self.selected_ports
+        self.setup_phase = 'READY'
+        self.configured_event.set()
+        self.log(f"Loaded config: ID={self.my_id} ports={self.selected_ports}")
+
+    def _interactive_setup(self):
+        """Detect ports, then wait for ID and port selection from the web console"""
+        # Step 1: Detect Ports
+        self.available_ports = [p.device for p in serial.tools.list_ports.comports()]
+        
+        if not self.available_ports:
+            self.log("Warning: No Serial Ports Detected!")
+            self.log("You can strictly test logic, but no network IO will happen.")
+        else:
+            self.log(f"Detected Ports: {self.available_ports}")
+
+        # Step 2: Waiting for ID
+        self.log("\n[SETUP REQUIRED]")
+        self.log("Please enter this Node's ID (e.g., A, B, WEB):")
+        self.log("(Type in the command bar below)")
+        
+        self.setup_phase = 'ID'
+        
+        # Wait for configuration to complete
+        self.configured_event.wait()
+
     def execute_command(self, cmd_str):
         """Handle inputs from the Web Console"""
         cmd_str = cmd_str.strip()
@@ -20,6 +20,8 @@ DIST_DIR = os.path.join(BASE_DIR, '../Frontend/dist')
 
 # Global Node Instance
 terminal_instance = None
+# Local serial bridge: argv after --bridge (--config / --id / --ports ...), None = disabled
+BRIDGE_ARGS = None
 active_websockets = []
 loop = None
 
@@ -71,6 +73,18 @@ async def lifespan(app: FastAPI):
     )
     print(f"TerminalSession Ready.")
 
+    if BRIDGE_ARGS is not None:
+        # Imported lazily: the bridge needs pyserial and the Experiment 5 sources
+        from bridge import WebNetworkNode
+        try:
+            bridge_node = WebNetworkNode.from_args(broadcast_log, broadcast_topo, BRIDGE_ARGS)
+        except ValueError as e:
+            print(f"Bridge config error: {e}")
+        else:
+            terminal_instance.bridge = bridge_node
+            threading.Thread(target=bridge_node.start, daemon=True).start()
+            print(f"Bridge node started.")
+
     # Start Manager Broadcast Task
     asyncio.create_task(periodic_topo_broadcast())
     
@@ -168,11 +182,18 @@ else:
 if __name__ == "__main__":
     import sys
     port = 8000
-    if len(sys.argv) > 1:
+    args = sys.argv[1:]
+    if args and not args[0].startswith('--'):
         try:
-            port = int(sys.argv[1])
+            port = int(args[0])
         except ValueError:
-            print(f"Invalid port: {sys.argv[1]}, using default 8000")
+            print(f"Invalid port: {args[0]}, using default 8000")
+        args = args[1:]
+    # main.py [port] --bridge [--config node.toml | --id A --ports COM3,COM4 ...]
+    if args and args[0] == '--bridge':
+        BRIDGE_ARGS = args[1:]
+    elif args:
+        print(f"Ignoring unknown arguments: {' '.join(args)}")
             
     print(f"Starting Backend on 0.0.0.0:{port}")
     print("Note: If accessing from another machine, ensure Windows Firewall allows python.exe")
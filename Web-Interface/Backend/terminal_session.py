@@ -12,6 +12,8 @@ class TerminalSession:
         self.log_callback = log_callback
         self.topo_callback = topo_callback
         self.line_buffer = ""
+        # Local serial node (bridge.WebNetworkNode), attached by main.py when started with --bridge
+        self.bridge = None
         
         # Initial greeting
         self.show_welcome()
@@ -50,6 +52,15 @@ class TerminalSession:
         
         parts = line.split(maxsplit=1)
         node_id = parts[0]
+
+        # Local bridge node: setup answers (ID / ports) while configuring, then '<ID> <cmd>'
+        if self.bridge:
+            if self.bridge.setup_phase != 'READY':
+                self.bridge.execute_command(line)
+                return
+            if node_id == self.bridge.my_id:
+                self.bridge.execute_command(parts[1] if len(parts) > 1 else '')
+                return
         
         # Check if node exists (async call wrap)
         # We can't await here directly as this is called from sync context usually, 